@@ -0,0 +1,329 @@
+# batch_edit.py
+#
+# Batched AI edit of several content fields – POST /api/update-fields.
+#
+# "Make the whole hero more playful" used to be one /api/update-field call
+# (prompt + completion + write) per field. Now one request:
+#
+#   {"project_id": ..., "instruction": "...", "paths": ["home.hero.headline", ...]}
+#   {"project_id": ..., "instruction": "...", "section": "hero"}   (id or path
+#                                                                  from sections_tree.json,
+#                                                                  else a capabilities key)
+#
+#   - a section expands to every field under its path that
+#     editor_capabilities.json marks "ai_edit": true
+#   - one prompt (editor_batch_prompt.txt) with the current value of every
+#     field → one completion → <update>{"changes": [...]}</update>
+#   - every change is checked against editor_capabilities.json: inside the
+#     requested fields, ai_edit allowed (per_item for list items), same type
+#     as the current value, same item count unless add_remove, locked item
+#     fields unchanged; the others are returned as "rejected"
+#   - the accepted changes are written in one JSON Patch (content_patch)
+
+from __future__ import annotations
+
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from build_service import get_value_by_path
+from content_patch import apply_content_changes, path_tokens
+from llm_cache import cached_completion
+from templates_config import TEMPLATES
+from update_parser import parse_update
+
+BASE_DIR = Path(__file__).resolve().parent
+PROMPT_PATH = BASE_DIR / "editor_batch_prompt.txt"
+EDIT_MODEL = "gpt-4.1-mini"
+MAX_FIELDS = 40
+
+PathTokens = Tuple[Any, ...]
+
+
+# ==========================================
+# Template editor files
+# ==========================================
+@lru_cache(maxsize=64)
+def _read_json(path: str, mtime: float) -> Optional[Any]:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except ValueError:
+        print(f"invalid JSON: {path}")
+        return None
+
+
+def _template_file_path(template_id: str, name: str) -> Optional[Path]:
+    template_conf = TEMPLATES.get(template_id)
+    if not template_conf:
+        return None
+    path = (BASE_DIR / template_conf["schema"]).parent / name
+    return path if path.exists() else None
+
+
+def _template_file(template_id: str, name: str) -> Optional[Any]:
+    path = _template_file_path(template_id, name)
+    if path is None:
+        return None
+    return _read_json(str(path), path.stat().st_mtime)
+
+
+def load_capabilities(template_id: str) -> Dict[str, Any]:
+    return _template_file(template_id, "editor_capabilities.json") or {}
+
+
+def section_path(template_id: str, section: str) -> str:
+    """
+    Section id ("hero") or path ("home.hero") from sections_tree.json → path.
+    ValueError("invalid_sections_tree") when the template has a tree that does not parse.
+    """
+    tree = _template_file(template_id, "sections_tree.json")
+    if tree is None and _template_file_path(template_id, "sections_tree.json") is not None:
+        raise ValueError("invalid_sections_tree")
+    if not isinstance(tree, dict):
+        tree = {}
+    for entry in tree.get("sections") or []:
+        if section in (entry.get("id"), entry.get("path")):
+            if entry.get("editable") is False:
+                raise ValueError("section_not_editable")
+            return entry.get("path") or section
+
+    # no sections_tree.json (or the section is not in it): a path as is, else
+    # a section id that is a second-level key of the capabilities ("hero" → "home.hero")
+    capabilities = load_capabilities(template_id)
+    if "." in section or section in capabilities:
+        return section
+    matches = [
+        f"{group}.{section}"
+        for group, node in capabilities.items()
+        if isinstance(node, dict) and not _is_leaf(node) and section in node
+    ]
+    return matches[0] if len(matches) == 1 else section
+
+
+# ==========================================
+# Capabilities
+# ==========================================
+def _is_leaf(node: Any) -> bool:
+    return isinstance(node, dict) and "ai_edit" in node
+
+
+def capability_for(capabilities: Dict[str, Any], tokens: PathTokens) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """(capability of the path, True if the path is one item of a list field)."""
+    node: Any = capabilities
+    item = False
+    for token in tokens:
+        if isinstance(token, int):
+            if not _is_leaf(node) or item:
+                return None, False
+            if isinstance(node.get("per_item"), dict):
+                node = node["per_item"]
+            else:
+                item = True
+            continue
+        if _is_leaf(node) or not isinstance(node, dict):
+            return None, False
+        node = node.get(token)
+        if node is None:
+            return None, False
+    return (node, item) if _is_leaf(node) else (None, False)
+
+
+def expand_fields(capabilities: Dict[str, Any], path: str) -> List[str]:
+    """Every ai_edit field at / under path."""
+    tokens = path_tokens(path)
+    node: Any = capabilities
+    for token in tokens:
+        node = node.get(token) if isinstance(node, dict) and not _is_leaf(node) else None
+        if node is None:
+            return []
+
+    fields: List[str] = []
+
+    def walk(current: Any, prefix: str) -> None:
+        if _is_leaf(current):
+            if current.get("ai_edit"):
+                fields.append(prefix)
+            return
+        if isinstance(current, dict):
+            for key, child in current.items():
+                walk(child, f"{prefix}.{key}" if prefix else key)
+
+    walk(node, path)
+    return fields
+
+
+def _in_scope(tokens: PathTokens, requested: List[PathTokens]) -> bool:
+    return any(tokens[:len(field)] == field for field in requested)
+
+
+def validate_change(
+    capabilities: Dict[str, Any],
+    content: Dict[str, Any],
+    requested: List[PathTokens],
+    path: str,
+    value: Any,
+    permission: str = "ai_edit",
+) -> Optional[str]:
+    """
+    None if the change may be applied, else the reason it is rejected.
+    permission: the capability flag that must be on – "ai_edit" for AI
+    changes, "inline_edit" for values typed in the editor.
+    """
+    tokens = path_tokens(path)
+    if not tokens or not _in_scope(tokens, requested):
+        return "out_of_scope"
+    capability, item = capability_for(capabilities, tokens)
+    if capability is None:
+        return "not_editable"
+    if not capability.get(permission):
+        return f"{permission}_disabled"
+    if value is None or value == "" or value == []:
+        return "empty_value"
+
+    current = get_value_by_path(content, path)
+    if current is None and (item or isinstance(tokens[-1], int)):
+        return "index_out_of_range"
+    if isinstance(current, dict):
+        return "not_editable"
+
+    if isinstance(current, list):
+        if not isinstance(value, list):
+            return "wrong_type"
+        if not capability.get("add_remove") and len(value) != len(current):
+            return "item_count_changed"
+        per_item = capability.get("per_item")
+        if isinstance(per_item, dict):
+            for new_item, old_item in zip(value, current):
+                if not isinstance(new_item, dict) or not isinstance(old_item, dict):
+                    return "wrong_type"
+                for key, item_capability in per_item.items():
+                    if not item_capability.get(permission) and new_item.get(key) != old_item.get(key):
+                        return f"locked_field:{key}"
+        return None
+
+    if isinstance(current, str) or current is None:
+        return None if isinstance(value, str) and value.strip() else "wrong_type"
+    return None if type(value) is type(current) else "wrong_type"
+
+
+# ==========================================
+# Batch edit
+# ==========================================
+def _prompt() -> str:
+    return PROMPT_PATH.read_text(encoding="utf-8")
+
+
+def batch_edit(
+    supabase,
+    client,
+    data: Dict[str, Any],
+    bypass_cache: bool = False,
+) -> Dict[str, Any]:
+    """
+    Run one batched AI edit. ValueError(<error code>) on a bad request,
+    LookupError("project_not_found"), ContentConflict if an edited field
+    was changed by another writer meanwhile.
+    """
+    project_id = data.get("project_id")
+    instruction = (data.get("instruction") or "").strip()
+    paths = data.get("paths")
+    section = data.get("section")
+
+    if not project_id:
+        raise ValueError("missing_project_id")
+    if not instruction:
+        raise ValueError("missing_instruction")
+    if not paths and not section:
+        raise ValueError("missing_paths_or_section")
+    if paths is not None and (not isinstance(paths, list) or not all(isinstance(p, str) for p in paths)):
+        raise ValueError("invalid_paths")
+
+    project = (
+        supabase.table("projects")
+        .select("*")
+        .eq("id", project_id)
+        .single()
+        .execute()
+        .data
+    )
+    if not project:
+        raise LookupError("project_not_found")
+
+    content = project.get("content_json")
+    if not isinstance(content, dict):
+        raise ValueError("invalid_content_json")
+    capabilities = load_capabilities(project.get("selected_template_id") or "")
+    if not capabilities:
+        raise ValueError("missing_editor_capabilities")
+
+    # ---- fields to edit
+    if paths:
+        fields = list(dict.fromkeys(paths))
+        for path in fields:
+            capability, _ = capability_for(capabilities, path_tokens(path))
+            if capability is None or not capability.get("ai_edit"):
+                raise ValueError(f"field_not_ai_editable:{path}")
+    else:
+        fields = expand_fields(capabilities, section_path(project["selected_template_id"], section))
+        if not fields:
+            raise ValueError("section_has_no_ai_fields")
+    if len(fields) > MAX_FIELDS:
+        raise ValueError("too_many_fields")
+
+    # ---- one prompt with all current values
+    fields_json = json.dumps(
+        [
+            {
+                "path": path,
+                "type": (capability_for(capabilities, path_tokens(path))[0] or {}).get("input_type"),
+                "current_value": get_value_by_path(content, path),
+            }
+            for path in fields
+        ],
+        ensure_ascii=False,
+        indent=2,
+    )
+    prompt = _prompt().replace("{{FIELDS_JSON}}", fields_json).replace("{{USER_MESSAGE}}", instruction)
+
+    assistant_text = cached_completion(
+        client,
+        model=EDIT_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        bypass=bypass_cache,
+        validate=lambda text: bool(parse_update(text, record=False).get("changes")),
+    )
+    changes = parse_update(assistant_text).get("changes")
+    if not isinstance(changes, list):
+        changes = []
+
+    # ---- validate every change, write the accepted ones together
+    requested = [path_tokens(path) for path in fields]
+    accepted: List[Dict[str, Any]] = []
+    rejected: List[Dict[str, Any]] = []
+    for change in changes:
+        if not isinstance(change, dict) or not isinstance(change.get("path"), str):
+            rejected.append({"change": change, "reason": "invalid_change"})
+            continue
+        reason = validate_change(capabilities, content, requested, change["path"], change.get("value"))
+        if reason:
+            rejected.append({"path": change["path"], "reason": reason})
+        else:
+            accepted.append({"path": change["path"], "value": change.get("value")})
+
+    if accepted:
+        # compare-and-swap on the version the prompt was built from (content_patch)
+        apply_content_changes(
+            project_id,
+            [(change["path"], change["value"]) for change in accepted],
+            base=content,
+            expected_version=project.get("content_version"),
+        )
+
+    return {
+        "status": "ok" if accepted else "no_valid_changes",
+        "fields": fields,
+        "changes": accepted,
+        "rejected": rejected,
+    }
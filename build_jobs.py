@@ -0,0 +1,140 @@
+# build_jobs.py
+#
+# Background queue for the initial site build (content_json generation).
+#
+# The chat turn that first picks a template used to run
+# generate_content_for_project inline – a large completion that held the web
+# worker for many seconds. The turn now only enqueues a job and returns:
+#
+#   - jobs run on a thread pool (SITEGYN_BUILD_WORKERS)
+#   - one job per project: submitting while a job of the same project is
+#     queued / running returns that job (dedupe)
+#   - GET /api/projects/<id>/build_status reads the job; ?wait=<seconds>
+#     long-polls until the job finishes (or the timeout passes)
+#   - a process that does not know the job (restart, another worker) falls
+#     back to the project row: content_json present → done, a template
+#     selected but no content yet → pending (keep polling)
+#
+# Finished jobs are kept for SITEGYN_BUILD_JOB_RETENTION seconds.
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+BUILD_WORKERS = int(os.getenv("SITEGYN_BUILD_WORKERS", "4"))
+JOB_RETENTION_SECONDS = float(os.getenv("SITEGYN_BUILD_JOB_RETENTION", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# no job in this process, but the project row says a build is expected
+PENDING = "pending"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class BuildJob:
+    def __init__(self, project_id: str, args: tuple):
+        self.job_id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.args = args
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.queued_at = _now()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.finished_monotonic: Optional[float] = None
+        self.done_event = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "project_id": self.project_id,
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class BuildJobQueue:
+    """
+    run(project_id, *args) does the build; it returns True on success
+    (False / an exception marks the job failed).
+    """
+
+    def __init__(self, run: Callable[..., bool], workers: int = BUILD_WORKERS):
+        self._run = run
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="site-build")
+        self._jobs: Dict[str, BuildJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, project_id: str, *args) -> BuildJob:
+        project_id = str(project_id)
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(project_id)
+            if job is not None and job.active:
+                return job
+            job = BuildJob(project_id, args)
+            self._jobs[project_id] = job
+        self._pool.submit(self._execute, job)
+        return job
+
+    def get(self, project_id: str) -> Optional[BuildJob]:
+        with self._lock:
+            return self._jobs.get(str(project_id))
+
+    def wait(self, project_id: str, timeout: float) -> Optional[BuildJob]:
+        job = self.get(project_id)
+        if job is not None and job.active and timeout > 0:
+            job.done_event.wait(timeout)
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def _execute(self, job: BuildJob) -> None:
+        job.status = RUNNING
+        job.started_at = _now()
+        try:
+            ok = self._run(job.project_id, *job.args)
+            job.status = DONE if ok else FAILED
+            if not ok:
+                job.error = "build_failed"
+        except Exception as e:
+            traceback.print_exc()
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.args = ()
+            job.finished_at = _now()
+            job.finished_monotonic = time.monotonic()
+            job.done_event.set()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for project_id in [
+            pid for pid, job in self._jobs.items()
+            if job.finished_monotonic is not None and now - job.finished_monotonic > JOB_RETENTION_SECONDS
+        ]:
+            del self._jobs[project_id]
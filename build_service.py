@@ -1,18 +1,18 @@
 import json
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Optional
-from supabase import create_client
+from typing import Any, Dict, List, Optional, Tuple, Union
 import os
 from bs4 import BeautifulSoup  # make sure beautifulsoup4 is installed
+from service_clients import get_supabase
 
 
 # ==========================================
 # Supabase client
 # ==========================================
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# shared pooled client (service_clients)
+supabase = get_supabase()
 
 
 # ==========================================
@@ -60,26 +60,91 @@ def _load_template_mapping(template_id: str) -> Dict[str, str]:
 # ==========================================
 # NEW: get_value_by_path – handles paths like "menu.pizzas[1].name"
 # ==========================================
-def get_value_by_path(data: Dict[str, Any], path: str) -> Any:
-    current = data
-    tokens = re.findall(r"[a-zA-Z0-9_]+|\[\d+\]", path)
+PathToken = Union[str, int]
+
+_MISSING = object()
 
-    for token in tokens:
+
+@lru_cache(maxsize=4096)
+def compile_path(path: str) -> Tuple[PathToken, ...]:
+    """
+    Tokenize a mapping path once: "menu.pizzas[1].name" -> ("menu", "pizzas", 1, "name").
+    Keys stay str, list indexes become int.
+    """
+    accessor = []
+    for token in re.findall(r"[a-zA-Z0-9_]+|\[\d+\]", path):
         if token.startswith("[") and token.endswith("]"):
-            index = int(token[1:-1])
-            if isinstance(current, list) and 0 <= index < len(current):
-                current = current[index]
-            else:
-                return None
+            accessor.append(int(token[1:-1]))
         else:
-            if isinstance(current, dict) and token in current:
-                current = current[token]
-            else:
-                return None
+            accessor.append(token)
+    return tuple(accessor)
 
+
+def _step(current: Any, token: PathToken) -> Any:
+    """One accessor step; _MISSING when the path does not exist."""
+    if token.__class__ is int:
+        if isinstance(current, list) and 0 <= token < len(current):
+            return current[token]
+        return _MISSING
+    if isinstance(current, dict) and token in current:
+        return current[token]
+    return _MISSING
+
+
+def get_value_by_path(data: Dict[str, Any], path: str) -> Any:
+    current = data
+    for token in compile_path(path):
+        current = _step(current, token)
+        if current is _MISSING:
+            return None
     return current
 
 
+class PathTrie:
+    """
+    Prefix trie of compiled mapping paths.
+
+    Paths like "offers.deals[0].name" / "offers.deals[0].price_text" share
+    their prefix, so resolve() walks content_json once and fills the value
+    of every path (None where the path is missing) – no tokenizing and no
+    repeated prefix descents per path.
+    """
+
+    __slots__ = ("size", "_root")
+
+    def __init__(self, paths: List[str]):
+        self.size = len(paths)
+        root: Dict[str, Any] = {"slots": [], "children": {}}
+        for index, path in enumerate(paths):
+            node = root
+            for token in compile_path(path):
+                node = node["children"].setdefault(token, {"slots": [], "children": {}})
+            node["slots"].append(index)
+        self._root = self._freeze(root)
+
+    @classmethod
+    def _freeze(cls, node: Dict[str, Any]) -> Tuple[Tuple[int, ...], Tuple[Tuple[PathToken, Any], ...]]:
+        return (
+            tuple(node["slots"]),
+            tuple((token, cls._freeze(child)) for token, child in node["children"].items()),
+        )
+
+    def resolve(self, data: Dict[str, Any]) -> List[Any]:
+        values: List[Any] = [None] * self.size
+        self._walk(self._root, data, values)
+        return values
+
+    @staticmethod
+    def _walk(node, current: Any, values: List[Any]) -> None:
+        slots, children = node
+        for index in slots:
+            values[index] = current
+        for token, child in children:
+            value = _step(current, token)
+            if value is not _MISSING:
+                PathTrie._walk(child, value, values)
+
+
 # ==========================================
 # inject_value_into_html – replaces innerText of an element by ID
 # ==========================================
@@ -108,8 +173,33 @@ def _render_template(html_source: str, project: Dict[str, Any], mapping: Dict[st
 # ==========================================
 # OPTIONAL static builder
 # ==========================================
-def build_site_for_project(project_id: str, output_dir: Optional[str] = None) -> Optional[str]:
-    project = _load_project_by_id(project_id)
+def write_file_atomic(path: Path, text: str) -> None:
+    """Write to a temp file next to `path` and rename it over – readers never see half a file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def build_site_for_project(
+    project_id: str,
+    output_dir: Optional[str] = None,
+    project: Optional[Dict[str, Any]] = None,
+) -> Optional[str]:
+    """
+    Render one project to HTML (and write <output_dir>/<project_id>.html).
+    `project` can be passed when the row is already loaded (bulk export),
+    otherwise it is read from Supabase.
+    """
+    # render_backends imports this module – import here to avoid the cycle
+    from render_backends import get_render_backend
+
+    if project is None:
+        project = _load_project_by_id(project_id)
     if not project:
         return None
 
@@ -117,14 +207,11 @@ def build_site_for_project(project_id: str, output_dir: Optional[str] = None) ->
     if not template_id:
         return None
 
-    template_path = _resolve_template_path(template_id)
-    mapping = _load_template_mapping(template_id)
-
-    html_source = template_path.read_text(encoding="utf-8")
-    rendered_html = _render_template(html_source, project, mapping)
+    rendered_html = get_render_backend().render(template_id, project.get("content_json") or {})
+    if rendered_html is None:
+        return None
 
     if output_dir:
-        output_path = Path(output_dir) / f"{project_id}.html"
-        output_path.write_text(rendered_html, encoding="utf-8")
+        write_file_atomic(Path(output_dir) / f"{project_id}.html", rendered_html)
 
     return rendered_html
@@ -0,0 +1,286 @@
+# chat_history.py
+#
+# Chat history window for /api/chat.
+#
+# Instead of resending the whole chat_messages table on every turn:
+#
+#   - the last turns are kept verbatim, newest first, until the token budget
+#     (SITEGYN_HISTORY_TOKEN_BUDGET) or SITEGYN_HISTORY_MAX_MESSAGES is hit
+#   - older turns are folded into a rolling per-project summary, stored on the
+#     project row (projects.chat_summary + projects.chat_summary_count = how
+#     many messages the summary already covers)
+#   - the summary is updated incrementally in a background thread: previous
+#     summary + the turns that just left the window → new summary
+#   - the summary (+ its count) is cached per project (LRU + TTL); the
+#     messages it does not cover yet are read from the table on every turn –
+#     a short tail, since everything older is summarized – so turns served by
+#     other workers are always in the window
+#   - messages still buffered in chat_writer are merged into what is read
+#
+# Schema:
+#   alter table projects add column chat_summary text;
+#   alter table projects add column chat_summary_count integer default 0;
+# Without these columns the window still works, it just never summarizes:
+# the first load that finds them missing turns summarizing off for the
+# process (no summary call per turn that could never be stored).
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from chat_writer import ChatMessageWriter, merge_pending
+
+try:
+    import tiktoken  # optional – without it tokens are estimated from characters
+except ImportError:
+    tiktoken = None
+
+TOKEN_BUDGET = int(os.getenv("SITEGYN_HISTORY_TOKEN_BUDGET", "3000"))
+MAX_MESSAGES = int(os.getenv("SITEGYN_HISTORY_MAX_MESSAGES", "20"))
+# summarize only once this many messages fell out of the window
+SUMMARY_MIN_BATCH = int(os.getenv("SITEGYN_HISTORY_SUMMARY_MIN_BATCH", "6"))
+CACHE_MAX_PROJECTS = int(os.getenv("SITEGYN_HISTORY_CACHE_MAX_PROJECTS", "2000"))
+CACHE_TTL_SECONDS = float(os.getenv("SITEGYN_HISTORY_CACHE_TTL", "300"))
+
+SUMMARY_MODEL = "gpt-4.1-mini"
+SUMMARY_COLUMN = "chat_summary"
+SUMMARY_COUNT_COLUMN = "chat_summary_count"
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a business owner "
+    "and Sitegyn, an assistant that builds their website.\n"
+    "Update the summary with the new messages below. Keep every business fact "
+    "(name, niche, services, prices, location, contact details, audience, tone, "
+    "design preferences) and every decision or open question. Drop small talk. "
+    "Answer with the updated summary only, as short bullet points.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages:\n{messages}"
+)
+
+_ENCODING = None
+if tiktoken is not None:
+    try:
+        _ENCODING = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    # ~4 characters per token for English, Hebrew is denser – stay on the safe side
+    return len(text) // 3 + 1
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    # + role / separators overhead of the chat format
+    return count_tokens(message.get("content") or "") + 4
+
+
+def _missing_summary_column(error: Exception) -> bool:
+    text = str(error)
+    return (SUMMARY_COLUMN in text or SUMMARY_COUNT_COLUMN in text) and (
+        "42703" in text or "PGRST204" in text or "does not exist" in text
+    )
+
+
+class ProjectHistory:
+    """Cached summary of one project + the messages not covered by it (as of the last turn)."""
+
+    __slots__ = ("summary", "summarized_count", "messages", "loaded_at", "summarizing", "lock")
+
+    def __init__(self, summary: str, summarized_count: int):
+        self.summary = summary
+        self.summarized_count = summarized_count
+        self.messages: List[Dict[str, str]] = []
+        self.loaded_at = time.monotonic()
+        self.summarizing = False
+        self.lock = threading.Lock()
+
+
+class ChatHistoryManager:
+    def __init__(
+        self,
+        supabase,
+        openai_client,
+        writer: Optional[ChatMessageWriter] = None,
+        token_budget: int = TOKEN_BUDGET,
+        max_messages: int = MAX_MESSAGES,
+        summary_min_batch: int = SUMMARY_MIN_BATCH,
+        max_projects: int = CACHE_MAX_PROJECTS,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+    ):
+        self.supabase = supabase
+        self.openai = openai_client
+        self.writer = writer
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.summary_min_batch = summary_min_batch
+        self.max_projects = max_projects
+        self.ttl_seconds = ttl_seconds
+        self._projects: "OrderedDict[str, ProjectHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+        self.summary_available = True
+        self.hits = 0
+        self.misses = 0
+        self.summaries = 0
+
+    # ---------- loading ----------
+    def _load(self, project_id: str) -> ProjectHistory:
+        summary, summarized_count = "", 0
+        if self.summary_available:
+            try:
+                row = (
+                    self.supabase.table("projects")
+                    .select(f"{SUMMARY_COLUMN}, {SUMMARY_COUNT_COLUMN}")
+                    .eq("id", project_id)
+                    .single()
+                    .execute()
+                    .data
+                ) or {}
+                summary = row.get(SUMMARY_COLUMN) or ""
+                summarized_count = int(row.get(SUMMARY_COUNT_COLUMN) or 0)
+            except Exception as e:
+                traceback.print_exc()
+                if _missing_summary_column(e):
+                    # columns not migrated yet – plain window, and no summary calls
+                    self.summary_available = False
+        return ProjectHistory(summary, summarized_count)
+
+    def _tail(self, project_id: str, summarized_count: int) -> List[Dict[str, str]]:
+        """The messages the summary does not cover, as stored now (+ rows still buffered)."""
+        # buffered rows first – see chat_writer.merge_pending
+        pending = self.writer.pending(str(project_id)) if self.writer else []
+
+        query = (
+            self.supabase.table("chat_messages")
+            .select("role, content")
+            .eq("project_id", project_id)
+            .order("created_at", desc=False)
+        )
+        if summarized_count:
+            # PostgREST needs an upper bound – large enough for any chat
+            query = query.range(summarized_count, summarized_count + 100000)
+        return merge_pending(query.execute().data or [], pending)
+
+    def _get(self, project_id: str) -> ProjectHistory:
+        project_id = str(project_id)
+        with self._lock:
+            history = self._projects.get(project_id)
+            if history is not None and time.monotonic() - history.loaded_at <= self.ttl_seconds:
+                self._projects.move_to_end(project_id)
+                self.hits += 1
+                return history
+            self.misses += 1
+
+        history = self._load(project_id)
+        with self._lock:
+            self._projects[project_id] = history
+            self._projects.move_to_end(project_id)
+            while len(self._projects) > self.max_projects:
+                self._projects.popitem(last=False)
+        return history
+
+    # ---------- public API ----------
+    def window(self, project_id: str) -> List[Dict[str, str]]:
+        """
+        History to send before the current user message:
+        [summary as a system message] + the newest turns that fit the budget.
+        """
+        history = self._get(project_id)
+        with history.lock:
+            offset = history.summarized_count
+        messages = self._tail(project_id, offset)
+
+        with history.lock:
+            # a summary finished while the tail was read – skip what it now covers
+            history.messages = messages[history.summarized_count - offset:]
+            budget = self.token_budget
+            summary_message = None
+            if history.summary:
+                summary_message = {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{history.summary}",
+                }
+                budget -= message_tokens(summary_message)
+
+            recent: List[Dict[str, str]] = []
+            for message in reversed(history.messages):
+                if len(recent) >= self.max_messages:
+                    break
+                cost = message_tokens(message)
+                if cost > budget:
+                    break
+                budget -= cost
+                recent.append({"role": message["role"], "content": message["content"]})
+            recent.reverse()
+
+            dropped = len(history.messages) - len(recent)
+            if dropped >= self.summary_min_batch and self.summary_available and not history.summarizing:
+                history.summarizing = True
+                self._summarizer.submit(self._summarize, str(project_id), history, dropped)
+
+        return ([summary_message] if summary_message else []) + recent
+
+    def invalidate(self, project_id: str) -> None:
+        with self._lock:
+            self._projects.pop(str(project_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "projects": len(self._projects),
+                "hits": self.hits,
+                "misses": self.misses,
+                "summaries": self.summaries,
+                "summary_available": self.summary_available,
+            }
+
+    # ---------- background summary ----------
+    def _summarize(self, project_id: str, history: ProjectHistory, count: int) -> None:
+        try:
+            with history.lock:
+                previous = history.summary
+                folded = history.messages[:count]
+                new_count = history.summarized_count + count
+
+            transcript = "\n".join(f"{m['role']}: {m['content']}" for m in folded)
+            completion = self.openai.chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[{
+                    "role": "user",
+                    "content": SUMMARY_PROMPT.format(summary=previous or "(none)", messages=transcript),
+                }],
+                temperature=0.0,
+            )
+            summary = (completion.choices[0].message.content or "").strip()
+            if not summary:
+                return
+
+            try:
+                self.supabase.table("projects").update({
+                    SUMMARY_COLUMN: summary,
+                    SUMMARY_COUNT_COLUMN: new_count,
+                }).eq("id", project_id).execute()
+            except Exception as e:
+                if _missing_summary_column(e):
+                    self.summary_available = False
+                raise
+
+            with history.lock:
+                history.summary = summary
+                history.summarized_count = new_count
+                del history.messages[:count]
+            with self._lock:
+                self.summaries += 1
+        except Exception:
+            traceback.print_exc()
+        finally:
+            history.summarizing = False
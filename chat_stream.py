@@ -0,0 +1,74 @@
+# chat_stream.py
+#
+# Helpers for streaming assistant replies over Server-Sent Events.
+#
+#   - UpdateBlockFilter hides <update>...</update> from the visible stream
+#     while the deltas arrive (the tags may be split over several deltas)
+#   - sse_event formats one SSE frame
+#
+# Events sent by /api/chat/stream:
+#   event: delta   data: {"text": "..."}                       visible text
+#   event: done    data: {"reply", "project_id", "subdomain"}  after the write
+#   event: error   data: {"error": "..."}
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List
+
+UPDATE_OPEN = "<update>"
+UPDATE_CLOSE = "</update>"
+
+
+def _partial_suffix(text: str, tag: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of tag."""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class UpdateBlockFilter:
+    """
+    feed(delta) returns the part of the stream that is safe to show:
+    text inside <update>...</update> is dropped, and a trailing "<upd" is
+    held back until the next delta shows whether it is the tag.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._inside = False
+
+    def feed(self, delta: str) -> str:
+        self._pending += delta
+        out: List[str] = []
+        while self._pending:
+            if self._inside:
+                end = self._pending.find(UPDATE_CLOSE)
+                if end == -1:
+                    keep = _partial_suffix(self._pending, UPDATE_CLOSE)
+                    self._pending = self._pending[len(self._pending) - keep:]
+                    break
+                self._pending = self._pending[end + len(UPDATE_CLOSE):]
+                self._inside = False
+            else:
+                start = self._pending.find(UPDATE_OPEN)
+                if start == -1:
+                    keep = _partial_suffix(self._pending, UPDATE_OPEN)
+                    out.append(self._pending[:len(self._pending) - keep])
+                    self._pending = self._pending[len(self._pending) - keep:]
+                    break
+                out.append(self._pending[:start])
+                self._pending = self._pending[start + len(UPDATE_OPEN):]
+                self._inside = True
+        return "".join(out)
+
+    def flush(self) -> str:
+        """End of stream – a held back partial tag was plain text after all."""
+        rest = "" if self._inside else self._pending
+        self._pending = ""
+        return rest
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
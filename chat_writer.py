@@ -0,0 +1,208 @@
+# chat_writer.py
+#
+# Write-behind buffer for chat_messages.
+#
+# /api/chat used to do two synchronous single-row inserts per turn on the
+# request path. Messages are now queued and a background thread writes them
+# as multi-row inserts:
+#
+#   - every SITEGYN_CHAT_FLUSH_INTERVAL seconds, or as soon as
+#     SITEGYN_CHAT_FLUSH_MAX_ROWS rows are waiting
+#   - rows keep their enqueue order; created_at is set here (strictly
+#     increasing), so rows of one batch still sort correctly by created_at
+#   - a failed batch is retried row by row: rows before the bad one are
+#     written, the bad row stays at the head and is retried next round; after
+#     SITEGYN_CHAT_MAX_ATTEMPTS failed attempts it is dead-lettered (kept in
+#     memory for inspection, dropped from the queue), so one bad row (e.g. an
+#     FK violation after the project was deleted) can't block every later
+#     insert
+#   - at most SITEGYN_CHAT_QUEUE_MAX rows wait; past that new rows are
+#     dropped (counted) instead of growing memory during a long outage
+#   - close() (registered with atexit) flushes whatever is left
+#
+# Read-your-writes: pending(project_id) returns the rows of a project that
+# are not in the table yet – chat_history merges them into what it reads,
+# so history never depends on the flush timing.
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import traceback
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("SITEGYN_CHAT_FLUSH_INTERVAL", "0.25"))
+FLUSH_MAX_ROWS = int(os.getenv("SITEGYN_CHAT_FLUSH_MAX_ROWS", "100"))
+MAX_ATTEMPTS = int(os.getenv("SITEGYN_CHAT_MAX_ATTEMPTS", "5"))
+QUEUE_MAX = int(os.getenv("SITEGYN_CHAT_QUEUE_MAX", "10000"))
+DEAD_LETTER_KEEP = 100
+
+
+class ChatMessageWriter:
+    def __init__(
+        self,
+        supabase,
+        flush_interval: float = FLUSH_INTERVAL_SECONDS,
+        max_rows: int = FLUSH_MAX_ROWS,
+        max_attempts: int = MAX_ATTEMPTS,
+        queue_max: int = QUEUE_MAX,
+    ):
+        self.supabase = supabase
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_attempts = max_attempts
+        self.queue_max = queue_max
+        self._queue: List[Dict[str, Any]] = []
+        # failed single-row attempts of the row at the head of the queue
+        self._head_attempts = 0
+        self.dead_letters: "deque[Dict[str, Any]]" = deque(maxlen=DEAD_LETTER_KEEP)
+        self._lock = threading.Lock()
+        # one flush at a time – keeps batches (and so per-project order) serial
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._last_created_at: Optional[datetime] = None
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------- API ----------
+    def enqueue(self, project_id: str, role: str, content: str) -> Dict[str, Any]:
+        with self._lock:
+            created_at = datetime.now(timezone.utc)
+            if self._last_created_at is not None and created_at <= self._last_created_at:
+                created_at = self._last_created_at + timedelta(microseconds=1)
+            self._last_created_at = created_at
+
+            row = {
+                "project_id": project_id,
+                "role": role,
+                "content": content,
+                "created_at": created_at.isoformat(),
+            }
+            if len(self._queue) >= self.queue_max:
+                self.dropped += 1
+                print(f"[chat_writer] queue full ({self.queue_max}) – message of {project_id} dropped")
+                return row
+            self._queue.append(row)
+            size = len(self._queue)
+
+        if size >= self.max_rows or self._closed:
+            self._wake.set()
+        return row
+
+    def pending(self, project_id: str) -> List[Dict[str, Any]]:
+        """Rows of the project that are queued / being written, oldest first."""
+        with self._lock:
+            return [dict(row) for row in self._queue if row["project_id"] == project_id]
+
+    def flush(self) -> int:
+        """Write everything queued right now; returns the number of rows written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._queue[: self.max_rows]
+                if not batch:
+                    return written
+                try:
+                    self.supabase.table("chat_messages").insert(batch).execute()
+                except Exception:
+                    traceback.print_exc()
+                    self.failures += 1
+                    rows_written, blocked = self._flush_rows(batch)
+                    written += rows_written
+                    if blocked:
+                        # the head row stays queued (and visible through pending()) – next round
+                        return written
+                    continue
+                self._pop_head(len(batch))
+                written += len(batch)
+                self.flushed_rows += len(batch)
+                self.flushes += 1
+
+    def _pop_head(self, count: int) -> None:
+        with self._lock:
+            # only the flushing thread removes rows, so the batch is still the head
+            del self._queue[:count]
+        self._head_attempts = 0
+
+    def _flush_rows(self, batch: List[Dict[str, Any]]) -> Tuple[int, bool]:
+        """
+        Batch insert failed → one row at a time, in order. Returns (rows written,
+        True if a row that is not dead yet failed and must be retried later).
+        """
+        written = 0
+        for row in batch:
+            try:
+                self.supabase.table("chat_messages").insert([row]).execute()
+            except Exception:
+                traceback.print_exc()
+                self._head_attempts += 1
+                if self._head_attempts < self.max_attempts:
+                    return written, True
+                print(f"[chat_writer] dead-lettering a message of {row['project_id']} after {self._head_attempts} attempts")
+                self.dead_letters.append(dict(row))
+                self.dead_lettered += 1
+                self._pop_head(1)
+                continue
+            self._pop_head(1)
+            written += 1
+            self.flushed_rows += 1
+        return written, False
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queued = len(self._queue)
+        return {
+            "queued": queued,
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "dead_lettered": self.dead_lettered,
+            "dropped": self.dropped,
+        }
+
+    # ---------- background thread ----------
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+
+def merge_pending(rows: List[Dict[str, Any]], pending: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    rows (read from the table) + pending rows that are not in it yet.
+    A row flushed between taking `pending` and reading `rows` shows up in
+    both – it is then the tail of rows and the head of pending.
+    """
+    def same(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        return a.get("role") == b.get("role") and a.get("content") == b.get("content")
+
+    overlap = 0
+    for size in range(min(len(rows), len(pending)), 0, -1):
+        if all(same(rows[len(rows) - size + i], pending[i]) for i in range(size)):
+            overlap = size
+            break
+    return rows + [{"role": row["role"], "content": row["content"]} for row in pending[overlap:]]
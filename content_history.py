@@ -0,0 +1,472 @@
+# content_history.py
+#
+# Undo / redo / restore for content_json – an append-only patch log.
+#
+# There was no undo in the editor (only hand-copied *_back_up files), and a
+# full content_json copy per edit would grow with every keystroke-sized
+# change. Instead every write of content_json appends one row per
+# content_version, in the same transaction as the write (the
+# apply_content_patch RPC inserts it – content_patch; the local store and
+# the RPC fallback call ContentHistoryLog.write):
+#
+#   forward   the operations of the write          (size of the edit)
+#   reverse   the operations that undo it          (content_patch.reverse_patch)
+#   snapshot  the whole document after the write – only every
+#             SITEGYN_CONTENT_HISTORY_SNAPSHOT_EVERY versions and after a
+#             whole-document write (initial build / full content from the chat)
+#   kind      edit | undo | redo | restore | noop (same values written again)
+#   ref_version  the version undone / redone / restored to
+#
+#   - undo    = the reverse patch of the latest edit not undone yet, written
+#               as a new version (compare-and-swap); ContentConflict if one of
+#               its fields was changed after that edit
+#   - redo    = the forward patch of the latest undone edit; a new edit
+#               clears the redo stack (stacks are replayed from the last
+#               SITEGYN_CONTENT_HISTORY_UNDO_DEPTH rows – metadata only)
+#   - restore = the document at version V: nearest snapshot ≤ V + forward
+#               patches, or the current document + reverse patches – whichever
+#               is fewer rows; written as diff_patch(current, target)
+#
+# The row is computed from the values the write replaces, read under the
+# same lock, so the log is linear without any read before a write; a write
+# whose row cannot be inserted does not happen.
+#
+# SITEGYN_CONTENT_HISTORY=0 turns the log off.
+# SITEGYN_CONTENT_HISTORY_BACKEND = supabase (default) | memory
+#
+# Schema:
+#   create table content_history (
+#     project_id uuid not null references projects(id) on delete cascade,
+#     version bigint not null,
+#     kind text not null default 'edit',
+#     ref_version bigint,
+#     forward jsonb not null,
+#     reverse jsonb not null,
+#     snapshot jsonb,
+#     created_at timestamptz not null default now(),
+#     primary key (project_id, version)
+#   );
+#   -- then the apply_content_patch function (content_patch.py)
+
+from __future__ import annotations
+
+import abc
+import copy
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from content_patch import (
+    ContentConflict,
+    HistoryLog,
+    _exists,
+    apply_content_ops,
+    apply_patch,
+    diff_patch,
+    get_patch_store,
+    pointer_get,
+    pointer_tokens,
+    reverse_patch,
+    set_history_log,
+)
+
+ENABLED = os.getenv("SITEGYN_CONTENT_HISTORY", "1") != "0"
+DEFAULT_BACKEND = os.getenv("SITEGYN_CONTENT_HISTORY_BACKEND", "supabase")
+SNAPSHOT_EVERY = int(os.getenv("SITEGYN_CONTENT_HISTORY_SNAPSHOT_EVERY", "25"))
+UNDO_DEPTH = int(os.getenv("SITEGYN_CONTENT_HISTORY_UNDO_DEPTH", "100"))
+TABLE = "content_history"
+
+META_COLUMNS = "version, kind, ref_version, created_at"
+
+
+# ==========================================
+# Stores
+# ==========================================
+class HistoryStore(abc.ABC):
+    name = ""
+
+    @abc.abstractmethod
+    def append(self, entry: Dict[str, Any]) -> None:
+        """Insert one row."""
+
+    @abc.abstractmethod
+    def get(self, project_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """The full row of one version (None = not logged)."""
+
+    @abc.abstractmethod
+    def recent(self, project_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Metadata of the newest rows, oldest first."""
+
+    @abc.abstractmethod
+    def between(self, project_id: str, after: int, upto: int) -> List[Dict[str, Any]]:
+        """Rows with after < version <= upto, oldest first."""
+
+    @abc.abstractmethod
+    def snapshot_before(self, project_id: str, version: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """(version, document) of the newest snapshot at or before version."""
+
+
+class SupabaseHistoryStore(HistoryStore):
+    name = "supabase"
+
+    def __init__(self, supabase=None):
+        if supabase is None:
+            from service_clients import get_supabase
+
+            supabase = get_supabase()
+        self.supabase = supabase
+        self.table_available = True
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        if not self.table_available:
+            return
+        try:
+            self.supabase.table(TABLE).insert(entry).execute()
+        except Exception as e:
+            if not _missing_table(e):
+                raise
+            # table not migrated yet – no log until it is (one traceback, not one per write)
+            traceback.print_exc()
+            self.table_available = False
+
+    def get(self, project_id: str, version: int) -> Optional[Dict[str, Any]]:
+        rows = (
+            self.supabase.table(TABLE)
+            .select("version, kind, ref_version, forward, reverse")
+            .eq("project_id", project_id)
+            .eq("version", version)
+            .limit(1)
+            .execute()
+            .data
+        )
+        return rows[0] if rows else None
+
+    def recent(self, project_id: str, limit: int) -> List[Dict[str, Any]]:
+        rows = (
+            self.supabase.table(TABLE)
+            .select(META_COLUMNS)
+            .eq("project_id", project_id)
+            .order("version", desc=True)
+            .limit(limit)
+            .execute()
+            .data
+        ) or []
+        return list(reversed(rows))
+
+    def between(self, project_id: str, after: int, upto: int) -> List[Dict[str, Any]]:
+        return (
+            self.supabase.table(TABLE)
+            .select("version, forward, reverse")
+            .eq("project_id", project_id)
+            .gt("version", after)
+            .lte("version", upto)
+            .order("version")
+            .execute()
+            .data
+        ) or []
+
+    def snapshot_before(self, project_id: str, version: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        rows = (
+            self.supabase.table(TABLE)
+            .select("version, snapshot")
+            .eq("project_id", project_id)
+            .lte("version", version)
+            .not_.is_("snapshot", "null")
+            .order("version", desc=True)
+            .limit(1)
+            .execute()
+            .data
+        )
+        return (rows[0]["version"], rows[0]["snapshot"]) if rows else None
+
+
+def _missing_table(error: Exception) -> bool:
+    text = str(error)
+    return TABLE in text and ("PGRST205" in text or "42P01" in text or "does not exist" in text)
+
+
+class MemoryHistoryStore(HistoryStore):
+    """In-memory stand-in (tests / scripts without Supabase)."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.rows: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            rows = self.rows.setdefault(entry["project_id"], {})
+            if entry["version"] in rows:
+                raise ValueError("duplicate_history_version")
+            rows[entry["version"]] = copy.deepcopy(entry)
+
+    def _rows(self, project_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.rows.get(project_id, {})
+            return [copy.deepcopy(rows[v]) for v in sorted(rows)]
+
+    def get(self, project_id: str, version: int) -> Optional[Dict[str, Any]]:
+        return next((row for row in self._rows(project_id) if row["version"] == version), None)
+
+    def recent(self, project_id: str, limit: int) -> List[Dict[str, Any]]:
+        return [
+            {key: row.get(key) for key in ("version", "kind", "ref_version", "created_at")}
+            for row in self._rows(project_id)[-limit:]
+        ]
+
+    def between(self, project_id: str, after: int, upto: int) -> List[Dict[str, Any]]:
+        return [row for row in self._rows(project_id) if after < row["version"] <= upto]
+
+    def snapshot_before(self, project_id: str, version: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        snapshots = [
+            row for row in self._rows(project_id)
+            if row["version"] <= version and row.get("snapshot") is not None
+        ]
+        return (snapshots[-1]["version"], snapshots[-1]["snapshot"]) if snapshots else None
+
+
+BACKENDS = {
+    SupabaseHistoryStore.name: SupabaseHistoryStore,
+    MemoryHistoryStore.name: MemoryHistoryStore,
+}
+
+_INSTANCES: Dict[str, HistoryStore] = {}
+_INSTANCES_LOCK = threading.Lock()
+
+
+def get_history_store(name: Optional[str] = None) -> HistoryStore:
+    name = name or DEFAULT_BACKEND
+    with _INSTANCES_LOCK:
+        store = _INSTANCES.get(name)
+        if store is None:
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown content history backend: {name} (expected one of {', '.join(BACKENDS)})")
+            store = BACKENDS[name]()
+            _INSTANCES[name] = store
+        return store
+
+
+# ==========================================
+# Stats
+# ==========================================
+class HistoryStats:
+    def __init__(self):
+        self._counts: Dict[str, int] = {
+            "entries": 0, "bytes": 0, "snapshots": 0, "skipped": 0, "undo": 0, "redo": 0, "restore": 0,
+        }
+        self._lock = threading.Lock()
+
+    def record(self, summary: Dict[str, Any]) -> None:
+        """summary of a written row: kind, bytes (forward + reverse), snapshot (bool)."""
+        with self._lock:
+            self._counts["entries"] += 1
+            self._counts["bytes"] += summary.get("bytes") or 0
+            if summary.get("snapshot"):
+                self._counts["snapshots"] += 1
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+history_stats = HistoryStats()
+
+
+# ==========================================
+# Recording (written by the content_patch store with the write)
+# ==========================================
+class ContentHistoryLog(HistoryLog):
+    """The row apply_content_patch inserts in SQL, built in Python (local store / RPC fallback)."""
+
+    snapshot_every = SNAPSHOT_EVERY
+
+    def write(
+        self,
+        project_id: str,
+        ops: List[Dict[str, Any]],
+        version: int,
+        before: Dict[str, Any],
+        log: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        whole_document = any(not op.get("path") for op in ops)
+        after = None
+        if whole_document or version % SNAPSHOT_EVERY == 0:
+            after = apply_patch(copy.deepcopy(before), ops)
+
+        reverse = reverse_patch(before, ops)
+        kind = log.get("kind") or "edit"
+        if kind == "edit" and not reverse:
+            # the same values again – keeps the versions contiguous, not undoable
+            kind = "noop"
+
+        entry = {
+            "project_id": str(project_id),
+            "version": version,
+            "kind": kind,
+            "ref_version": log.get("ref_version"),
+            # a whole-document write is logged as what actually changed
+            "forward": diff_patch(before, after) if whole_document else ops,
+            "reverse": reverse,
+            "snapshot": after,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        get_history_store().append(entry)
+        return {
+            "kind": kind,
+            "bytes": len(json.dumps([entry["forward"], reverse], ensure_ascii=False, default=str).encode("utf-8")),
+            "snapshot": after is not None,
+        }
+
+    def recorded(self, summary: Optional[Dict[str, Any]]) -> None:
+        if summary is None:
+            history_stats.count("skipped")
+        else:
+            history_stats.record(summary)
+
+
+if ENABLED:
+    set_history_log(ContentHistoryLog())
+
+
+# ==========================================
+# Undo / redo / restore
+# ==========================================
+def edit_stacks(project_id: str) -> Tuple[List[int], List[int]]:
+    """(undo stack, redo stack) of edit versions, replayed from the recent log."""
+    undo: List[int] = []
+    redo: List[int] = []
+    for row in get_history_store().recent(str(project_id), UNDO_DEPTH):
+        kind, ref = row.get("kind") or "edit", row.get("ref_version")
+        if kind == "undo":
+            if undo and undo[-1] == ref:
+                redo.append(undo.pop())
+        elif kind == "redo":
+            if redo and redo[-1] == ref:
+                undo.append(redo.pop())
+        elif kind != "noop":
+            # edit / restore – a new branch, nothing left to redo
+            undo.append(row["version"])
+            redo.clear()
+    return undo, redo
+
+
+def _not_reflected(doc: Dict[str, Any], ops: List[Dict[str, Any]]) -> List[str]:
+    """Paths where doc does not hold the result of ops (changed by a later write)."""
+    final: Dict[str, Dict[str, Any]] = {}
+    for op in ops:
+        final[op.get("path", "")] = op
+    paths = []
+    for path, op in final.items():
+        if op.get("op") == "remove":
+            if _exists(doc, pointer_tokens(path)):
+                paths.append(path)
+        elif pointer_get(doc, path) != op.get("value"):
+            paths.append(path)
+    return paths
+
+
+def _apply_logged(project_id: str, entry: Dict[str, Any], kind: str) -> Optional[int]:
+    # undo applies reverse (the doc must still hold forward), redo the other way round
+    ops, expected = (entry["reverse"], entry["forward"]) if kind == "undo" else (entry["forward"], entry["reverse"])
+    current, version = get_patch_store().load(project_id)
+    conflicts = _not_reflected(current, expected)
+    if conflicts:
+        raise ContentConflict(conflicts)
+    new_version = apply_content_ops(
+        project_id, ops, base=current, expected_version=version,
+        history_kind=kind, history_ref=entry["version"],
+    )
+    history_stats.count(kind)
+    return new_version
+
+
+def undo(project_id: str) -> Dict[str, Any]:
+    """Undo the latest edit. ValueError("nothing_to_undo"), ContentConflict."""
+    project_id = str(project_id)
+    stack, _ = edit_stacks(project_id)
+    if not stack:
+        raise ValueError("nothing_to_undo")
+    entry = get_history_store().get(project_id, stack[-1])
+    if entry is None:
+        raise LookupError("history_incomplete")
+    return {"content_version": _apply_logged(project_id, entry, "undo"), "undone": entry["version"]}
+
+
+def redo(project_id: str) -> Dict[str, Any]:
+    """Redo the latest undone edit. ValueError("nothing_to_redo"), ContentConflict."""
+    project_id = str(project_id)
+    _, stack = edit_stacks(project_id)
+    if not stack:
+        raise ValueError("nothing_to_redo")
+    entry = get_history_store().get(project_id, stack[-1])
+    if entry is None:
+        raise LookupError("history_incomplete")
+    return {"content_version": _apply_logged(project_id, entry, "redo"), "redone": entry["version"]}
+
+
+def document_at(project_id: str, version: int, current: Dict[str, Any], current_version: int) -> Dict[str, Any]:
+    """content_json as it was right after version. LookupError("history_incomplete") if rows are missing."""
+    store = get_history_store()
+    snapshot = store.snapshot_before(project_id, version)
+
+    if snapshot is not None and version - snapshot[0] <= current_version - version:
+        # forward from the snapshot
+        snapshot_version, doc = snapshot
+        rows = store.between(project_id, snapshot_version, version)
+        if len(rows) != version - snapshot_version:
+            raise LookupError("history_incomplete")
+        doc = copy.deepcopy(doc)
+        for row in rows:
+            doc = apply_patch(doc, row["forward"])
+        return doc
+
+    # backward from the current document
+    rows = store.between(project_id, version, current_version)
+    if len(rows) != current_version - version:
+        raise LookupError("history_incomplete")
+    doc = copy.deepcopy(current)
+    for row in reversed(rows):
+        doc = apply_patch(doc, row["reverse"])
+    return doc
+
+
+def restore(project_id: str, version: int) -> Dict[str, Any]:
+    """Write the document of an earlier version as a new version."""
+    project_id = str(project_id)
+    current, current_version = get_patch_store().load(project_id)
+    if current_version is None:
+        raise ValueError("history_unavailable")
+    # bool is an int subclass – {"version": true} must not restore version 1
+    if isinstance(version, bool) or not isinstance(version, int) or version < 0 or version > current_version:
+        raise ValueError("unknown_version")
+
+    target = document_at(project_id, version, current, current_version)
+    ops = diff_patch(current, target)
+    if not ops:
+        return {"content_version": current_version, "restored": version}
+    new_version = apply_content_ops(
+        project_id, ops, base=current, expected_version=current_version,
+        history_kind="restore", history_ref=version,
+    )
+    history_stats.count("restore")
+    return {"content_version": new_version, "restored": version}
+
+
+def history(project_id: str, limit: int = 50) -> Dict[str, Any]:
+    """Newest log rows (metadata) + what undo / redo would do now."""
+    project_id = str(project_id)
+    undo_stack, redo_stack = edit_stacks(project_id)
+    rows = get_history_store().recent(project_id, max(1, min(limit, UNDO_DEPTH)))
+    return {
+        "entries": list(reversed(rows)),
+        "can_undo": bool(undo_stack),
+        "can_redo": bool(redo_stack),
+    }
@@ -0,0 +1,794 @@
+# content_patch.py
+#
+# Field-update engine for content_json – partial writes via JSON Patch.
+#
+# Every field edit (editor_update_server, content_update_service,
+# update_server, the editor branch of server.chat) used to read the whole
+# content_json, set one value and write the whole document back. Now:
+#
+#   - changes [(dotted path, value)] → RFC 6902 operations
+#       "home.hero.headline"   → {"op": "add",     "path": "/home/hero/headline", ...}
+#       "home.hero.pills[0]"   → {"op": "replace", "path": "/home/hero/pills/0", ...}
+#     ("add" on an object member sets it; missing parent objects are created,
+#     like the old set_value_by_path did)
+#   - the operations are applied in the database by the apply_content_patch
+#     RPC (jsonb_set / #- on the stored document), so the request carries only
+#     the edit and no read of content_json is needed to write
+#   - apply_patch() is the same semantics in Python: the "local" store keeps
+#     documents in memory (tests / scripts without Supabase), and the "rpc"
+#     store falls back to read → apply_patch → write while the function is
+#     not installed yet
+#   - optimistic concurrency: projects.content_version counts the writes of
+#     content_json. A writer that read the document passes the version it
+#     read (+ the document as base); the write is a compare-and-swap. On a
+#     conflict the patch is rebased: the latest document is read, and if
+#     none of the patched paths changed since the base, the same operations
+#     are retried on the latest version (SITEGYN_CONTENT_CAS_RETRIES times).
+#     If a patched path did change, ContentConflict is raised – the edit was
+#     made against a value somebody else already replaced.
+#   - path "" (the whole document) is allowed for add / replace – the
+#     initial build and a full content_json from the chat use it
+#   - add_write_listener(fn): fn(project_id, ops, version, before) is called
+#     in this process after every successful write (live preview –
+#     preview_updates). before is the document the ops were applied to when
+#     the caller passed one with its expected_version, else None
+#   - history log (content_history registers a HistoryLog): the undo row of a
+#     write is written by the store in the same transaction as the write –
+#     the RPC computes the reverse patch from the values it replaces (read
+#     under the row lock) and inserts the content_history row before it
+#     commits, so the log has no gaps and no write reads content_json first.
+#     The local store builds the row in Python under its lock; the
+#     read → write fallback appends it after its compare-and-swap
+#   - reverse_patch(before, ops) / diff_patch(a, b): the operations that undo
+#     a patch / turn one document into another – sized by the edit, not by
+#     the document (the RPC has the same two in SQL)
+#
+# SITEGYN_CONTENT_PATCH_BACKEND = rpc (default) | local
+#
+# Schema (after the content_history table – see content_history.py):
+#   alter table projects add column content_version bigint not null default 0;
+#   drop function if exists apply_content_patch(uuid, jsonb);
+#   drop function if exists apply_content_patch(uuid, jsonb, bigint);
+#
+#   create or replace function content_pointer(p_path text[]) returns text
+#   language sql immutable as $$
+#     select coalesce(string_agg('/' || replace(replace(seg, '~', '~0'), '/', '~1'), '' order by n), '')
+#       from unnest(p_path) with ordinality as t(seg, n)
+#   $$;
+#
+#   -- content_patch.diff_patch
+#   create or replace function content_json_diff(a jsonb, b jsonb, p_pointer text default '')
+#   returns jsonb language plpgsql immutable as $$
+#   declare
+#     ops jsonb := '[]'::jsonb;
+#     k text;
+#   begin
+#     if jsonb_typeof(a) = 'object' and jsonb_typeof(b) = 'object' then
+#       for k in select jsonb_object_keys(a) loop
+#         if not b ? k then
+#           ops := ops || jsonb_build_object('op', 'remove', 'path', p_pointer || content_pointer(array[k]));
+#         end if;
+#       end loop;
+#       for k in select jsonb_object_keys(b) loop
+#         if a ? k then
+#           ops := ops || content_json_diff(a -> k, b -> k, p_pointer || content_pointer(array[k]));
+#         else
+#           ops := ops || jsonb_build_object('op', 'add', 'path', p_pointer || content_pointer(array[k]), 'value', b -> k);
+#         end if;
+#       end loop;
+#       return ops;
+#     end if;
+#     if jsonb_typeof(a) = 'array' and jsonb_typeof(b) = 'array'
+#        and jsonb_array_length(a) = jsonb_array_length(b) then
+#       for i in 0 .. jsonb_array_length(a) - 1 loop
+#         ops := ops || content_json_diff(a -> i, b -> i, p_pointer || '/' || i);
+#       end loop;
+#       return ops;
+#     end if;
+#     if a = b then
+#       return ops;
+#     end if;
+#     return jsonb_build_array(jsonb_build_object('op', 'replace', 'path', p_pointer, 'value', b));
+#   end $$;
+#
+#   -- p_log: {"kind", "ref_version", "snapshot_every"} → content_history row
+#   -- returns {"version": n, "history": {"kind", "bytes", "snapshot"} | null}
+#   create or replace function apply_content_patch(
+#     p_project_id uuid, p_ops jsonb, p_expected_version bigint default null, p_log jsonb default null
+#   ) returns jsonb language plpgsql as $$
+#   declare
+#     op jsonb;
+#     path text[];
+#     missing text[];
+#     depth int;
+#     parent jsonb;
+#     old jsonb;
+#     before jsonb;
+#     doc jsonb;
+#     version bigint;
+#     whole boolean := false;
+#     forward jsonb := p_ops;
+#     reverse jsonb := '[]'::jsonb;
+#     kind text;
+#     snapshot jsonb;
+#   begin
+#     select coalesce(content_json, '{}'::jsonb), content_version into doc, version
+#       from projects where id = p_project_id for update;
+#     if not found then
+#       raise exception 'project_not_found';
+#     end if;
+#     if p_expected_version is not null and version <> p_expected_version then
+#       raise exception 'content_version_conflict' using errcode = '40001';
+#     end if;
+#     before := doc;
+#     for op in select value from jsonb_array_elements(p_ops) loop
+#       select coalesce(array_agg(replace(replace(seg, '~1', '/'), '~0', '~') order by n), '{}')
+#         into path
+#         from unnest(string_to_array(substr(op->>'path', 2), '/')) with ordinality as t(seg, n);
+#       if op->>'op' in ('add', 'replace', 'remove') and path <> '{}' then
+#         -- content_patch.reverse_patch: the values this op replaces
+#         depth := null;
+#         for i in 1 .. array_length(path, 1) loop
+#           if (doc #> path[1:i]) is null then
+#             depth := i;
+#             exit;
+#           end if;
+#         end loop;
+#         if depth is not null then
+#           parent := doc #> path[1:depth - 1];
+#           missing := path[1:depth];
+#           if jsonb_typeof(parent) = 'array' then
+#             missing[depth] := jsonb_array_length(parent)::text;
+#           end if;
+#           reverse := jsonb_build_object('op', 'remove', 'path', content_pointer(missing)) || reverse;
+#         else
+#           old := doc #> path;
+#           parent := doc #> path[1:array_length(path, 1) - 1];
+#           if op->>'op' = 'remove' and jsonb_typeof(parent) = 'array' then
+#             reverse := jsonb_build_object(
+#               'op', 'replace', 'path', content_pointer(path[1:array_length(path, 1) - 1]), 'value', parent
+#             ) || reverse;
+#           elsif op->>'op' = 'remove' or old is distinct from op->'value' then
+#             reverse := jsonb_build_object(
+#               'op', case when jsonb_typeof(parent) = 'array' then 'replace' else 'add' end,
+#               'path', op->>'path', 'value', old
+#             ) || reverse;
+#           end if;
+#         end if;
+#       end if;
+#       if op->>'op' in ('add', 'replace') and path = '{}' then
+#         doc := op->'value';
+#         whole := true;
+#       elsif op->>'op' in ('add', 'replace') then
+#         for i in 1 .. coalesce(array_length(path, 1), 0) - 1 loop
+#           if jsonb_typeof(doc #> path[1:i]) is distinct from 'object'
+#              and jsonb_typeof(doc #> path[1:i]) is distinct from 'array' then
+#             doc := jsonb_set(doc, path[1:i], '{}'::jsonb, true);
+#           end if;
+#         end loop;
+#         doc := jsonb_set(doc, path, op->'value', true);
+#       elsif op->>'op' = 'remove' then
+#         doc := doc #- path;
+#       elsif op->>'op' = 'test' then
+#         if (doc #> path) is distinct from op->'value' then
+#           raise exception 'patch_test_failed';
+#         end if;
+#       else
+#         raise exception 'unsupported_patch_op %', op->>'op';
+#       end if;
+#     end loop;
+#     update projects set content_json = doc, content_version = version + 1
+#       where id = p_project_id;
+#     if p_log is null then
+#       return jsonb_build_object('version', version + 1, 'history', null);
+#     end if;
+#
+#     if whole then
+#       -- a whole-document write is logged as what actually changed
+#       forward := content_json_diff(before, doc);
+#       reverse := content_json_diff(doc, before);
+#     end if;
+#     kind := coalesce(p_log->>'kind', 'edit');
+#     if kind = 'edit' and reverse = '[]'::jsonb then
+#       kind := 'noop';
+#     end if;
+#     if whole or (version + 1) % coalesce((p_log->>'snapshot_every')::int, 25) = 0 then
+#       snapshot := doc;
+#     end if;
+#     insert into content_history (project_id, version, kind, ref_version, forward, reverse, snapshot)
+#       values (p_project_id, version + 1, kind, (p_log->>'ref_version')::bigint, forward, reverse, snapshot);
+#     return jsonb_build_object('version', version + 1, 'history', jsonb_build_object(
+#       'kind', kind,
+#       'bytes', octet_length(forward::text) + octet_length(reverse::text),
+#       'snapshot', snapshot is not null
+#     ));
+#   end $$;
+
+from __future__ import annotations
+
+import abc
+import copy
+import json
+import os
+import re
+import threading
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+DEFAULT_BACKEND = os.getenv("SITEGYN_CONTENT_PATCH_BACKEND", "rpc")
+CAS_RETRIES = int(os.getenv("SITEGYN_CONTENT_CAS_RETRIES", "5"))
+RPC_NAME = "apply_content_patch"
+VERSION_COLUMN = "content_version"
+
+PathToken = Union[str, int]
+
+_PATH_TOKEN_RE = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+
+class VersionConflict(Exception):
+    """The stored content_version is not the expected one (store level)."""
+
+
+class ContentConflict(Exception):
+    """A patched path was changed by another writer since the base was read."""
+
+    def __init__(self, paths: List[str]):
+        super().__init__("content_conflict")
+        self.paths = paths
+
+
+# ==========================================
+# Paths
+# ==========================================
+def path_tokens(path: str) -> Tuple[PathToken, ...]:
+    """"menu.pizzas[1].name" → ("menu", "pizzas", 1, "name")."""
+    return tuple(
+        int(index) if index else key
+        for key, index in _PATH_TOKEN_RE.findall(path or "")
+    )
+
+
+def to_pointer(path: str) -> str:
+    """Dotted content path → JSON pointer (RFC 6901)."""
+    return "".join(
+        "/" + str(token).replace("~", "~0").replace("/", "~1")
+        for token in path_tokens(path)
+    )
+
+
+def pointer_tokens(pointer: str) -> List[str]:
+    if not pointer:
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError(f"invalid JSON pointer: {pointer}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer[1:].split("/")]
+
+
+def changes_to_patch(changes: Union[Dict[str, Any], Iterable[Tuple[str, Any]]]) -> List[Dict[str, Any]]:
+    """{path: value} / [(path, value)] → RFC 6902 operations."""
+    items = changes.items() if isinstance(changes, dict) else changes
+    ops = []
+    for path, value in items:
+        tokens = path_tokens(path)
+        if not tokens:
+            continue
+        ops.append({
+            "op": "replace" if isinstance(tokens[-1], int) else "add",
+            "path": to_pointer(path),
+            "value": value,
+        })
+    return ops
+
+
+# ==========================================
+# Local apply (same semantics as the RPC)
+# ==========================================
+def _child(container: Any, key: str) -> Any:
+    if isinstance(container, list):
+        if not key.isdigit():
+            return None
+        index = int(key)
+        return container[index] if 0 <= index < len(container) else None
+    if isinstance(container, dict):
+        return container.get(key)
+    return None
+
+
+def _set(container: Any, key: str, value: Any) -> None:
+    if isinstance(container, list):
+        index = int(key)
+        if 0 <= index < len(container):
+            container[index] = value
+        else:
+            # jsonb_set(..., create_missing => true) appends past the end
+            container.append(value)
+    else:
+        container[key] = value
+
+
+def pointer_get(doc: Any, pointer: str) -> Any:
+    """Value at the pointer (None if it does not exist)."""
+    for key in pointer_tokens(pointer):
+        doc = _child(doc, key)
+        if doc is None:
+            return None
+    return doc
+
+
+def apply_patch(doc: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply the operations on doc in place (and return it – a new object for path "")."""
+    for op in ops:
+        name = op.get("op")
+        tokens = pointer_tokens(op.get("path", ""))
+        if not tokens:
+            if name not in ("add", "replace") or not isinstance(op.get("value"), dict):
+                raise ValueError("only add / replace of an object is supported for the whole document")
+            doc = copy.deepcopy(op["value"])
+            continue
+
+        parent = doc
+        for depth, key in enumerate(tokens[:-1]):
+            child = _child(parent, key)
+            if not isinstance(child, (dict, list)):
+                if name not in ("add", "replace"):
+                    break
+                child = {}
+                _set(parent, key, child)
+            parent = child
+        else:
+            depth = len(tokens) - 1
+
+        last = tokens[-1]
+        if name in ("add", "replace"):
+            _set(parent, last, copy.deepcopy(op.get("value")))
+        elif name == "remove":
+            if depth == len(tokens) - 1 and isinstance(parent, dict):
+                parent.pop(last, None)
+            elif depth == len(tokens) - 1 and isinstance(parent, list) and 0 <= int(last) < len(parent):
+                del parent[int(last)]
+        elif name == "test":
+            current = _child(parent, last) if depth == len(tokens) - 1 else None
+            if current != op.get("value"):
+                raise ValueError(f"patch test failed at {op.get('path')}")
+        else:
+            raise ValueError(f"unsupported patch op: {name}")
+    return doc
+
+
+def _pointer(tokens: List[str]) -> str:
+    return "".join("/" + token.replace("~", "~0").replace("/", "~1") for token in tokens)
+
+
+def _exists(doc: Any, tokens: List[str]) -> bool:
+    for key in tokens:
+        if isinstance(doc, list):
+            if not key.isdigit() or int(key) >= len(doc):
+                return False
+            doc = doc[int(key)]
+        elif isinstance(doc, dict):
+            if key not in doc:
+                return False
+            doc = doc[key]
+        else:
+            return False
+    return True
+
+
+def reverse_patch(before: Dict[str, Any], ops: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Operations that turn apply_patch(before, ops) back into before."""
+    if any(not op.get("path") for op in ops):
+        # whole-document write – the difference, not a copy of the old document
+        return diff_patch(apply_patch(copy.deepcopy(before), ops), before)
+
+    doc = copy.deepcopy(before)
+    undo: List[Dict[str, Any]] = []
+    for op in ops:
+        if op.get("op") == "test":
+            continue
+        tokens = pointer_tokens(op["path"])
+        depth = next((d for d in range(1, len(tokens) + 1) if not _exists(doc, tokens[:d])), None)
+        if depth is not None:
+            # the path (or a parent apply_patch creates) is new → remove it again
+            parent = pointer_get(doc, _pointer(tokens[:depth - 1]))
+            missing = list(tokens[:depth])
+            if isinstance(parent, list):
+                # past-the-end writes append
+                missing[-1] = str(len(parent))
+            undo.append({"op": "remove", "path": _pointer(missing)})
+        else:
+            old = pointer_get(doc, op["path"])
+            parent = pointer_get(doc, _pointer(tokens[:-1]))
+            if op.get("op") == "remove" and isinstance(parent, list):
+                # no insert op (jsonb_set) – the whole list comes back
+                undo.append({"op": "replace", "path": _pointer(tokens[:-1]), "value": copy.deepcopy(parent)})
+            elif op.get("op") == "remove" or old != op.get("value"):
+                undo.append({
+                    "op": "replace" if isinstance(parent, list) else "add",
+                    "path": op["path"],
+                    "value": copy.deepcopy(old),
+                })
+        doc = apply_patch(doc, [op])
+    undo.reverse()
+    return undo
+
+
+def diff_patch(a: Any, b: Any, pointer: str = "") -> List[Dict[str, Any]]:
+    """Operations that turn a into b (objects key by key, same-length lists item by item)."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        ops: List[Dict[str, Any]] = []
+        for key in a:
+            if key not in b:
+                ops.append({"op": "remove", "path": pointer + _pointer([key])})
+        for key, value in b.items():
+            child = pointer + _pointer([key])
+            if key not in a:
+                ops.append({"op": "add", "path": child, "value": copy.deepcopy(value)})
+            else:
+                ops.extend(diff_patch(a[key], value, child))
+        return ops
+    if isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        ops = []
+        for index, (old, new) in enumerate(zip(a, b)):
+            ops.extend(diff_patch(old, new, f"{pointer}/{index}"))
+        return ops
+    if a == b:
+        return []
+    return [{"op": "replace", "path": pointer, "value": copy.deepcopy(b)}]
+
+
+# ==========================================
+# Stores
+# ==========================================
+class PatchStats:
+    def __init__(self):
+        self._counts: Dict[str, int] = {
+            "patches": 0, "ops": 0, "bytes": 0, "fallback_writes": 0, "conflicts": 0, "rebased": 0,
+        }
+        self._lock = threading.Lock()
+
+    def record(self, ops: List[Dict[str, Any]], fallback: bool = False) -> None:
+        size = len(json.dumps(ops, ensure_ascii=False, default=str).encode("utf-8"))
+        with self._lock:
+            self._counts["patches"] += 1
+            self._counts["ops"] += len(ops)
+            self._counts["bytes"] += size
+            if fallback:
+                self._counts["fallback_writes"] += 1
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+patch_stats = PatchStats()
+
+
+# ==========================================
+# History log (content_history)
+# ==========================================
+class HistoryLog(abc.ABC):
+    """The undo log a store writes together with each write (registered by content_history)."""
+
+    snapshot_every = 25
+
+    @abc.abstractmethod
+    def write(
+        self,
+        project_id: str,
+        ops: List[Dict[str, Any]],
+        version: int,
+        before: Dict[str, Any],
+        log: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """Append the row of a write made from Python → its summary {"kind", "bytes", "snapshot"}."""
+
+    def recorded(self, summary: Optional[Dict[str, Any]]) -> None:
+        """A row was written (summary) – or None: the write could not be logged."""
+
+
+_HISTORY_LOG: Optional[HistoryLog] = None
+
+
+def set_history_log(history_log: Optional[HistoryLog]) -> None:
+    global _HISTORY_LOG
+    _HISTORY_LOG = history_log
+
+
+class ContentPatchStore(abc.ABC):
+    name = ""
+
+    @abc.abstractmethod
+    def apply(
+        self,
+        project_id: str,
+        ops: List[Dict[str, Any]],
+        expected_version: Optional[int] = None,
+        log: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        """
+        Apply ops atomically → the new content_version. VersionConflict if
+        expected_version is stale. log {"kind", "ref_version"} → the
+        content_history row of the write is written with it.
+        """
+
+    @abc.abstractmethod
+    def load(self, project_id: str) -> Tuple[Dict[str, Any], Optional[int]]:
+        """(content_json, content_version) as stored now."""
+
+
+class RpcPatchStore(ContentPatchStore):
+    name = "rpc"
+
+    def __init__(self, supabase=None):
+        if supabase is None:
+            from service_clients import get_supabase
+
+            supabase = get_supabase()
+        self.supabase = supabase
+        self.rpc_available = True
+        self.version_column = True
+
+    def apply(
+        self,
+        project_id: str,
+        ops: List[Dict[str, Any]],
+        expected_version: Optional[int] = None,
+        log: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        if self.rpc_available:
+            params = {"p_project_id": project_id, "p_ops": ops, "p_expected_version": expected_version}
+            if log is not None and _HISTORY_LOG is not None:
+                # the function writes the content_history row in its transaction
+                params["p_log"] = {**log, "snapshot_every": _HISTORY_LOG.snapshot_every}
+            try:
+                result = self.supabase.rpc(RPC_NAME, params).execute().data or {}
+            except Exception as e:
+                if "content_version_conflict" in str(e):
+                    raise VersionConflict() from e
+                if not _missing_function(e):
+                    raise
+                # function not migrated yet – whole-document write until it is
+                traceback.print_exc()
+                self.rpc_available = False
+            else:
+                patch_stats.record(ops)
+                if "p_log" in params:
+                    _HISTORY_LOG.recorded(result.get("history"))
+                return result.get("version")
+        return self._read_modify_write(project_id, ops, expected_version, log)
+
+    def load(self, project_id: str) -> Tuple[Dict[str, Any], Optional[int]]:
+        columns = f"content_json, {VERSION_COLUMN}" if self.version_column else "content_json"
+        try:
+            row = (
+                self.supabase.table("projects")
+                .select(columns)
+                .eq("id", project_id)
+                .single()
+                .execute()
+                .data
+            ) or {}
+        except Exception as e:
+            if not self.version_column or not _missing_column(e):
+                raise
+            # content_version not migrated yet – writes without compare-and-swap
+            traceback.print_exc()
+            self.version_column = False
+            return self.load(project_id)
+        return row.get("content_json") or {}, row.get(VERSION_COLUMN)
+
+    def _read_modify_write(
+        self,
+        project_id: str,
+        ops: List[Dict[str, Any]],
+        expected_version: Optional[int],
+        log: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        before, version = self.load(project_id)
+        if expected_version is not None and version is not None and version != expected_version:
+            raise VersionConflict()
+        content = apply_patch(copy.deepcopy(before), ops)
+
+        if version is None:
+            self.supabase.table("projects").update({"content_json": content}).eq("id", project_id).execute()
+            patch_stats.record(ops, fallback=True)
+            if log is not None and _HISTORY_LOG is not None:
+                # content_version not migrated yet – nothing to order the log by
+                _HISTORY_LOG.recorded(None)
+            return None
+
+        # compare-and-swap on the version that was read
+        updated = (
+            self.supabase.table("projects")
+            .update({"content_json": content, VERSION_COLUMN: version + 1})
+            .eq("id", project_id)
+            .eq(VERSION_COLUMN, version)
+            .execute()
+            .data
+        )
+        if not updated:
+            raise VersionConflict()
+        patch_stats.record(ops, fallback=True)
+        if log is not None and _HISTORY_LOG is not None:
+            # not in the write's transaction – only until the function is migrated;
+            # the write already happened, so a failing log must not fail it
+            try:
+                _HISTORY_LOG.recorded(_HISTORY_LOG.write(project_id, ops, version + 1, before, log))
+            except Exception:
+                traceback.print_exc()
+        return version + 1
+
+
+def _missing_function(error: Exception) -> bool:
+    text = str(error)
+    return "PGRST202" in text or "Could not find the function" in text or "42883" in text
+
+
+def _missing_column(error: Exception) -> bool:
+    text = str(error)
+    return VERSION_COLUMN in text and ("42703" in text or "does not exist" in text)
+
+
+class LocalPatchStore(ContentPatchStore):
+    """In-memory stand-in: project_id → content_json (+ content_version)."""
+
+    name = "local"
+
+    def __init__(self, documents: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.documents = documents if documents is not None else {}
+        self.versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def apply(
+        self,
+        project_id: str,
+        ops: List[Dict[str, Any]],
+        expected_version: Optional[int] = None,
+        log: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        project_id = str(project_id)
+        summary = None
+        with self._lock:
+            version = self.versions.get(project_id, 0)
+            if expected_version is not None and expected_version != version:
+                raise VersionConflict()
+            doc = self.documents.get(project_id) or {}
+            # all or nothing, like the RPC transaction – the log row first
+            content = apply_patch(copy.deepcopy(doc), ops)
+            if log is not None and _HISTORY_LOG is not None:
+                summary = _HISTORY_LOG.write(project_id, ops, version + 1, doc, log)
+            self.documents[project_id] = content
+            self.versions[project_id] = version + 1
+        patch_stats.record(ops)
+        if summary is not None:
+            _HISTORY_LOG.recorded(summary)
+        return version + 1
+
+    def load(self, project_id: str) -> Tuple[Dict[str, Any], Optional[int]]:
+        project_id = str(project_id)
+        with self._lock:
+            return copy.deepcopy(self.documents.get(project_id) or {}), self.versions.get(project_id, 0)
+
+
+BACKENDS = {
+    RpcPatchStore.name: RpcPatchStore,
+    LocalPatchStore.name: LocalPatchStore,
+}
+
+_INSTANCES: Dict[str, ContentPatchStore] = {}
+_INSTANCES_LOCK = threading.Lock()
+
+
+def get_patch_store(name: Optional[str] = None) -> ContentPatchStore:
+    name = name or DEFAULT_BACKEND
+    with _INSTANCES_LOCK:
+        store = _INSTANCES.get(name)
+        if store is None:
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown content patch backend: {name} (expected one of {', '.join(BACKENDS)})")
+            store = BACKENDS[name]()
+            _INSTANCES[name] = store
+        return store
+
+
+# ==========================================
+# Write listeners
+# ==========================================
+WriteListener = Callable[[str, List[Dict[str, Any]], Optional[int], Optional[Dict[str, Any]]], None]
+
+_LISTENERS: List[WriteListener] = []
+
+
+def add_write_listener(listener: WriteListener) -> None:
+    if listener not in _LISTENERS:
+        _LISTENERS.append(listener)
+
+
+def _notify(
+    project_id: str, ops: List[Dict[str, Any]], version: Optional[int], before: Optional[Dict[str, Any]]
+) -> None:
+    # a listener failing must never fail the write that already happened
+    for listener in list(_LISTENERS):
+        try:
+            listener(project_id, ops, version, before)
+        except Exception:
+            traceback.print_exc()
+
+
+# ==========================================
+# Writes with compare-and-swap + rebase
+# ==========================================
+def _rebase_conflicts(ops: List[Dict[str, Any]], base: Any, latest: Any) -> List[str]:
+    """Patched paths whose value changed between base and latest."""
+    return [
+        op.get("path", "")
+        for op in ops
+        if pointer_get(base, op.get("path", "")) != pointer_get(latest, op.get("path", ""))
+    ]
+
+
+def apply_content_ops(
+    project_id: str,
+    ops: List[Dict[str, Any]],
+    base: Optional[Dict[str, Any]] = None,
+    expected_version: Optional[int] = None,
+    history_kind: str = "edit",
+    history_ref: Optional[int] = None,
+) -> Optional[int]:
+    """
+    Write the operations → the new content_version.
+    expected_version (+ base = the content_json read with it) → compare-and-swap,
+    rebased on a conflict; ContentConflict if a patched path changed meanwhile.
+    history_kind / history_ref: how the write is logged (undo / redo / restore
+    of a version – content_history).
+    """
+    if not ops:
+        return expected_version
+    store = get_patch_store()
+    project_id = str(project_id)
+    checked = base is not None
+    log = {"kind": history_kind, "ref_version": history_ref} if _HISTORY_LOG is not None else None
+    for attempt in range(CAS_RETRIES + 1):
+        try:
+            version = store.apply(project_id, ops, expected_version, log)
+        except VersionConflict:
+            patch_stats.count("conflicts")
+            latest, latest_version = store.load(project_id)
+            conflicts = _rebase_conflicts(ops, base, latest) if checked else []
+            if conflicts:
+                raise ContentConflict(conflicts)
+            # the paths of this patch are untouched → same ops on the latest version
+            patch_stats.count("rebased")
+            base, expected_version = latest, latest_version
+            continue
+        _notify(project_id, ops, version, base if expected_version is not None else None)
+        return version
+    raise ContentConflict([op.get("path", "") for op in ops])
+
+
+def apply_content_changes(
+    project_id: str,
+    changes: Union[Dict[str, Any], Iterable[Tuple[str, Any]]],
+    base: Optional[Dict[str, Any]] = None,
+    expected_version: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Write the changes to the project's content_json; returns the operations applied."""
+    ops = changes_to_patch(changes)
+    apply_content_ops(project_id, ops, base=base, expected_version=expected_version)
+    return ops
+
+
+def replace_content(
+    project_id: str,
+    content: Dict[str, Any],
+    base: Optional[Dict[str, Any]] = None,
+    expected_version: Optional[int] = None,
+) -> Optional[int]:
+    """Write a whole content_json (initial build / full update from the chat)."""
+    return apply_content_ops(
+        project_id, [{"op": "replace", "path": "", "value": content}], base=base, expected_version=expected_version
+    )
@@ -0,0 +1,184 @@
+# content_prompts.py
+#
+# Prompt assembly for content generation (generate_content_for_project).
+#
+# The content prompt used to be re-read from disk with the template schema on
+# every call, with BUSINESS_DATA_JSON spliced into the middle of it. Now:
+#
+#   - per template, the static part (instructions + schema) is built once
+#     and cached; it is rebuilt only when one of its files changes (mtime)
+#   - the request is [system: static prefix] + [user: business data], so
+#     every build of the same template starts with an identical prefix and
+#     OpenAI's automatic prompt caching (prefixes of 1024+ tokens) applies
+#   - usage.prompt_tokens_details.cached_tokens of every completion is
+#     recorded per template (prompt_cache_stats), to confirm the savings
+#   - the top-level sections of the schema (hero/about/menu/...) are parsed
+#     with the prefix; build_section_messages asks for one section only and
+#     keeps the same prefix + business data, so the parallel section calls
+#     of one build (content_sections.py) share the cached prompt
+#   - the section-mode rules are part of the static prefix (SECTION_MODE_RULES,
+#     appended to every content prompt), so they override "ALL website copy
+#     as a SINGLE JSON object" in the prompt itself; the last message of a
+#     section call is only "SECTION: <name>"
+
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from templates_config import TEMPLATES
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_CONTENT_PROMPT = "content_fill_prompt.txt"
+
+SCHEMA_PLACEHOLDER = "{{SCHEMA_JSON}}"
+BUSINESS_DATA_PLACEHOLDER = "{{BUSINESS_DATA_JSON}}"
+# what stays in the static prompt where the business data used to be
+BUSINESS_DATA_REFERENCE = "(the BUSINESS DATA JSON is given in the next message)"
+
+
+# appended to the static prompt of every template (full and section calls
+# share one cached prefix)
+SECTION_MODE_RULES = """
+
+SECTION MODE
+============
+If the last message is "SECTION: <name>", this overrides the instruction to
+generate ALL website copy: generate ONLY the "<name>" top-level section of
+the content JSON. Return a JSON object with the single top-level key "<name>",
+whose value matches the "<name>" part of the schema exactly. Nothing else.
+Without a SECTION message, generate the full object as described above.
+"""
+
+SECTION_MESSAGE = "SECTION: {section}"
+
+
+class PromptPrefix:
+    __slots__ = ("template_id", "text", "mtimes", "sections")
+
+    def __init__(self, template_id: str, text: str, mtimes: Tuple[float, ...], sections: Dict[str, Any]):
+        self.template_id = template_id
+        self.text = text
+        self.mtimes = mtimes
+        # section name → its part of the schema ({} = schema is not valid JSON)
+        self.sections = sections
+
+
+_PREFIXES: Dict[str, PromptPrefix] = {}
+_LOCK = threading.Lock()
+
+
+def _prompt_files(template_id: str) -> Optional[Tuple[Path, Path]]:
+    template_conf = TEMPLATES.get(template_id)
+    if not template_conf:
+        return None
+    prompt_path = BASE_DIR / (template_conf.get("content_prompt") or DEFAULT_CONTENT_PROMPT)
+    return prompt_path, BASE_DIR / template_conf["schema"]
+
+
+def _schema_sections(schema_str: str) -> Dict[str, Any]:
+    try:
+        schema = json.loads(schema_str)
+    except ValueError:
+        return {}
+    if not isinstance(schema, dict):
+        return {}
+    # JSON Schema ("properties") or a plain example object (template_lawyer_01)
+    properties = schema.get("properties")
+    if isinstance(properties, dict):
+        return dict(properties)
+    return {key: value for key, value in schema.items() if not key.startswith("$")}
+
+
+def get_prompt_prefix(template_id: str) -> Optional[PromptPrefix]:
+    """Static system prompt (instructions + schema) of the template, cached."""
+    files = _prompt_files(template_id)
+    if files is None:
+        return None
+    prompt_path, schema_path = files
+    mtimes = (prompt_path.stat().st_mtime, schema_path.stat().st_mtime)
+
+    prefix = _PREFIXES.get(template_id)
+    if prefix is not None and prefix.mtimes == mtimes:
+        return prefix
+
+    prompt_template = prompt_path.read_text(encoding="utf-8")
+    schema_str = schema_path.read_text(encoding="utf-8")
+    text = (
+        prompt_template
+        .replace(SCHEMA_PLACEHOLDER, schema_str)
+        .replace(BUSINESS_DATA_PLACEHOLDER, BUSINESS_DATA_REFERENCE)
+    ) + SECTION_MODE_RULES
+    prefix = PromptPrefix(template_id, text, mtimes, _schema_sections(schema_str))
+    with _LOCK:
+        _PREFIXES[template_id] = prefix
+    return prefix
+
+
+def build_content_messages(
+    template_id: str,
+    project_row: Dict[str, Any],
+    update_obj: Dict[str, Any],
+) -> Optional[List[Dict[str, str]]]:
+    """[static prefix, business data] for the content completion (None = unknown template)."""
+    prefix = get_prompt_prefix(template_id)
+    if prefix is None:
+        return None
+
+    # BUSINESS_DATA_JSON – מה שיש לנו על הפרויקט + העדכון האחרון (סדר מפתחות קבוע)
+    business_data = json.dumps(
+        {"project": project_row, "update": update_obj},
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return [
+        {"role": "system", "content": prefix.text},
+        {"role": "user", "content": f"BUSINESS DATA\n=============\n{business_data}"},
+    ]
+
+
+def build_section_messages(
+    template_id: str,
+    section: str,
+    project_row: Dict[str, Any],
+    update_obj: Dict[str, Any],
+) -> Optional[List[Dict[str, str]]]:
+    """build_content_messages + a last "SECTION: <name>" message (see SECTION_MODE_RULES)."""
+    messages = build_content_messages(template_id, project_row, update_obj)
+    if messages is None:
+        return None
+    return messages + [{"role": "user", "content": SECTION_MESSAGE.format(section=section)}]
+
+
+# ==========================================
+# Usage – cached prompt tokens
+# ==========================================
+class PromptCacheStats:
+    def __init__(self):
+        self._by_key: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, usage: Any) -> None:
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        with self._lock:
+            entry = self._by_key.setdefault(key, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            entry["calls"] += 1
+            entry["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            entry["cached_tokens"] += cached
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out = {}
+            for key, entry in self._by_key.items():
+                ratio = entry["cached_tokens"] / entry["prompt_tokens"] if entry["prompt_tokens"] else 0.0
+                out[key] = {**entry, "cached_ratio": round(ratio, 3)}
+            return out
+
+
+prompt_cache_stats = PromptCacheStats()
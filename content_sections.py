@@ -0,0 +1,188 @@
+# content_sections.py
+#
+# Section-parallel content generation for the initial build.
+#
+# One completion used to fill the whole template schema: its latency grew
+# with the output tokens and one malformed section meant redoing everything.
+# Now, for a schema with several top-level sections (home, about, menu,
+# offers, contact...):
+#
+#   - every section is its own completion (content_prompts.build_section_messages);
+#     they run in parallel on a process-wide pool, so SITEGYN_CONTENT_SECTION_WORKERS
+#     caps the concurrent calls of all builds together
+#   - each reply is validated on its own: JSON object, the section's value
+#     has the schema's type and its required keys
+#   - only the sections that failed are retried (SITEGYN_CONTENT_SECTION_RETRIES
+#     rounds); the retry runs with RETRY_TEMPERATURE, since the same
+#     temperature=0 prompt would most likely give the same broken reply
+#   - the sections are merged in schema order; if one still fails the build
+#     fails (no half-filled content_json is saved)
+#
+# Calls at temperature=0 go through llm_cache like before; only replies that
+# validate are stored.
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from content_prompts import build_section_messages, get_prompt_prefix
+from llm_cache import cached_completion
+
+CONTENT_MODEL = "gpt-4.1-mini"
+SECTION_WORKERS = int(os.getenv("SITEGYN_CONTENT_SECTION_WORKERS", "8"))
+SECTION_RETRIES = int(os.getenv("SITEGYN_CONTENT_SECTION_RETRIES", "2"))
+RETRY_TEMPERATURE = 0.3
+
+_pool = ThreadPoolExecutor(max_workers=SECTION_WORKERS, thread_name_prefix="content-section")
+
+
+class SectionStats:
+    def __init__(self):
+        self._counts: Dict[str, int] = {"builds": 0, "sections": 0, "retries": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, count: int = 1) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + count
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+section_stats = SectionStats()
+
+
+# ==========================================
+# Validation
+# ==========================================
+def _strip_fence(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def _matches(value: Any, spec: Any) -> bool:
+    if isinstance(spec, dict) and isinstance(spec.get("type"), str):
+        # JSON Schema
+        expected = spec["type"]
+        if expected == "object":
+            return isinstance(value, dict) and all(key in value for key in spec.get("required") or [])
+        if expected == "array":
+            return isinstance(value, list) and len(value) >= int(spec.get("minItems") or 0)
+        if expected == "string":
+            return isinstance(value, str) and value.strip() != ""
+        return value is not None
+    # plain example object – same keys, same container types
+    if isinstance(spec, dict):
+        return isinstance(value, dict) and all(key in value for key in spec)
+    if isinstance(spec, list):
+        return isinstance(value, list)
+    return value is not None
+
+
+def section_value(text: str, section: str, spec: Any) -> Optional[Any]:
+    """Value of the section in the reply, or None if it does not validate."""
+    try:
+        reply = json.loads(_strip_fence(text or ""))
+    except ValueError:
+        return None
+    if not isinstance(reply, dict):
+        return None
+    # {"menu": {...}} as asked – or the section body alone
+    value = reply[section] if section in reply and len(reply) == 1 else reply
+    return value if _matches(value, spec) else None
+
+
+# ==========================================
+# Generation
+# ==========================================
+def has_sections(template_id: str) -> bool:
+    prefix = get_prompt_prefix(template_id)
+    return prefix is not None and len(prefix.sections) > 1
+
+
+def _generate_section(
+    client,
+    messages: List[Dict[str, str]],
+    section: str,
+    spec: Any,
+    temperature: float,
+    bypass_cache: bool,
+    on_usage: Optional[Callable[[Any], None]],
+) -> Optional[Any]:
+    try:
+        text = cached_completion(
+            client,
+            model=CONTENT_MODEL,
+            messages=messages,
+            temperature=temperature,
+            bypass=bypass_cache,
+            validate=lambda reply: section_value(reply, section, spec) is not None,
+            on_usage=on_usage,
+        )
+        return section_value(text, section, spec)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def generate_sections(
+    client,
+    template_id: str,
+    project_row: Dict[str, Any],
+    update_obj: Dict[str, Any],
+    bypass_cache: bool = False,
+    on_usage: Optional[Callable[[Any], None]] = None,
+) -> Optional[Dict[str, Any]]:
+    """content_json built section by section, or None if a section kept failing."""
+    prefix = get_prompt_prefix(template_id)
+    if prefix is None or not prefix.sections:
+        return None
+    section_stats.record("builds")
+
+    results: Dict[str, Any] = {}
+    pending = list(prefix.sections)
+    temperature = 0.0
+    for attempt in range(SECTION_RETRIES + 1):
+        futures = {}
+        for section in pending:
+            messages = build_section_messages(template_id, section, project_row, update_obj)
+            if messages is None:
+                return None
+            futures[section] = _pool.submit(
+                _generate_section,
+                client,
+                messages,
+                section,
+                prefix.sections[section],
+                temperature,
+                bypass_cache,
+                on_usage,
+            )
+        section_stats.record("sections", len(futures))
+
+        for section, future in futures.items():
+            value = future.result()
+            if value is not None:
+                results[section] = value
+        pending = [section for section in pending if section not in results]
+        if not pending:
+            break
+        if attempt < SECTION_RETRIES:
+            section_stats.record("retries", len(pending))
+        temperature = RETRY_TEMPERATURE
+
+    if pending:
+        section_stats.record("failed", len(pending))
+        print(f"content sections failed for {template_id}: {pending}")
+        return None
+    return {section: results[section] for section in prefix.sections}
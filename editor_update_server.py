@@ -1,20 +1,16 @@
-import os
-import json
-import re
+import copy
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
-from supabase import create_client
-from openai import OpenAI
 from flask_cors import CORS
+from update_parser import parse_update
+from content_patch import ContentConflict, apply_content_changes, apply_patch
+import content_history  # noqa: F401 – every write goes to the undo log
+from service_clients import get_openai, get_supabase
 
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-OPENAI_KEY = os.getenv("OPENAI_API_KEY")
-
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-client = OpenAI(api_key=OPENAI_KEY)
+supabase = get_supabase()
+client = get_openai()
 
 app = Flask(__name__)
 CORS(app)
@@ -37,27 +33,9 @@ def get_value_by_path(obj, path):
     return cur
 
 
-def set_value_by_path(obj, path, value):
-    keys = path.split(".")
-    cur = obj
-
-    for k in keys[:-1]:
-        if k not in cur or not isinstance(cur[k], dict):
-            cur[k] = {}
-        cur = cur[k]
-
-    cur[keys[-1]] = value
-
-
 def extract_update(text):
-    m = re.search(r"<update>(.*?)</update>", text, re.S)
-    if not m:
-        return None
-
-    try:
-        return json.loads(m.group(1))
-    except:
-        return None
+    # JSON שבור מתוקן מקומית (update_parser) במקום להחזיר None
+    return parse_update(text) or None
 
 
 # ===============================
@@ -76,9 +54,9 @@ def editor_update():
     if not project_id or not path or not message:
         return jsonify({"error":"missing parameters"}),400
 
-    # ---- load project content
+    # ---- load project content ("*" – כולל content_version אם קיימת)
     res = supabase.table("projects") \
-        .select("content_json") \
+        .select("*") \
         .eq("id", project_id) \
         .single() \
         .execute()
@@ -114,13 +92,18 @@ def editor_update():
             "changes": []
         })
 
-    for change in update.get("changes", []):
-        set_value_by_path(content, change["path"], change["value"])
-
-    supabase.table("projects") \
-        .update({"content_json": content}) \
-        .eq("id", project_id) \
-        .execute()
+    # ---- JSON Patch של השינויים בלבד (content_patch), לא כל ה-content_json;
+    # compare-and-swap מול הגרסה שנקראה, rebase אם שדות אחרים השתנו בינתיים
+    try:
+        ops = apply_content_changes(
+            project_id,
+            [(change["path"], change["value"]) for change in update.get("changes", [])],
+            base=copy.deepcopy(content),
+            expected_version=res.data.get("content_version"),
+        )
+    except ContentConflict as e:
+        return jsonify({"error": "content_conflict", "paths": e.paths}), 409
+    apply_patch(content, ops)
 
     return jsonify({
         "success": True,
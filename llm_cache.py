@@ -0,0 +1,267 @@
+# llm_cache.py
+#
+# Disk-backed memoization of deterministic OpenAI chat completions.
+#
+# The editor path of /api/chat, the /api/update-field services and
+# generate_content_for_project all call gpt-4.1-mini with temperature=0 and
+# are often repeated with the exact same input (re-clicking "rewrite",
+# retrying a failed request). Those completions are stored in SQLite:
+#
+#   - key = sha256 of model + temperature + normalized messages
+#     (line endings and surrounding whitespace do not change the key)
+#   - only calls with temperature <= SITEGYN_LLM_CACHE_MAX_TEMPERATURE
+#     are cached; anything else always goes to OpenAI
+#   - entries expire after SITEGYN_LLM_CACHE_TTL seconds
+#   - the file is kept under SITEGYN_LLM_CACHE_MAX_BYTES by evicting the
+#     least recently used entries
+#   - a caller can pass validate=... so a reply that turned out unusable
+#     (e.g. no <update> block) is never stored
+#   - request header "X-Sitegyn-Cache: bypass" (or Cache-Control: no-cache)
+#     skips the lookup; the fresh reply replaces the stored one
+#
+# SQLite in WAL mode, so several worker processes can share one file.
+# SITEGYN_LLM_CACHE=0 turns the cache off.
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+ENABLED = os.getenv("SITEGYN_LLM_CACHE", "1") != "0"
+CACHE_PATH = os.getenv(
+    "SITEGYN_LLM_CACHE_PATH",
+    str(Path(__file__).resolve().parent / ".cache" / "llm_cache.sqlite3"),
+)
+TTL_SECONDS = float(os.getenv("SITEGYN_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+MAX_BYTES = int(os.getenv("SITEGYN_LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+MAX_TEMPERATURE = float(os.getenv("SITEGYN_LLM_CACHE_MAX_TEMPERATURE", "0"))
+
+BYPASS_HEADER = "X-Sitegyn-Cache"
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    normalized = []
+    for message in messages:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = json.dumps(content, sort_keys=True, ensure_ascii=False)
+        normalized.append({
+            "role": message.get("role") or "user",
+            "content": content.replace("\r\n", "\n").strip(),
+        })
+    return normalized
+
+
+def completion_key(model: str, messages: List[Dict[str, Any]], temperature: float) -> str:
+    raw = json.dumps(
+        {"model": model, "temperature": float(temperature), "messages": normalize_messages(messages)},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_bypass_requested(headers: Mapping[str, str]) -> bool:
+    if (headers.get(BYPASS_HEADER) or "").strip().lower() == "bypass":
+        return True
+    return "no-cache" in (headers.get("Cache-Control") or "").lower()
+
+
+class LLMCache:
+    def __init__(self, path: str = CACHE_PATH, ttl_seconds: float = TTL_SECONDS, max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT response, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8")) + len(key)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute(
+                "SELECT key, size FROM completions ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                return
+            for key, size in rows:
+                conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    return
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM completions")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "evictions": self.evictions,
+        }
+
+
+# ==========================================
+# Process-wide cache + completion helpers
+# ==========================================
+llm_cache = LLMCache()
+
+
+def _cacheable(temperature: float) -> bool:
+    return ENABLED and temperature <= MAX_TEMPERATURE
+
+
+def _lookup(key: str, bypass: bool) -> Optional[str]:
+    if bypass:
+        llm_cache.bypasses += 1
+        return None
+    try:
+        return llm_cache.get(key)
+    except Exception:
+        # a broken cache file must never break the request
+        traceback.print_exc()
+        return None
+
+
+def _store(key: str, model: str, text: str, validate: Optional[Callable[[str], Any]]) -> None:
+    try:
+        if validate is None or validate(text):
+            llm_cache.put(key, model, text)
+    except Exception:
+        traceback.print_exc()
+
+
+def _report_usage(completion: Any, on_usage: Optional[Callable[[Any], None]]) -> None:
+    if on_usage is None:
+        return
+    try:
+        on_usage(getattr(completion, "usage", None))
+    except Exception:
+        traceback.print_exc()
+
+
+def cached_completion(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    bypass: bool = False,
+    validate: Optional[Callable[[str], Any]] = None,
+    on_usage: Optional[Callable[[Any], None]] = None,
+) -> str:
+    """
+    client.chat.completions.create(...) → reply text, memoized for deterministic calls.
+    on_usage(completion.usage) is called for every completion actually made.
+    """
+    if not _cacheable(temperature):
+        completion = client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+        _report_usage(completion, on_usage)
+        return completion.choices[0].message.content or ""
+
+    key = completion_key(model, messages, temperature)
+    text = _lookup(key, bypass)
+    if text is not None:
+        return text
+
+    completion = client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+    _report_usage(completion, on_usage)
+    text = completion.choices[0].message.content or ""
+    _store(key, model, text, validate)
+    return text
+
+
+async def acached_completion(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    bypass: bool = False,
+    validate: Optional[Callable[[str], Any]] = None,
+    on_usage: Optional[Callable[[Any], None]] = None,
+) -> str:
+    """Same as cached_completion for an AsyncOpenAI client (SQLite runs in a thread)."""
+    if not _cacheable(temperature):
+        completion = await client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+        _report_usage(completion, on_usage)
+        return completion.choices[0].message.content or ""
+
+    key = completion_key(model, messages, temperature)
+    text = await asyncio.to_thread(_lookup, key, bypass)
+    if text is not None:
+        return text
+
+    completion = await client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+    _report_usage(completion, on_usage)
+    text = completion.choices[0].message.content or ""
+    await asyncio.to_thread(_store, key, model, text, validate)
+    return text
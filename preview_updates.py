@@ -0,0 +1,346 @@
+# preview_updates.py
+#
+# Targeted live-preview updates for the editor iframe.
+#
+# The editor used to reload the whole /p/<subdomain> page after every edit
+# (full render + transfer + relayout for a one-word change). Now:
+#
+#   - the editor opens GET /api/projects/<id>/preview/stream (SSE)
+#   - the hub keeps, per watched project, the template id and the last known
+#     content_json + content_version (read once when the stream opens)
+#   - content_patch calls on_write(project_id, ops, version, before) after every
+#     write in this process; the ops are applied to the kept document, the
+#     template's reverse index (template_engine: path → slots, built from
+#     *_mapping.json) gives the affected element ids, and only their new
+#     inner html is pushed:
+#       event: fragments   data: {"version": 7, "fragments": {"hero-title": "..."}}
+#   - a gap in the versions (a write from another process / worker) → the
+#     document is re-read and every slot is re-rendered once; too many
+#     fragments → {"reload": true} and the editor reloads the iframe
+#   - projects nobody watches cost nothing: on_write returns at once
+#
+# The hub is per process – writes made by another service (update_server on
+# its own port) reach the editor through the Supabase realtime fallback that
+# editor.html already has.
+#
+# A stream lives as long as the editor tab. Under uvicorn, server_async serves
+# it as a native async route (aopen_preview_stream): an idle tab costs a
+# coroutine, not a thread. The Flask route (open_preview_stream) holds a
+# worker thread per tab – behind WSGIMiddleware that is one of the 40 threads
+# every other route shares – so it is capped at SITEGYN_PREVIEW_MAX_SYNC_STREAMS
+# and answers 503 above it; the editor then lives on the realtime fallback.
+#
+# SITEGYN_PREVIEW_MAX_FRAGMENTS      above this → reload event (default 200)
+# SITEGYN_PREVIEW_QUEUE_SIZE         events buffered per subscriber (default 32)
+# SITEGYN_PREVIEW_HEARTBEAT          seconds between SSE keep-alive comments (default 15)
+# SITEGYN_PREVIEW_MAX_SYNC_STREAMS   thread-holding streams per process (default 8)
+
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+import traceback
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from chat_stream import sse_event
+from content_patch import PathToken, add_write_listener, apply_patch, get_patch_store, pointer_tokens
+from template_engine import get_compiled_template
+
+MAX_FRAGMENTS = int(os.getenv("SITEGYN_PREVIEW_MAX_FRAGMENTS", "200"))
+QUEUE_SIZE = int(os.getenv("SITEGYN_PREVIEW_QUEUE_SIZE", "32"))
+HEARTBEAT_SECONDS = float(os.getenv("SITEGYN_PREVIEW_HEARTBEAT", "15"))
+MAX_SYNC_STREAMS = int(os.getenv("SITEGYN_PREVIEW_MAX_SYNC_STREAMS", "8"))
+
+
+def op_path_tokens(pointer: str) -> Tuple[PathToken, ...]:
+    """"/menu/pizzas/1/name" → ("menu", "pizzas", 1, "name") – same tokens as the mapping paths."""
+    return tuple(int(part) if part.isdigit() else part for part in pointer_tokens(pointer))
+
+
+class AsyncSubscriber(queue.Queue):
+    """
+    Subscriber of an asyncio stream: on_write runs on whatever thread wrote,
+    so every put also wakes the event loop the stream waits on.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__(maxsize=QUEUE_SIZE)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def put(self, item: Dict[str, Any], block: bool = True, timeout: Optional[float] = None) -> None:
+        super().put(item, block, timeout)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def next_event(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """The next event, or None after timeout seconds without one."""
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                pass
+            if self._wakeup.is_set():
+                # woken for an event already taken – wait for the next one
+                self._wakeup.clear()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+
+class _WatchedProject:
+    __slots__ = ("template_id", "content", "version", "subscribers")
+
+    def __init__(self, template_id: str, content: Dict[str, Any], version: Optional[int]):
+        self.template_id = template_id
+        self.content = content
+        self.version = version
+        self.subscribers: List["queue.Queue[Dict[str, Any]]"] = []
+
+
+class PreviewHub:
+    def __init__(self):
+        self._projects: Dict[str, _WatchedProject] = {}
+        self._lock = threading.Lock()
+        self._sync_streams = 0
+        self._counts: Dict[str, int] = {
+            "events": 0, "fragments": 0, "bytes": 0, "resyncs": 0, "reloads": 0, "dropped": 0, "refused": 0,
+        }
+
+    # ---------- subscribers ----------
+    def subscribe(
+        self,
+        project_id: str,
+        template_id: str,
+        content: Optional[Dict[str, Any]],
+        version: Optional[int],
+        subscriber: Optional["queue.Queue[Dict[str, Any]]"] = None,
+    ) -> "queue.Queue[Dict[str, Any]]":
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=QUEUE_SIZE)
+        project_id = str(project_id)
+        with self._lock:
+            watched = self._projects.get(project_id)
+            if watched is None or watched.template_id != template_id:
+                watched = _WatchedProject(template_id, content if isinstance(content, dict) else {}, version)
+                if project_id in self._projects:
+                    watched.subscribers = self._projects[project_id].subscribers
+                self._projects[project_id] = watched
+            watched.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, project_id: str, subscriber: "queue.Queue[Dict[str, Any]]") -> None:
+        project_id = str(project_id)
+        with self._lock:
+            watched = self._projects.get(project_id)
+            if watched is None:
+                return
+            if subscriber in watched.subscribers:
+                watched.subscribers.remove(subscriber)
+            if not watched.subscribers:
+                del self._projects[project_id]
+
+    # ---------- writes ----------
+    def on_write(
+        self,
+        project_id: str,
+        ops: List[Dict[str, Any]],
+        version: Optional[int],
+        before: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        project_id = str(project_id)
+        with self._lock:
+            watched = self._projects.get(project_id)
+            if watched is None:
+                return
+            in_order = version is None or watched.version is None or version == watched.version + 1
+            if in_order:
+                watched.content = apply_patch(watched.content, ops)
+                changed = [op_path_tokens(op.get("path", "")) for op in ops]
+
+        if not in_order:
+            # another writer's patches are missing from our copy → re-read once
+            content, version = get_patch_store().load(project_id)
+            changed = [()]
+            with self._lock:
+                watched = self._projects.get(project_id)
+                if watched is None:
+                    return
+                watched.content = content
+                self._counts["resyncs"] += 1
+
+        with self._lock:
+            watched.version = version
+            event = self._event(watched, changed, version)
+            subscribers = list(watched.subscribers)
+        for subscriber in subscribers:
+            self._put(subscriber, event)
+
+    def _event(self, watched: _WatchedProject, changed: List[Tuple[PathToken, ...]], version: Optional[int]) -> Dict[str, Any]:
+        compiled = get_compiled_template(watched.template_id)
+        fragments = compiled.render_fragments(watched.content, changed) if compiled is not None else None
+        if fragments is None or len(fragments) > MAX_FRAGMENTS:
+            self._counts["reloads"] += 1
+            return {"version": version, "reload": True}
+        self._counts["events"] += 1
+        self._counts["fragments"] += len(fragments)
+        self._counts["bytes"] += sum(len(html.encode("utf-8")) for html in fragments.values())
+        return {"version": version, "fragments": fragments}
+
+    def _put(self, subscriber: "queue.Queue[Dict[str, Any]]", event: Dict[str, Any]) -> None:
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            # a stalled client: skipped fragments can't be replayed → full reload
+            with self._lock:
+                self._counts["dropped"] += 1
+            try:
+                while True:
+                    subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            subscriber.put_nowait({"version": event.get("version"), "reload": True})
+
+    # ---------- SSE ----------
+    def reserve_sync_stream(self) -> bool:
+        """Take one of the MAX_SYNC_STREAMS thread-holding slots; False if all are taken."""
+        with self._lock:
+            if self._sync_streams >= MAX_SYNC_STREAMS:
+                self._counts["refused"] += 1
+                return False
+            self._sync_streams += 1
+            return True
+
+    def release_sync_stream(self) -> None:
+        with self._lock:
+            self._sync_streams -= 1
+
+    def stream(self, project_id: str, subscriber: "queue.Queue[Dict[str, Any]]") -> Iterator[str]:
+        """SSE frames for one subscriber until the client goes away."""
+        try:
+            yield sse_event("ready", {"project_id": str(project_id)})
+            while True:
+                try:
+                    event = subscriber.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # keep-alive comment – proxies drop idle connections
+                    yield ": ping\n\n"
+                    continue
+                yield sse_event("reload" if event.get("reload") else "fragments", event)
+        finally:
+            self.unsubscribe(project_id, subscriber)
+
+    async def astream(self, project_id: str, subscriber: AsyncSubscriber) -> AsyncIterator[str]:
+        """Same frames as stream(), awaiting the events instead of blocking a thread."""
+        try:
+            yield sse_event("ready", {"project_id": str(project_id)})
+            while True:
+                event = await subscriber.next_event(HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                yield sse_event("reload" if event.get("reload") else "fragments", event)
+        finally:
+            self.unsubscribe(project_id, subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "watched_projects": len(self._projects),
+                "subscribers": sum(len(w.subscribers) for w in self._projects.values()),
+                "sync_streams": self._sync_streams,
+                **self._counts,
+            }
+
+
+preview_hub = PreviewHub()
+add_write_listener(preview_hub.on_write)
+
+
+class _SyncStream:
+    """
+    stream() holding one thread slot. The WSGI server calls close() when the
+    response ends – also for a generator that never started, whose finally
+    would not run – so the slot and the subscriber are always given back.
+    """
+
+    def __init__(self, project_id: str, subscriber: "queue.Queue[Dict[str, Any]]"):
+        self._project_id = project_id
+        self._subscriber = subscriber
+        self._frames = preview_hub.stream(project_id, subscriber)
+        self._closed = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self._frames
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._frames.close()
+        preview_hub.unsubscribe(self._project_id, self._subscriber)
+        preview_hub.release_sync_stream()
+
+
+def _subscribe_project(
+    project: Dict[str, Any],
+    project_id: str,
+    subscriber: Optional["queue.Queue[Dict[str, Any]]"] = None,
+) -> "queue.Queue[Dict[str, Any]]":
+    return preview_hub.subscribe(
+        project_id,
+        project.get("selected_template_id") or "",
+        project.get("content_json"),
+        project.get("content_version"),
+        subscriber,
+    )
+
+
+def open_preview_stream(supabase, project_id: str) -> Optional[_SyncStream]:
+    """
+    Subscribe the caller to the project's preview updates; None if the project
+    does not exist. ValueError("too_many_preview_streams") when every
+    thread-holding slot is taken.
+    """
+    if not preview_hub.reserve_sync_stream():
+        raise ValueError("too_many_preview_streams")
+    try:
+        rows = (
+            supabase.table("projects")
+            .select("*")
+            .eq("id", project_id)
+            .limit(1)
+            .execute()
+            .data
+        )
+    except Exception:
+        traceback.print_exc()
+        rows = None
+    if not rows:
+        preview_hub.release_sync_stream()
+        return None
+
+    return _SyncStream(project_id, _subscribe_project(rows[0], project_id))
+
+
+async def aopen_preview_stream(supabase, project_id: str) -> Optional[AsyncIterator[str]]:
+    """open_preview_stream for asyncio routes (supabase = AsyncClient); no slot limit."""
+    try:
+        resp = await (
+            supabase.table("projects")
+            .select("*")
+            .eq("id", project_id)
+            .limit(1)
+            .execute()
+        )
+    except Exception:
+        traceback.print_exc()
+        return None
+    if not resp.data:
+        return None
+
+    subscriber = _subscribe_project(resp.data[0], project_id, AsyncSubscriber(asyncio.get_running_loop()))
+    return preview_hub.astream(project_id, subscriber)
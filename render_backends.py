@@ -0,0 +1,113 @@
+# render_backends.py
+#
+# Render backends – same input (template_id + content_json), same output HTML.
+#
+#   bs4       – the original _render_template: html.parser + soup.find(id=...)
+#               per mapping key. This is the reference implementation.
+#   compiled  – template_engine: template parsed once into chunks + slots.
+#
+# (An lxml tree-builder backend was dropped: lxml serializes void elements
+# and the doctype differently, so it can never be byte-identical to bs4.
+# It is listed in DROPPED_BACKENDS, so asking for it says why instead of
+# "unknown backend", and render_conformance prints it as not checked.)
+#
+# The backend is chosen per deployment with SITEGYN_RENDER_BACKEND
+# (default: compiled). Run render_conformance.py before switching – it
+# renders every template through every backend and diffs against bs4.
+
+from __future__ import annotations
+
+import abc
+import os
+from typing import Any, Dict, Iterator, Optional
+
+from build_service import _render_template
+from template_engine import compile_all_templates, get_compiled_template, load_template_source
+
+DEFAULT_BACKEND = os.getenv("SITEGYN_RENDER_BACKEND", "compiled")
+
+
+class RenderBackend(abc.ABC):
+    name = ""
+
+    def warm_up(self) -> None:
+        """Load every template in TEMPLATES (call once at startup)."""
+        from templates_config import TEMPLATES
+
+        for template_id in TEMPLATES:
+            load_template_source(template_id)
+
+    def template_version(self, template_id: str) -> Optional[str]:
+        """Version of the template (None if template_id is unknown)."""
+        source = load_template_source(template_id)
+        return source[2] if source else None
+
+    @abc.abstractmethod
+    def render(self, template_id: str, content_json: Dict[str, Any]) -> Optional[str]:
+        """Full page HTML (None if template_id is unknown)."""
+
+    def iter_render(self, template_id: str, content_json: Dict[str, Any]) -> Iterator[str]:
+        """Streaming variant of render(); tree-based backends yield the whole page at once."""
+        html = self.render(template_id, content_json)
+        if html is not None:
+            yield html
+
+
+class Bs4Backend(RenderBackend):
+    name = "bs4"
+
+    def render(self, template_id: str, content_json: Dict[str, Any]) -> Optional[str]:
+        source = load_template_source(template_id)
+        if source is None:
+            return None
+        html_source, mapping, _ = source
+        return _render_template(html_source, {"content_json": content_json}, mapping)
+
+
+class CompiledBackend(RenderBackend):
+    name = "compiled"
+
+    def warm_up(self) -> None:
+        compile_all_templates()
+
+    def template_version(self, template_id: str) -> Optional[str]:
+        compiled = get_compiled_template(template_id)
+        return compiled.version if compiled else None
+
+    def render(self, template_id: str, content_json: Dict[str, Any]) -> Optional[str]:
+        compiled = get_compiled_template(template_id)
+        if compiled is None:
+            return None
+        return compiled.render(content_json)
+
+    def iter_render(self, template_id: str, content_json: Dict[str, Any]) -> Iterator[str]:
+        compiled = get_compiled_template(template_id)
+        if compiled is not None:
+            yield from compiled.iter_render(content_json)
+
+
+BACKENDS = {
+    Bs4Backend.name: Bs4Backend,
+    CompiledBackend.name: CompiledBackend,
+}
+
+# name → why it is not offered (kept so the error / conformance output says so)
+DROPPED_BACKENDS = {
+    "lxml": "dropped – lxml serializes void elements and the doctype differently, "
+            "so it can never be byte-identical to bs4",
+}
+
+_INSTANCES: Dict[str, RenderBackend] = {}
+
+
+def get_render_backend(name: Optional[str] = None) -> RenderBackend:
+    name = name or DEFAULT_BACKEND
+    backend = _INSTANCES.get(name)
+    if backend is None:
+        if name in DROPPED_BACKENDS:
+            raise ValueError(f"Render backend {name} is not available: {DROPPED_BACKENDS[name]}")
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown render backend: {name} (expected one of {', '.join(BACKENDS)})")
+        backend = BACKENDS[name]()
+        _INSTANCES[name] = backend
+    return backend
@@ -0,0 +1,351 @@
+# render_benchmark.py
+#
+# Render benchmark – how much does a page view cost per template?
+#
+# For every template in TEMPLATES:
+#   1. builds a realistic content_json from its *_schema.json (arrays filled
+#      to maxItems, text lengths by field name); mapping paths the schema does
+#      not cover are filled as well, so every slot has a value
+#   2. renders it through
+#        - build_service._render_template   (bs4 reference)
+#        - every available render backend
+#        - render_service.render_project_html, cold (empty render cache) and
+#          warm, against an in-memory Supabase stub
+#   3. reports p50 / p99 latency, tracemalloc allocations and output size
+#
+# Results can be saved as JSON and compared across commits:
+#   python render_benchmark.py --save bench/base.json
+#   python render_benchmark.py --compare bench/base.json
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# build_service creates a Supabase client on import – no network is used here,
+# the client is replaced by InMemorySupabase below.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "bench.bench.bench")
+
+import build_service  # noqa: E402
+import render_service  # noqa: E402
+from build_service import _render_template, compile_path  # noqa: E402
+from render_backends import BACKENDS, get_render_backend  # noqa: E402
+from render_cache import render_cache  # noqa: E402
+from render_conformance import set_by_accessor  # noqa: E402
+from template_engine import load_template_source  # noqa: E402
+
+WORDS = (
+    "fresh wood fired oven crispy crust local family recipe since care team "
+    "trusted experience modern clinic friendly expert course lesson support "
+    "quality service fast delivery booking today premium award winning"
+).split()
+
+
+# ==========================================
+# In-memory Supabase stub
+# ==========================================
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self._rows = rows
+        self._columns: Optional[List[str]] = None
+        self._filters: List[Any] = []
+        self._limit: Optional[int] = None
+        self._single = False
+        self._update: Optional[Dict[str, Any]] = None
+
+    def select(self, columns: str = "*", **_):
+        if columns.strip() != "*":
+            self._columns = [c.strip() for c in columns.split(",")]
+        return self
+
+    def update(self, values: Dict[str, Any], **_):
+        self._update = values
+        return self
+
+    def eq(self, column: str, value: Any):
+        self._filters.append((column, value))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def order(self, *_, **__):
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def execute(self) -> _Result:
+        rows = [r for r in self._rows if all(r.get(c) == v for c, v in self._filters)]
+        if self._update is not None:
+            for row in rows:
+                row.update(copy.deepcopy(self._update))
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        if self._columns:
+            rows = [{c: row.get(c) for c in self._columns} for row in rows]
+        # a real client returns freshly decoded JSON every time
+        rows = copy.deepcopy(rows)
+        if self._single:
+            return _Result(rows[0] if rows else None)
+        return _Result(rows)
+
+
+class InMemorySupabase:
+    """Just enough of the supabase client for the render path."""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+
+    def table(self, name: str) -> _Query:
+        return _Query(self.tables.setdefault(name, []))
+
+
+# ==========================================
+# Synthetic content from *_schema.json
+# ==========================================
+def _text_for(field: str, rnd: random.Random) -> str:
+    field = field.lower()
+    if any(k in field for k in ("description", "text", "paragraph", "bio", "subtitle", "subheadline")):
+        count = rnd.randint(25, 45)
+    elif any(k in field for k in ("title", "headline", "name")):
+        count = rnd.randint(3, 7)
+    else:
+        count = rnd.randint(1, 4)
+    return " ".join(rnd.choice(WORDS) for _ in range(count)).capitalize()
+
+
+def _from_json_schema(node: Dict[str, Any], field: str, rnd: random.Random) -> Any:
+    node_type = node.get("type")
+    if node_type == "object" or "properties" in node:
+        return {
+            key: _from_json_schema(child, key, rnd)
+            for key, child in (node.get("properties") or {}).items()
+        }
+    if node_type == "array":
+        count = node.get("maxItems") or node.get("minItems") or 3
+        return [_from_json_schema(node.get("items") or {}, field, rnd) for _ in range(count)]
+    if node_type in ("integer", "number"):
+        return rnd.randint(1, 500)
+    if node_type == "boolean":
+        return True
+    return _text_for(field, rnd)
+
+
+def _from_example(node: Any, field: str, rnd: random.Random) -> Any:
+    """Schemas written as an empty example document (e.g. lawyer_01)."""
+    if isinstance(node, dict):
+        return {key: _from_example(child, key, rnd) for key, child in node.items()}
+    if isinstance(node, list):
+        return [_from_example(child, field, rnd) for child in node]
+    if isinstance(node, (int, float)) and not isinstance(node, bool):
+        return rnd.randint(1, 500)
+    return _text_for(field, rnd)
+
+
+def synthetic_content(template_id: str, seed: int = 0) -> Dict[str, Any]:
+    from templates_config import TEMPLATES
+
+    rnd = random.Random(seed)
+    content: Dict[str, Any] = {}
+
+    schema_path = Path(build_service.__file__).resolve().parent / TEMPLATES[template_id]["schema"]
+    try:
+        schema = json.loads(schema_path.read_text(encoding="utf-8"))
+        if "properties" in schema or schema.get("type") == "object":
+            content = _from_json_schema(schema, "", rnd)
+        else:
+            content = _from_example(schema, "", rnd)
+    except (OSError, ValueError) as e:
+        print(f"[bench] {template_id}: schema not usable ({e}) – using mapping paths only")
+
+    # every mapped slot gets a value, even if the schema does not describe it
+    _, mapping, _ = load_template_source(template_id)
+    for html_id, schema_path_expr in mapping.items():
+        if build_service.get_value_by_path(content, schema_path_expr) is None:
+            leaf = schema_path_expr.split(".")[-1].split("[")[0]
+            set_by_accessor(content, compile_path(schema_path_expr), _text_for(leaf, rnd))
+    return content
+
+
+# ==========================================
+# Measurement
+# ==========================================
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def measure(fn: Callable[[], Optional[str]], iterations: int, setup: Callable[[], None] = None) -> Dict[str, Any]:
+    # allocations of a single call
+    if setup:
+        setup()
+    tracemalloc.start()
+    output = fn()
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "p50_ms": round(statistics.median(samples), 4),
+        "p99_ms": round(_percentile(samples, 99), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "alloc_peak_kb": round(peak / 1024, 1),
+        "alloc_retained_kb": round(allocated / 1024, 1),
+        "output_bytes": len((output or "").encode("utf-8")),
+    }
+
+
+def benchmark_template(template_id: str, backend_names: List[str], iterations: int) -> Dict[str, Any]:
+    html_source, mapping, version = load_template_source(template_id)
+    content_json = synthetic_content(template_id)
+    project = {
+        "id": f"bench-{template_id}",
+        "subdomain": f"bench-{template_id}",
+        "selected_template_id": template_id,
+        "content_json": content_json,
+    }
+
+    stub = InMemorySupabase()
+    stub.tables["projects"] = [project]
+    build_service.supabase = stub
+    render_service.supabase = stub
+
+    results: Dict[str, Any] = {
+        "template_version": version,
+        "template_bytes": len(html_source.encode("utf-8")),
+        "slots": len(mapping),
+        "content_bytes": len(json.dumps(content_json, ensure_ascii=False).encode("utf-8")),
+        "cases": {},
+    }
+    cases = results["cases"]
+
+    cases["_render_template"] = measure(
+        lambda: _render_template(html_source, project, mapping), iterations
+    )
+
+    for name in backend_names:
+        try:
+            backend = get_render_backend(name)
+        except RuntimeError as e:
+            print(f"[bench] skip backend {name}: {e}")
+            continue
+        backend.warm_up()
+        cases[f"backend:{name}"] = measure(lambda: backend.render(template_id, content_json), iterations)
+
+    cases["render_project_html:cold"] = measure(
+        lambda: render_service.render_project_html(project["id"]), iterations, setup=render_cache.clear
+    )
+    render_cache.clear()
+    cases["render_project_html:warm"] = measure(
+        lambda: render_service.render_project_html(project["id"]), iterations
+    )
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(template_ids: List[str], backend_names: List[str], iterations: int) -> Dict[str, Any]:
+    return {
+        "commit": _git_commit(),
+        "render_backend": get_render_backend().name,
+        "iterations": iterations,
+        "python": sys.version.split()[0],
+        "templates": {
+            template_id: benchmark_template(template_id, backend_names, iterations)
+            for template_id in template_ids
+        },
+    }
+
+
+# ==========================================
+# Report
+# ==========================================
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"commit={results['commit']} iterations={results['iterations']} python={results['python']}")
+    header = f"{'template / case':<52}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>10}{'out KB':>9}"
+    if baseline:
+        header += f"{'Δp50':>9}"
+    print(header)
+
+    for template_id, data in results["templates"].items():
+        print(f"{template_id}  (template {data['template_bytes'] // 1024} KB, {data['slots']} slots)")
+        for case, m in data["cases"].items():
+            line = (
+                f"  {case:<50}{m['p50_ms']:>10.3f}{m['p99_ms']:>10.3f}"
+                f"{m['alloc_peak_kb']:>10.1f}{m['output_bytes'] / 1024:>9.1f}"
+            )
+            old = (((baseline or {}).get("templates") or {}).get(template_id) or {}).get("cases", {}).get(case)
+            if old and old.get("p50_ms"):
+                line += f"{(m['p50_ms'] / old['p50_ms'] - 1) * 100:>+8.1f}%"
+            print(line)
+
+
+def main(argv: List[str] = None) -> int:
+    from templates_config import TEMPLATES
+
+    parser = argparse.ArgumentParser(description="Benchmark template rendering")
+    parser.add_argument("--templates", default=",".join(TEMPLATES), help="comma separated template ids")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma separated backend names")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--save", help="write results JSON to this path")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        [tid.strip() for tid in args.templates.split(",") if tid.strip()],
+        [name.strip() for name in args.backends.split(",") if name.strip()],
+        args.iterations,
+    )
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+    print_report(results, baseline)
+
+    if args.save:
+        path = Path(args.save)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"[bench] saved {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# render_cache.py
+#
+# In-process LRU cache of rendered pages (bounded by bytes, not entries).
+#
+# Key = project_id + hash(content_json) + template_id + template version,
+# so a cached page can never be served for content it was not rendered from.
+#
+#   - render_service checks get_fresh(project_id) first: inside the freshness
+#     window the page is served without touching Supabase at all.
+#   - after the window the project is re-read and get(key) is tried: if
+#     content_json did not change, the same HTML is reused (no render).
+#   - every write path of content_json in the serving process (server.py /
+#     server_async) calls invalidate_project(project_id).
+#   - compressed variants (gzip / br) live inside the same entry: computed
+#     once per content version on first request, counted in the byte budget
+#     and dropped together with the HTML.
+#   - a small metadata map (project_id -> ETag / Last-Modified) outlives the
+#     HTML entries, so conditional GETs (If-None-Match) can be answered with
+#     304 inside the freshness window even after the page bytes were evicted.
+#
+# Writes done by another process (editor_update_server / content_update_service
+# / update_server run as separate Flask apps that never render, so they have
+# no cache to clear) show up once the freshness window (SITEGYN_RENDER_CACHE_TTL)
+# is over: the project is re-read and the content hash in the key no longer
+# matches.
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import brotli  # optional – without it only gzip variants are produced
+except ImportError:
+    brotli = None
+
+CacheKey = Tuple[str, str, str, str]
+
+DEFAULT_MAX_BYTES = int(os.getenv("SITEGYN_RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = float(os.getenv("SITEGYN_RENDER_CACHE_TTL", "5"))
+DEFAULT_MAX_META_ENTRIES = int(os.getenv("SITEGYN_RENDER_META_MAX_ENTRIES", "50000"))
+
+GZIP_LEVEL = int(os.getenv("SITEGYN_GZIP_LEVEL", "9"))
+BROTLI_QUALITY = int(os.getenv("SITEGYN_BROTLI_QUALITY", "9"))
+
+# Content-Encoding values we can serve, in order of preference
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # mtime=0 → same bytes for the same content (stable across processes)
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=BROTLI_QUALITY, mode=brotli.MODE_TEXT)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def content_hash(content_json: Optional[Dict[str, Any]]) -> str:
+    """Stable hash of content_json (key order does not matter)."""
+    raw = json.dumps(content_json or {}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(
+    project_id: str,
+    content_json: Optional[Dict[str, Any]],
+    template_id: str,
+    template_version: str,
+) -> CacheKey:
+    return (str(project_id), content_hash(content_json), template_id, template_version)
+
+
+def etag_for_key(key: CacheKey) -> str:
+    """Strong ETag (unquoted) – content hash + template version."""
+    return f"{key[1][:20]}-{key[3]}"
+
+
+class PageMeta:
+    """Validators of the latest known version of a project's page."""
+
+    __slots__ = ("etag", "last_modified", "validated_at")
+
+    def __init__(self, etag: str, last_modified: Optional[datetime]):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated_at = time.monotonic()
+
+
+class CacheEntry:
+    __slots__ = ("key", "html", "size", "validated_at", "etag", "last_modified", "variants")
+
+    def __init__(self, key: CacheKey, html: str, last_modified: Optional[datetime] = None):
+        self.key = key
+        self.html = html
+        self.size = len(html.encode("utf-8"))
+        self.validated_at = time.monotonic()
+        self.etag = etag_for_key(key)
+        self.last_modified = last_modified
+        # Content-Encoding -> compressed bytes of html
+        self.variants: Dict[str, bytes] = {}
+
+    @property
+    def project_id(self) -> str:
+        return self.key[0]
+
+
+class RenderCache:
+    """LRU of rendered HTML, evicting least recently used entries past max_bytes."""
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_meta_entries: int = DEFAULT_MAX_META_ENTRIES,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_meta_entries = max_meta_entries
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._meta: "OrderedDict[str, PageMeta]" = OrderedDict()
+        # project_id -> key of its latest rendered version
+        self._by_project: Dict[str, CacheKey] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- lookups ----------
+    def get_fresh(self, project_id: str) -> Optional[CacheEntry]:
+        """Latest entry of the project if it was validated inside the TTL window."""
+        with self._lock:
+            key = self._by_project.get(str(project_id))
+            entry = self._entries.get(key) if key else None
+            if entry is None or time.monotonic() - entry.validated_at > self.ttl_seconds:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        """Exact lookup after re-reading the project; renews the TTL window."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry.validated_at = time.monotonic()
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get_fresh_meta(self, project_id: str) -> Optional[PageMeta]:
+        """ETag / Last-Modified of the project if validated inside the TTL window."""
+        with self._lock:
+            meta = self._meta.get(str(project_id))
+            if meta is None or time.monotonic() - meta.validated_at > self.ttl_seconds:
+                return None
+            self._meta.move_to_end(str(project_id))
+            return meta
+
+    def remember_meta(self, project_id: str, etag: str, last_modified: Optional[datetime]) -> PageMeta:
+        meta = PageMeta(etag, last_modified)
+        with self._lock:
+            self._meta[str(project_id)] = meta
+            self._meta.move_to_end(str(project_id))
+            while len(self._meta) > self.max_meta_entries:
+                self._meta.popitem(last=False)
+        return meta
+
+    def get_variant(self, entry: CacheEntry, encoding: str) -> bytes:
+        """
+        Compressed body of the entry, compressed on first use and kept in the
+        entry (so it is evicted / invalidated together with the HTML).
+        """
+        body = entry.variants.get(encoding)
+        if body is not None:
+            return body
+
+        body = compress_body(entry.html.encode("utf-8"), encoding)
+        with self._lock:
+            if encoding in entry.variants:
+                return entry.variants[encoding]
+            entry.variants[encoding] = body
+            # only count bytes of entries that are still in the cache
+            if self._entries.get(entry.key) is entry:
+                entry.size += len(body)
+                self._bytes += len(body)
+                self._evict()
+        return body
+
+    # ---------- writes ----------
+    def put(self, key: CacheKey, html: str, last_modified: Optional[datetime] = None) -> CacheEntry:
+        entry = CacheEntry(key, html, last_modified)
+        self.remember_meta(entry.project_id, entry.etag, last_modified)
+        with self._lock:
+            # only the latest version of a project is worth keeping
+            old_key = self._by_project.get(entry.project_id)
+            if old_key is not None:
+                self._remove(old_key)
+            self._remove(key)
+
+            if entry.size > self.max_bytes:
+                return entry
+
+            self._entries[key] = entry
+            self._by_project[entry.project_id] = key
+            self._bytes += entry.size
+            self._evict()
+        return entry
+
+    def invalidate_project(self, project_id: str) -> None:
+        with self._lock:
+            self._meta.pop(str(project_id), None)
+            key = self._by_project.get(str(project_id))
+            if key is not None:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_project.clear()
+            self._meta.clear()
+            self._bytes = 0
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        if self._by_project.get(entry.project_id) == key:
+            del self._by_project[entry.project_id]
+
+    # ---------- stats ----------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "meta_entries": len(self._meta),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# ==========================================
+# Process-wide cache
+# ==========================================
+render_cache = RenderCache()
+
+
+def invalidate_project(project_id: Optional[str]) -> None:
+    """Call after every write of content_json (or anything else that changes the page)."""
+    if project_id:
+        render_cache.invalidate_project(project_id)
@@ -0,0 +1,157 @@
+# render_conformance.py
+#
+# Conformance check for render_backends.
+#
+# Renders every template in TEMPLATES with a set of fixture content_json
+# documents through every backend and diffs the HTML against the reference
+# backend (bs4 – the original _render_template). Any difference, even a
+# single byte, is reported.
+#
+# Usage:
+#   python render_conformance.py
+#   python render_conformance.py --backends compiled --templates template_pizza_01
+#
+# Exit code 0 = all backends conform, 1 = at least one mismatch.
+
+from __future__ import annotations
+
+import argparse
+import difflib
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from build_service import compile_path
+from render_backends import BACKENDS, DROPPED_BACKENDS, get_render_backend
+from template_engine import load_template_source
+
+REFERENCE_BACKEND = "bs4"
+
+TRICKY_TEXT = 'Tom & Jerry <b>"bold"</b> > 50% off – שלום ✓'
+TYPED_VALUES = [0, 12.5, True, ["a", "b"], {"k": "v"}, ""]
+
+
+# ==========================================
+# Fixtures – built from the template mapping
+# ==========================================
+def set_by_accessor(data: Dict[str, Any], accessor: Tuple[Any, ...], value: Any) -> None:
+    """Set a value along a compiled path, creating dicts / lists on the way."""
+    current: Any = data
+    for position, token in enumerate(accessor):
+        last = position == len(accessor) - 1
+        next_container: Any = None if last else ([] if isinstance(accessor[position + 1], int) else {})
+
+        if isinstance(token, int):
+            if not isinstance(current, list):
+                return
+            while len(current) <= token:
+                current.append(None)
+            if last:
+                current[token] = value
+            else:
+                if not isinstance(current[token], (dict, list)):
+                    current[token] = next_container
+                current = current[token]
+        else:
+            if not isinstance(current, dict):
+                return
+            if last:
+                current[token] = value
+            else:
+                if not isinstance(current.get(token), (dict, list)):
+                    current[token] = next_container
+                current = current[token]
+
+
+def build_fixtures(mapping: Dict[str, str]) -> List[Tuple[str, Dict[str, Any]]]:
+    items = list(mapping.items())
+
+    def fill(value_for) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        for position, (html_id, schema_path) in enumerate(items):
+            value = value_for(position, html_id)
+            if value is not None:
+                set_by_accessor(data, compile_path(schema_path), value)
+        return data
+
+    return [
+        ("empty", {}),
+        ("full", fill(lambda i, html_id: f"{html_id} value")),
+        ("escaping", fill(lambda i, html_id: TRICKY_TEXT)),
+        ("partial", fill(lambda i, html_id: f"{html_id} value" if i % 2 == 0 else None)),
+        ("types", fill(lambda i, html_id: TYPED_VALUES[i % len(TYPED_VALUES)])),
+    ]
+
+
+# ==========================================
+# Runner
+# ==========================================
+def _first_diff(expected: str, actual: str, context_lines: int) -> str:
+    diff = difflib.unified_diff(
+        expected.splitlines(),
+        actual.splitlines(),
+        fromfile=REFERENCE_BACKEND,
+        tofile="backend",
+        lineterm="",
+        n=1,
+    )
+    return "\n".join(list(diff)[:context_lines])
+
+
+def run_conformance(backend_names: List[str], template_ids: List[str], context_lines: int = 20) -> int:
+    reference = get_render_backend(REFERENCE_BACKEND)
+
+    for name, reason in DROPPED_BACKENDS.items():
+        print(f"[conformance] not checked: {name} ({reason})")
+
+    backends = []
+    for name in backend_names:
+        if name == REFERENCE_BACKEND:
+            continue
+        try:
+            backends.append(get_render_backend(name))
+        except ValueError as e:
+            print(f"[conformance] SKIP {name}: {e}")
+
+    failures = 0
+    for template_id in template_ids:
+        source = load_template_source(template_id)
+        if source is None:
+            print(f"[conformance] SKIP {template_id}: not in TEMPLATES")
+            continue
+        _, mapping, _ = source
+
+        for fixture_name, content_json in build_fixtures(mapping):
+            expected = reference.render(template_id, content_json)
+            for backend in backends:
+                actual = backend.render(template_id, content_json)
+                label = f"{template_id} / {fixture_name} / {backend.name}"
+                if actual == expected:
+                    print(f"[conformance] OK   {label}")
+                    continue
+                failures += 1
+                print(f"[conformance] FAIL {label}")
+                print(_first_diff(expected, actual or "", context_lines))
+
+    print(f"[conformance] {failures} mismatch(es)")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from templates_config import TEMPLATES
+
+    parser = argparse.ArgumentParser(description="Diff every render backend against bs4")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma separated backend names")
+    parser.add_argument("--templates", default=",".join(TEMPLATES), help="comma separated template ids")
+    parser.add_argument("--diff-lines", type=int, default=20, help="diff lines to print per mismatch")
+    args = parser.parse_args(argv)
+
+    failures = run_conformance(
+        [name.strip() for name in args.backends.split(",") if name.strip()],
+        [tid.strip() for tid in args.templates.split(",") if tid.strip()],
+        args.diff_lines,
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,40 +7,165 @@
 #   /p/<subdomain> → server.py קורא ל-render_project_html_by_subdomain()
 #   הפונקציה:
 #     1. מוצאת את ה-project לפי subdomain
-#     2. טוענת את ה-template + ה-mapping
-#     3. משתמשת ב-_render_template מתוך build_service
+#     2. לוקחת את ה-template דרך ה-render backend (ברירת מחדל: compiled)
+#     3. ממלאת את התוכן מתוך content_json
 #     4. מחזירה מחרוזת HTML מוכנה לדפדפן
 
 from __future__ import annotations
 
+import os
+import threading
+import time
 import traceback
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Iterator, Tuple
 
-# אנחנו ממחזרים את כל הלוגיקה של הבילדר:
-#   - supabase (חיבור)
-#   - _resolve_template_path
-#   - _load_template_mapping
-#   - _render_template (כולל הנרמול של content_json לפיצה)
-from build_service import (
-    supabase,
-    _resolve_template_path,
-    _load_template_mapping,
-    _render_template,
-)
+# אנחנו ממחזרים את החיבור של הבילדר (supabase), והרינדור עצמו עובר
+# דרך render_backends – ברירת המחדל היא template_engine (התבנית + mapping
+# מקומפלים פעם אחת ל-chunks + slots, פלט זהה ל-_render_template של build_service).
+from build_service import supabase
+from render_backends import get_render_backend
+from render_cache import CacheEntry, etag_for_key, render_cache, make_cache_key
 
 
-def _load_project_by_id(project_id: str) -> Optional[Dict[str, Any]]:
+# עמודת זמן העדכון של projects – ממנה נבנה Last-Modified. כבויה כברירת מחדל:
+# בסכמה הבסיסית אין updated_at (רק created_at). אם הוגדרה ולא קיימת –
+# מזוהה פעם אחת ויורדת מה-select (אחרת כל /p/ מחזיר 404)
+UPDATED_AT_COLUMN = os.getenv("SITEGYN_PROJECT_UPDATED_AT_COLUMN", "")
+
+# הרנדרר צריך רק את העמודות האלה – לא select("*") (עמודות צ'אט וכו')
+BASE_RENDER_COLUMNS = "id, selected_template_id, content_json"
+_updated_at_available = bool(UPDATED_AT_COLUMN)
+
+
+def _render_columns() -> str:
+    if _updated_at_available:
+        return f"{BASE_RENDER_COLUMNS}, {UPDATED_AT_COLUMN}"
+    return BASE_RENDER_COLUMNS
+
+
+def _missing_updated_at(error: Exception) -> bool:
+    text = str(error)
+    return bool(UPDATED_AT_COLUMN) and UPDATED_AT_COLUMN in text and ("42703" in text or "does not exist" in text)
+
+SUBDOMAIN_TTL_SECONDS = float(os.getenv("SITEGYN_SUBDOMAIN_TTL", "60"))
+SUBDOMAIN_NEGATIVE_TTL_SECONDS = float(os.getenv("SITEGYN_SUBDOMAIN_NEGATIVE_TTL", "30"))
+SUBDOMAIN_MAX_ENTRIES = int(os.getenv("SITEGYN_SUBDOMAIN_MAX_ENTRIES", "50000"))
+
+
+# ==========================================
+# subdomain → project_id resolver (TTL + negative caching)
+# ==========================================
+class SubdomainResolver:
     """
-    מחזיר רשומת project מלאה לפי id, או None אם לא נמצא / שגיאה.
+    זוכר subdomain → project_id לזמן מוגבל.
+    subdomain שלא קיים נשמר גם הוא (project_id=None) כדי שסריקות 404
+    על subdomains אקראיים לא יגיעו ל-Supabase.
     """
+
+    def __init__(
+        self,
+        ttl_seconds: float = SUBDOMAIN_TTL_SECONDS,
+        negative_ttl_seconds: float = SUBDOMAIN_NEGATIVE_TTL_SECONDS,
+        max_entries: int = SUBDOMAIN_MAX_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        # subdomain -> (project_id | None, expires_at)
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def lookup(self, subdomain: str) -> Tuple[bool, Optional[str]]:
+        """(found, project_id) – found=True עם project_id=None זו תשובה שלילית מה-cache."""
+        with self._lock:
+            item = self._entries.get(subdomain)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._entries[subdomain]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(subdomain)
+            if item[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, item[0]
+
+    def remember(self, subdomain: str, project_id: Optional[str]) -> None:
+        ttl = self.ttl_seconds if project_id else self.negative_ttl_seconds
+        with self._lock:
+            self._entries[subdomain] = (project_id, time.monotonic() + ttl)
+            self._entries.move_to_end(subdomain)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, subdomain: Optional[str] = None, project_id: Optional[str] = None) -> None:
+        with self._lock:
+            if subdomain:
+                self._entries.pop(subdomain, None)
+            if project_id:
+                stale = [sub for sub, (pid, _) in self._entries.items() if pid == project_id]
+                for sub in stale:
+                    del self._entries[sub]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+            }
+
+
+subdomain_resolver = SubdomainResolver()
+
+
+def invalidate_subdomain(subdomain: Optional[str] = None, project_id: Optional[str] = None) -> None:
+    """לקרוא אחרי שינוי subdomain של פרויקט (או יצירת subdomain חדש)."""
+    subdomain_resolver.forget(subdomain=subdomain, project_id=project_id)
+
+
+def render_stats() -> Dict[str, Any]:
+    return {
+        "subdomains": subdomain_resolver.stats(),
+        "pages": render_cache.stats(),
+    }
+
+
+# ==========================================
+# Supabase loaders
+# ==========================================
+def _select_project(column: str, value: str):
+    """select של עמודות הרינדור; עמודת updated_at שלא קיימת → יורדת פעם אחת ו-retry."""
+    global _updated_at_available
     try:
-        resp = (
+        return (
             supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
+            .select(_render_columns())
+            .eq(column, value)
             .limit(1)
             .execute()
         )
+    except Exception as e:
+        if not _updated_at_available or not _missing_updated_at(e):
+            raise
+        print(f"[render_service] column {UPDATED_AT_COLUMN} not found – rendering without Last-Modified")
+        _updated_at_available = False
+        return _select_project(column, value)
+
+
+def _load_project_by_id(project_id: str) -> Optional[Dict[str, Any]]:
+    """
+    מחזיר את עמודות הרינדור של project לפי id, או None אם לא נמצא / שגיאה.
+    """
+    try:
+        resp = _select_project("id", project_id)
         rows = getattr(resp, "data", []) or []
         if not rows:
             print(f"[render_service] project {project_id} not found")
@@ -51,55 +176,225 @@ def _load_project_by_id(project_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def _load_project_id_by_subdomain(subdomain: str) -> Optional[str]:
+def _load_project_by_subdomain(subdomain: str) -> Optional[Dict[str, Any]]:
     """
-    מאתר project_id לפי subdomain מתוך טבלת projects.
+    קריאה אחת ל-Supabase: id + template + content_json לפי subdomain.
+    שגיאת רשת נזרקת הלאה (כדי שלא תישמר כתשובה שלילית ב-resolver).
     """
+    resp = _select_project("subdomain", subdomain)
+    rows = getattr(resp, "data", []) or []
+    if not rows:
+        print(f"[render_service] project with subdomain={subdomain} not found")
+        return None
+    return rows[0]
+
+
+# ==========================================
+# Render
+# ==========================================
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """updated_at של Supabase (ISO string) → datetime; None אם אין / לא תקין."""
+    if not value:
+        return None
     try:
-        resp = (
-            supabase.table("projects")
-            .select("id")
-            .eq("subdomain", subdomain)
-            .limit(1)
-            .execute()
-        )
-        rows = getattr(resp, "data", []) or []
-        if not rows:
-            print(f"[render_service] project with subdomain={subdomain} not found")
-            return None
-        return rows[0]["id"]
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.replace(microsecond=0)
+
+
+class _PreparedRow:
+    """שורת project + כל מה שצריך כדי לרנדר אותה (בלי לרנדר עדיין)."""
+
+    __slots__ = ("backend", "template_id", "content_json", "key", "entry", "last_modified")
+
+    def __init__(self, backend, template_id, content_json, key, entry, last_modified):
+        self.backend = backend
+        self.template_id = template_id
+        self.content_json = content_json
+        self.key = key
+        self.entry = entry
+        self.last_modified = last_modified
+
+    @property
+    def etag(self) -> str:
+        return etag_for_key(self.key)
+
+
+def _prepare_project_row(project: Dict[str, Any]) -> Optional[_PreparedRow]:
+    """מכין שורת project לרינדור, או None אם התבנית לא קיימת."""
+    template_id = project.get("selected_template_id") or "template_pizza_02"
+
+    backend = get_render_backend()
+    version = backend.template_version(template_id)
+    if version is None:
+        print(f"[render_service] template not found for template_id={template_id}")
+        return None
+
+    content_json = project.get("content_json") or {}
+    last_modified = _parse_timestamp(project.get(UPDATED_AT_COLUMN)) if _updated_at_available else None
+
+    # אותו תוכן + אותה גרסת תבנית → אותו HTML, בלי לרנדר שוב
+    key = make_cache_key(project["id"], content_json, template_id, version)
+    render_cache.remember_meta(project["id"], etag_for_key(key), last_modified)
+    return _PreparedRow(backend, template_id, content_json, key, render_cache.get(key), last_modified)
+
+
+def _render_prepared(prepared: _PreparedRow) -> str:
+    if prepared.entry is not None:
+        return prepared.entry.html
+
+    rendered_html = prepared.backend.render(prepared.template_id, prepared.content_json)
+    prepared.entry = render_cache.put(prepared.key, rendered_html, prepared.last_modified)
+    return rendered_html
+
+
+def _stream_and_cache(prepared: _PreparedRow) -> Iterator[str]:
+    chunks = []
+    try:
+        for chunk in prepared.backend.iter_render(prepared.template_id, prepared.content_json):
+            chunks.append(chunk)
+            yield chunk
     except Exception:
+        # הכותרות כבר נשלחו – אין מה להחזיר חוץ מלוג
         traceback.print_exc()
-        return None
+        return
+    render_cache.put(prepared.key, "".join(chunks), prepared.last_modified)
 
 
 def render_project_html(project_id: str) -> Optional[str]:
     """
     רנדר מלא של אתר לפי project_id:
-      1. טוען את ה-project מ-Supabase
+      1. טוען את ה-project מ-Supabase (רק העמודות של הרינדור)
       2. בוחר template_id (עם ברירת מחדל template_pizza_02)
-      3. טוען HTML + mapping.json מהתיקייה sitegyn/templates/...
-      4. מריץ _render_template (אותו כמו בבילדר – כולל נרמול של content_json)
+      3. לוקח את התבנית (HTML + mapping.json) דרך ה-render backend
+      4. ממלא את התוכן מתוך content_json (פלט זהה ל-_render_template)
+         – התוצאה נשמרת ב-render_cache לפי project_id + hash של content_json
+           + גרסת התבנית, כך שצפייה חוזרת לא מרנדרת מחדש
       5. מחזיר מחרוזת HTML מוכנה. אם יש שגיאה – מחזיר None.
     """
     try:
+        # בתוך חלון ה-TTL – מגישים מה-cache בלי לגשת ל-Supabase בכלל
+        entry = render_cache.get_fresh(project_id)
+        if entry is not None:
+            return entry.html
+
         project = _load_project_by_id(project_id)
         if not project:
             return None
 
-        template_id = project.get("selected_template_id") or "template_pizza_02"
+        prepared = _prepare_project_row(project)
+        if prepared is None:
+            return None
+        return _render_prepared(prepared)
+
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+# ==========================================
+# Public pages (/p/<subdomain>) – validators first, render only if needed
+# ==========================================
+class PublicPage:
+    """
+    עמוד ציבורי שנפתר לפי subdomain, עוד לפני שרונדר.
+
+    etag / last_modified זמינים מיד (לפעמים רק מה-cache של ה-metadata,
+    בלי Supabase), כך ש-If-None-Match תואם מקבל 304 בלי רינדור.
+    html() / iter_chunks() טוענים ומרנדרים רק כשצריך באמת גוף.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        etag: str,
+        last_modified: Optional[datetime],
+        entry: Optional[CacheEntry] = None,
+        prepared: Optional[_PreparedRow] = None,
+    ):
+        self.project_id = project_id
+        self.etag = etag
+        self.last_modified = last_modified
+        self._entry = entry
+        self._prepared = prepared
+
+    def load(self) -> bool:
+        """טוען את ה-project אם עוד לא נטען (False = כבר לא קיים / תבנית חסרה)."""
+        if self._entry is not None or self._prepared is not None:
+            return True
+        project = _load_project_by_id(self.project_id)
+        prepared = _prepare_project_row(project) if project else None
+        if prepared is None:
+            return False
+        self._prepared = prepared
+        self.etag = prepared.etag
+        self.last_modified = prepared.last_modified
+        return True
+
+    def html(self) -> Optional[str]:
+        if not self.load():
+            return None
+        if self._entry is not None:
+            return self._entry.html
+        return _render_prepared(self._prepared)
+
+    def iter_chunks(self) -> Optional[Iterator[str]]:
+        """
+        generator של חלקי HTML: קודם ה-<head> הסטטי (CSS וכו') ואחר כך ה-body –
+        כדי שהדפדפן יתחיל להוריד stylesheets לפני שהרינדור נגמר.
+        עמוד שכבר ב-cache מוחזר כחלק אחד; עמוד שרונדר נשמר ב-cache בסוף ה-stream.
+        """
+        if not self.load():
+            return None
+        if self._entry is not None:
+            return iter((self._entry.html,))
+        if self._prepared.entry is not None:
+            return iter((self._prepared.entry.html,))
+        return _stream_and_cache(self._prepared)
 
-        template_path = _resolve_template_path(template_id)
-        if not template_path:
-            print(f"[render_service] template file not found for template_id={template_id}")
+    def encoded(self, encoding: str) -> Optional[bytes]:
+        """
+        גוף דחוס (gzip / br) מתוך ה-render_cache – נדחס פעם אחת לכל גרסת תוכן.
+        None אם העמוד עוד לא ב-cache (למשל בזמן stream ראשון).
+        """
+        entry = self._entry or (self._prepared.entry if self._prepared else None)
+        if entry is None:
             return None
+        return render_cache.get_variant(entry, encoding)
+
 
-        mapping = _load_template_mapping(template_id)
+def get_public_page(subdomain: str) -> Optional[PublicPage]:
+    """
+    פותר subdomain לעמוד (None = לא נמצא).
+
+    subdomain מוכר (או לא קיים) נפתר מה-resolver בלי Supabase; בתוך חלון
+    ה-TTL גם ה-ETag מגיע מה-cache. אחרת – קריאה אחת שמביאה גם את ה-id
+    וגם את התוכן.
+    """
+    try:
+        found, project_id = subdomain_resolver.lookup(subdomain)
+        if found:
+            if not project_id:
+                return None
+            entry = render_cache.get_fresh(project_id)
+            if entry is not None:
+                return PublicPage(project_id, entry.etag, entry.last_modified, entry=entry)
+            meta = render_cache.get_fresh_meta(project_id)
+            if meta is not None:
+                return PublicPage(project_id, meta.etag, meta.last_modified)
 
-        html_source = template_path.read_text(encoding="utf-8")
-        rendered_html = _render_template(html_source, project, mapping)
-        return rendered_html
+        project = _load_project_by_subdomain(subdomain)
+        subdomain_resolver.remember(subdomain, project["id"] if project else None)
+        if not project:
+            return None
 
+        prepared = _prepare_project_row(project)
+        if prepared is None:
+            return None
+        return PublicPage(project["id"], prepared.etag, prepared.last_modified, prepared=prepared)
     except Exception:
         traceback.print_exc()
         return None
@@ -120,10 +415,21 @@ def render_project_html_by_subdomain(subdomain: str) -> Optional[str]:
             return html
     """
     try:
-        project_id = _load_project_id_by_subdomain(subdomain)
-        if not project_id:
-            return None
-        return render_project_html(project_id)
+        page = get_public_page(subdomain)
+        return page.html() if page else None
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def stream_project_html_by_subdomain(subdomain: str) -> Optional[Iterator[str]]:
+    """
+    כמו render_project_html_by_subdomain, אבל מחזיר generator של חלקי HTML.
+    None = לא נמצא (מחליטים לפני שמתחילים לשלוח תשובה, כדי להחזיר 404).
+    """
+    try:
+        page = get_public_page(subdomain)
+        return page.iter_chunks() if page else None
     except Exception:
         traceback.print_exc()
         return None
@@ -133,8 +439,6 @@ if __name__ == "__main__":
     # בדיקה ידנית קטנה:
     #   export TEST_PROJECT_SUBDOMAIN=rotempizza
     #   python render_service.py
-    import os
-
     test_sub = os.getenv("TEST_PROJECT_SUBDOMAIN")
     if test_sub:
         html = render_project_html_by_subdomain(test_sub) or ""
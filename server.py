@@ -2,18 +2,46 @@ import os
 import json
 import traceback
 import random
-from typing import List, Dict, Any
-from pathlib import Path
+from typing import List, Dict, Any, Optional
 
-from flask import Flask, request, jsonify, send_from_directory, Response
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from dotenv import load_dotenv
 from flask_cors import CORS
-from supabase import create_client, Client
+from supabase import Client
 from openai import OpenAI
 from templates_config import TEMPLATES
+from chat_history import ChatHistoryManager
+from chat_writer import ChatMessageWriter
+from llm_cache import cached_completion, cache_bypass_requested, llm_cache
+from update_parser import UPDATE_FIELDS, parse_update, update_repair_stats
+from build_jobs import BuildJobQueue, DONE, PENDING
+from content_prompts import build_content_messages, prompt_cache_stats
+from content_sections import generate_sections, has_sections, section_stats
+from content_patch import (
+    ContentConflict,
+    apply_content_changes,
+    apply_content_ops,
+    changes_to_patch,
+    patch_stats,
+    path_tokens,
+    replace_content,
+)
+from preview_updates import open_preview_stream, preview_hub
+import content_history
+from content_history import history_stats
+from chat_stream import UpdateBlockFilter, sse_event
+from service_clients import get_openai, get_supabase, pool_stats, user_can_access_project
+from batch_edit import load_capabilities, validate_change
 
 # === Render On-The-Fly ===
-from render_service import render_project_html_by_subdomain
+from render_service import (
+    PublicPage,
+    get_public_page,
+    invalidate_subdomain,
+    render_stats,
+)
+from render_backends import get_render_backend
+from render_cache import invalidate_project, SUPPORTED_ENCODINGS
 
 # ==========================================
 # Load environment
@@ -30,8 +58,15 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
 if not OPENAI_API_KEY:
     raise RuntimeError("Missing OPENAI_API_KEY in environment")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-client = OpenAI(api_key=OPENAI_API_KEY)
+# משותפים לכל השירותים: pool, timeouts ו-retries (service_clients)
+supabase: Client = get_supabase()
+client = get_openai()
+
+# הודעות צ'אט נכתבות ב-batch ברקע (write-behind), לא על מסלול הבקשה
+message_writer = ChatMessageWriter(supabase)
+
+# חלון היסטוריה לצ'אט: תורות אחרונות בתוך תקציב טוקנים + סיכום מתגלגל
+history_manager = ChatHistoryManager(supabase, client, writer=message_writer)
 
 # ==========================================
 # Load Sitegyn system prompt
@@ -64,23 +99,26 @@ app = Flask(
 )
 CORS(app)
 
+# טעינה/קומפילציה של כל התבניות פעם אחת בעלייה (backend לפי SITEGYN_RENDER_BACKEND)
+get_render_backend().warm_up()
+
 
 # ==========================================
 # Helpers
 # ==========================================
-def parse_update_block(assistant_text: str) -> Dict[str, Any]:
-    """Extract JSON inside <update>...</update>."""
+def parse_update_block(assistant_text: str, fields=None, record: bool = True) -> Dict[str, Any]:
+    """Extract JSON inside <update>...</update> (broken JSON is repaired locally, see update_parser)."""
     try:
-        start = assistant_text.find("<update>")
-        end = assistant_text.find("</update>")
-        if start == -1 or end == -1:
-            return {}
-        raw = assistant_text[start + len("<update>"): end].strip()
-        return json.loads(raw) if raw else {}
+        return parse_update(assistant_text, fields=fields, record=record)
     except:
         traceback.print_exc()
         return {}
 
+
+def has_update_block(assistant_text: str) -> bool:
+    """llm_cache validator – only replies with a usable <update> are stored."""
+    return bool(parse_update_block(assistant_text, record=False))
+
 def get_value_by_path(obj: Dict[str, Any], path: str):
     try:
         curr = obj
@@ -94,7 +132,7 @@ def get_value_by_path(obj: Dict[str, Any], path: str):
 # Template selection
 # ============================
 def pick_template_for_project(project: Dict[str, Any],
-                              update_obj: Dict[str, Any]) -> str | None:
+                              update_obj: Dict[str, Any]) -> Optional[str]:
 
     existing = update_obj.get("selected_template_id") or project.get("selected_template_id")
     if existing:
@@ -112,58 +150,59 @@ def pick_template_for_project(project: Dict[str, Any],
     return random.choice(candidates)
 
 
-# ⬇️ כאן להדביק את generate_content_for_project ⬇️
+# ==========================================
+# Content generation (initial build)
+# ==========================================
+def _is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
 def generate_content_for_project(
     client: OpenAI,
     project_row: Dict[str, Any],
     update_obj: Dict[str, Any],
     template_id: str,
-) -> Dict[str, Any] | None:
+    bypass_cache: bool = False,
+) -> Optional[Dict[str, Any]]:
     """
     Use the generic content_fill_prompt + template schema
     to generate content_json for this project & template.
     אם משהו נכשל בדרך (קובץ חסר / GPT נופל) – נחזיר None
     ולא נשבור את זרימת העדכון ל-projects.
     """
+    on_usage = lambda usage: prompt_cache_stats.record(f"content:{template_id}", usage)
     try:
-        template_conf = TEMPLATES.get(template_id)
-        if not template_conf:
-            return None
-
-        base_dir = Path(__file__).resolve().parent
-
-        # 1) schema של הטמפלט
-        schema_path = base_dir / template_conf["schema"]
-        schema_str = schema_path.read_text(encoding="utf-8")
-
-        # 2) הפרומפט הכללי (או מה שמוגדר ב-content_prompt)
-        content_prompt_path = base_dir / "content_fill_prompt.txt"
-        if template_conf.get("content_prompt"):
-            content_prompt_path = base_dir / template_conf["content_prompt"]
-
-        prompt_template = content_prompt_path.read_text(encoding="utf-8")
-
-        # 3) BUSINESS_DATA_JSON – מה שיש לנו על הפרויקט + העדכון האחרון
-        business_data = {
-            "project": project_row,
-            "update": update_obj,
-        }
-        business_data_str = json.dumps(business_data, ensure_ascii=False)
+        # schema עם כמה sections – completion לכל section במקביל (content_sections)
+        if has_sections(template_id):
+            return generate_sections(
+                client,
+                template_id,
+                project_row,
+                update_obj,
+                bypass_cache=bypass_cache,
+                on_usage=on_usage,
+            )
 
-        # 4) מכניסים את ה-schema ואת BUSINESS_DATA לתוך הפרומפט
-        final_prompt = (
-            prompt_template
-            .replace("{{SCHEMA_JSON}}", schema_str)
-            .replace("{{BUSINESS_DATA_JSON}}", business_data_str)
-        )
+        # הוראות + schema (קבוע לכל טמפלט, נבנה פעם אחת) ואז BUSINESS_DATA – content_prompts
+        messages = build_content_messages(template_id, project_row, update_obj)
+        if not messages:
+            return None
 
-        # 5) קריאה שנייה ל-GPT שמחזירה JSON טהור בלבד
-        completion = client.chat.completions.create(
+        # קריאה שנייה ל-GPT שמחזירה JSON טהור בלבד
+        # (temperature=0 → נשמר ב-llm_cache; רק JSON תקין נשמר)
+        text = cached_completion(
+            client,
             model="gpt-4.1-mini",
-            messages=[{"role": "user", "content": final_prompt}],
+            messages=messages,
             temperature=0.0,
-        )
-        text = completion.choices[0].message.content.strip()
+            bypass=bypass_cache,
+            validate=_is_json,
+            on_usage=on_usage,
+        ).strip()
         content_json = json.loads(text)
         return content_json
 
@@ -171,6 +210,118 @@ def generate_content_for_project(
         traceback.print_exc()
         return None
 
+
+def run_initial_build(
+    project_id: str,
+    project_row: Dict[str, Any],
+    update_obj: Dict[str, Any],
+    template_id: str,
+    bypass_cache: bool = False,
+) -> bool:
+    """build_jobs worker: generate content_json and save it on the project."""
+    content_json = generate_content_for_project(
+        client,
+        project_row,
+        update_obj,
+        template_id,
+        bypass_cache=bypass_cache,
+    )
+    if not content_json:
+        return False
+
+    # compare-and-swap: אם בינתיים נכתב תוכן (עורך / בנייה אחרת) – לא לדרוס אותו
+    try:
+        replace_content(
+            project_id,
+            content_json,
+            base=project_row.get("content_json") or {},
+            expected_version=project_row.get("content_version"),
+        )
+    except ContentConflict:
+        print(f"content_json of {project_id} was written meanwhile – build result dropped")
+    invalidate_project(project_id)
+    return True
+
+
+# הבנייה הראשונית רצה ברקע – בקשת הצ'אט לא מחכה ל-completion הגדול
+build_queue = BuildJobQueue(run_initial_build)
+
+
+# ==========================================
+# Chat helpers (shared with server_async.py)
+# ==========================================
+CHAT_MODEL = "gpt-4.1-mini"
+
+# קריאה שנייה "נסתרת" כשהמודל לא החזיר <update>...</update>
+UPDATE_REPAIR_INSTRUCTION = (
+    "Your previous reply did not follow the instructions. "
+    "Now respond ONLY with a single <update>{...}</update> block "
+    "containing valid JSON for the current project. "
+    "Do not add any natural language or explanation."
+)
+# the edited field was changed elsewhere (another tab / worker) meanwhile
+CONTENT_CONFLICT_MESSAGE = "⚠️ This content was just changed elsewhere – please try again."
+
+
+def build_chat_messages(
+    is_editor: bool,
+    user_message: str,
+    history: List[Dict[str, Any]],
+    field_path: Optional[str] = None,
+    content_json: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, str]]:
+    messages = []
+
+    if is_editor:
+        current_value = get_value_by_path(content_json or {}, field_path) if field_path else ""
+
+        editor_prompt = (
+            EDITOR_UPDATE_PROMPT
+            .replace("{{FIELD_PATH}}", field_path or "")
+            .replace("{{CURRENT_VALUE}}", json.dumps(current_value, ensure_ascii=False))
+            .replace("{{USER_MESSAGE}}", user_message)
+        )
+
+        messages.append({
+            "role": "system",
+            "content": editor_prompt
+        })
+    else:
+        messages.append({
+            "role": "system",
+            "content": SITEGYN_SYSTEM_PROMPT
+        })
+
+        for row in history:
+            messages.append({"role": row["role"], "content": row["content"]})
+
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def strip_update_block(assistant_text: str) -> str:
+    """The assistant text as shown to the user (without <update>...</update>)."""
+    if "<update>" in assistant_text and "</update>" in assistant_text:
+        before = assistant_text.split("<update>")[0]
+        after = assistant_text.split("</update>")[-1]
+        return (before + after).strip()
+    return assistant_text
+
+
+def editor_payload_changes(editor_payload: Dict[str, Any]) -> Dict[str, Any]:
+    """{"content_json": {path: value}} / {"changes": [...]} from the editor → {path: value}."""
+    updates = {}
+
+    if isinstance(editor_payload.get("content_json"), dict):
+        updates = editor_payload["content_json"]
+
+    elif "changes" in editor_payload:
+        for change in editor_payload["changes"]:
+            updates[change["path"]] = change["value"]
+
+    return updates
+
+
 # ==========================================
 # ROUTES
 # ==========================================
@@ -196,281 +347,658 @@ def start_project():
 # ==========================================
 # CHAT — stores history + updates DB
 # ==========================================
-@app.route("/api/chat", methods=["POST"])
-def chat():
-    try:
-
-        data = request.get_json(force=True)
+def prepare_chat_turn(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate the request, save the user message and build the messages for
+    OpenAI. ValueError(<error code>) on a bad request.
+    """
+    project_id = data.get("project_id")
+    user_message = (data.get("message") or "").strip()
 
-        project_id = data.get("project_id")
-        user_message = (data.get("message") or "").strip()
+    source = data.get("source", "default")  # "editor" | "default"
+    field_path = data.get("field_path")  # NEW
 
-        source = data.get("source", "default")  # "editor" | "default"
-        field_path = data.get("field_path")  # NEW
+    is_editor = source == "editor"
 
-        is_editor = source == "editor"
+    if not project_id:
+        raise ValueError("missing_project_id")
+    if not user_message:
+        raise ValueError("empty_message")
 
-        if not project_id:
-            return jsonify({"error": "missing_project_id"}), 400
-        if not user_message:
-            return jsonify({"error": "empty_message"}), 400
-
-        # Save user message
-        if not is_editor:
-            supabase.table("chat_messages").insert({
-                "project_id": project_id,
-                "role": "user",
-                "content": user_message,
-            }).execute()
-
-        # Load entire history
-        history = supabase.table("chat_messages") \
-            .select("role, content") \
-            .eq("project_id", project_id) \
-            .order("created_at", desc=False) \
-            .execute().data or []
+    # History window (summary + recent turns) – before saving the new
+    # message, build_chat_messages appends it at the end
+    history = []
+    if not is_editor:
+        history = history_manager.window(project_id)
 
-        # Build messages
-        messages = []
-
-        if is_editor:
-            project_row = (
-                              supabase.table("projects")
-                              .select("content_json")
-                              .eq("id", project_id)
-                              .single()
-                              .execute()
-                              .data
-                          ) or {}
-
-            content_json = project_row.get("content_json") or {}
-            current_value = get_value_by_path(content_json, field_path) if field_path else ""
-
-            editor_prompt = (
-                EDITOR_UPDATE_PROMPT
-                .replace("{{FIELD_PATH}}", field_path or "")
-                .replace("{{CURRENT_VALUE}}", json.dumps(current_value, ensure_ascii=False))
-                .replace("{{USER_MESSAGE}}", user_message)
-            )
+        message_writer.enqueue(project_id, "user", user_message)
 
-            messages.append({
-                "role": "system",
-                "content": editor_prompt
-            })
+    # Build messages
+    content_json = None
+    project_row = {}
+    if is_editor:
+        # "*" – content_version (אם קיימת) + subdomain נשמרים ל-finish_chat_turn
+        project_row = (
+                          supabase.table("projects")
+                          .select("*")
+                          .eq("id", project_id)
+                          .single()
+                          .execute()
+                          .data
+                      ) or {}
+
+        content_json = project_row.get("content_json") or {}
+
+    return {
+        "project_id": project_id,
+        "user_message": user_message,
+        "field_path": field_path,
+        "is_editor": is_editor,
+        "temperature": 0.0 if is_editor else 0.5,
+        "messages": build_chat_messages(is_editor, user_message, history, field_path, content_json),
+        # base of the editor patch (compare-and-swap on content_version)
+        "content_json": content_json,
+        "content_version": project_row.get("content_version"),
+        "subdomain": project_row.get("subdomain"),
+    }
+
+
+def finish_chat_turn(turn: Dict[str, Any], assistant_text: str) -> Dict[str, Any]:
+    """
+    Everything after the assistant reply: save it, parse <update> (with the
+    hidden repair call), initial build / editor patch, and the JSON response.
+    """
+    project_id = turn["project_id"]
+    is_editor = turn["is_editor"]
+    messages = turn["messages"]
+
+    print("FIELD PATH:", turn["field_path"])
+    print("USER MESSAGE:", turn["user_message"])
+    print("ASSISTANT TEXT:", assistant_text)
+    print("====== AI RESPONSE ======")
+    print(assistant_text)
+    print("=========================")
+    editor_payload = None
+
+    if is_editor:
+        editor_payload = parse_update_block(assistant_text, record=False)
+
+        if editor_payload:
+            visible_text = assistant_text
         else:
-            messages.append({
-                "role": "system",
-                "content": SITEGYN_SYSTEM_PROMPT
-            })
-
-        if not is_editor:
-            for row in history:
-                messages.append({"role": row["role"], "content": row["content"]})
-
-        messages.append({"role": "user", "content": user_message})
+            visible_text = "⚠️ Failed to update content."
+    else:
+        # save assistant message only for non-editor chat
+        message_writer.enqueue(project_id, "assistant", assistant_text)
 
-        # OpenAI call
-        completion = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=messages,
-            temperature=0.0 if is_editor else 0.5,
-        )
-
-        assistant_text = completion.choices[0].message.content or ""
-        print("FIELD PATH:", field_path)
-        print("USER MESSAGE:", user_message)
-        print("ASSISTANT TEXT:", assistant_text)
-        print("====== AI RESPONSE ======")
-        print(assistant_text)
-        print("=========================")
-        editor_payload = None
-
-        if is_editor:
-            editor_payload = parse_update_block(assistant_text)
-
-            if editor_payload:
-                visible_text = assistant_text
-            else:
-                visible_text = "⚠️ Failed to update content."
-        else:
-            # save assistant message only for non-editor chat
-            supabase.table("chat_messages").insert({
-                "project_id": project_id,
-                "role": "assistant",
-                "content": assistant_text,
-            }).execute()
-
-            # show assistant text (without <update>)
-            visible_text = assistant_text
-            if "<update>" in assistant_text and "</update>" in assistant_text:
-                before = assistant_text.split("<update>")[0]
-                after = assistant_text.split("</update>")[-1]
-                visible_text = (before + after).strip()
+        # show assistant text (without <update>)
+        visible_text = strip_update_block(assistant_text)
 
 
 
-        # Parse <update> block מהתשובה הראשונה
-        update_obj = parse_update_block(assistant_text)
+    # Parse <update> block מהתשובה הראשונה (כולל תיקונים מקומיים – update_parser)
+    update_obj = parse_update_block(assistant_text, fields=None if is_editor else UPDATE_FIELDS)
    
 
-        # אם המודל לא החזיר בכלל <update>...</update> – נעשה קריאה שנייה "נסתרת"
-        if not update_obj:
+    # אם המודל לא החזיר בכלל <update>...</update> (וגם תיקון מקומי לא עזר) – נעשה קריאה שנייה "נסתרת"
+    if not update_obj:
+        update_repair_stats.record("llm_fallback")
+        try:
+            backend_messages = messages + [
+                {
+                    "role": "system",
+                    "content": UPDATE_REPAIR_INSTRUCTION,
+                }
+            ]
+            backend_text = cached_completion(
+                client,
+                model=CHAT_MODEL,
+                messages=backend_messages,
+                temperature=0.0,
+                bypass=turn.get("cache_bypass", False),
+                validate=has_update_block,
+            )
+            update_obj = parse_update_block(backend_text, fields=None if is_editor else UPDATE_FIELDS)
+
+            if is_editor:
+                editor_payload = update_obj
+        except Exception:
+            traceback.print_exc()
+            update_obj = {}
+
+    # ==========================================
+    # INITIAL BUILD (missing piece)
+    # ==========================================
+    # (רק לצ'אט הרגיל – בעורך ה-update הוא changes ל-content_json)
+    build_job = None
+    if update_obj and not is_editor:
+        project_row = (
+            supabase.table("projects")
+            .select("*")
+            .eq("id", project_id)
+            .single()
+            .execute()
+            .data
+        )
+
+        # ===============================
+        # 1. Template selection
+        # ===============================
+        template_id = pick_template_for_project(project_row, update_obj)
+
+        if template_id and not update_obj.get("selected_template_id"):
+            update_obj["selected_template_id"] = template_id
+
+        # ===============================
+        # 2. content_json (אם אין עדיין תוכן – נבנה ברקע, build_jobs)
+        # ===============================
+        # ה-prompt מחזיר תמיד "content_json": null – לא לדרוס תוכן קיים / בנייה שרצה
+        if not update_obj.get("content_json"):
+            update_obj.pop("content_json", None)
+
+        needs_build = bool(template_id) and not (project_row.get("content_json") or update_obj.get("content_json"))
+
+        # ===============================
+        # 3. Create subdomain (🔥 חשוב)
+        # ===============================
+        if not project_row.get("subdomain"):
+            update_obj["subdomain"] = f"site-{project_id[:6]}"
+
+        # ===============================
+        # 4. Save everything together
+        # ===============================
+        # content_json מלא מהצ'אט עובר דרך content_patch (compare-and-swap על content_version)
+        project_update = {k: v for k, v in update_obj.items() if k != "content_json"}
+        if project_update:
+            supabase.table("projects").update(project_update).eq("id", project_id).execute()
+        if update_obj.get("content_json"):
             try:
-                backend_messages = messages + [
-                    {
-                        "role": "system",
-                        "content": (
-                            "Your previous reply did not follow the instructions. "
-                            "Now respond ONLY with a single <update>{...}</update> block "
-                            "containing valid JSON for the current project. "
-                            "Do not add any natural language or explanation."
-                        ),
-                    }
-                ]
-                completion2 = client.chat.completions.create(
-                    model="gpt-4.1-mini",
-                    messages=backend_messages,
-                    temperature=0.0,
-                )
-                backend_text = completion2.choices[0].message.content or ""
-                update_obj = parse_update_block(backend_text)
-
-                if is_editor:
-                    editor_payload = update_obj
-            except Exception:
-                traceback.print_exc()
-                update_obj = {}
-
-                # ==========================================
-                # INITIAL BUILD (missing piece)
-                # ==========================================
-                project_row = (
-                    supabase.table("projects")
-                    .select("*")
-                    .eq("id", project_id)
-                    .single()
-                    .execute()
-                    .data
+                replace_content(
+                    project_id,
+                    update_obj["content_json"],
+                    base=project_row.get("content_json") or {},
+                    expected_version=project_row.get("content_version"),
                 )
+            except ContentConflict:
+                print(f"content_json of {project_id} changed meanwhile – chat content not saved")
+        invalidate_project(project_id)
+        invalidate_subdomain(update_obj.get("subdomain"), project_id)
+
+        # ===============================
+        # 5. Initial build → job queue (dedupe לכל פרויקט)
+        # ===============================
+        if needs_build:
+            build_job = build_queue.submit(
+                project_id,
+                project_row,
+                dict(update_obj),
+                template_id,
+                turn.get("cache_bypass", False),
+            )
 
-                # אם אין עדיין תוכן – נבנה
-                if update_obj:
-
-                    # ===============================
-                    # 1. Template selection
-                    # ===============================
-                    template_id = pick_template_for_project(project_row, update_obj)
-
-                    if template_id and not update_obj.get("selected_template_id"):
-                        update_obj["selected_template_id"] = template_id
-
-                    # ===============================
-                    # 2. Generate content_json
-                    # ===============================
-                    if template_id and not (project_row.get("content_json") or update_obj.get("content_json")):
-
-                        content_json = generate_content_for_project(
-                            client,
-                            project_row,
-                            update_obj,
-                            template_id
-                        )
-
-                        if content_json:
-                            update_obj["content_json"] = content_json
-
-                    # ===============================
-                    # 3. Create subdomain (🔥 חשוב)
-                    # ===============================
-                    if not project_row.get("subdomain"):
-                        update_obj["subdomain"] = f"site-{project_id[:6]}"
-
-                    # ===============================
-                    # 4. Save everything together
-                    # ===============================
-                    supabase.table("projects").update(update_obj).eq("id", project_id).execute()
-
-        # ===== Editor content patch =====
-        if is_editor and editor_payload:
-            project_row = (
-                supabase.table("projects")
-                .select("content_json")
-                .eq("id", project_id)
-                .single()
-                .execute()
-                .data
+    # ===== Editor content patch =====
+    content_conflict = False
+    if is_editor and editor_payload:
+        # JSON Patch של השדות שהשתנו בלבד (content_patch), compare-and-swap מול
+        # הגרסה שה-prompt נבנה ממנה – rebase אוטומטי אם שדות אחרים השתנו בינתיים
+        try:
+            apply_content_changes(
+                project_id,
+                editor_payload_changes(editor_payload),
+                base=turn.get("content_json"),
+                expected_version=turn.get("content_version"),
             )
+            invalidate_project(project_id)
+        except ContentConflict:
+            content_conflict = True
 
-            content = project_row.get("content_json") or {}
+        # ensure subdomain exists
+        if not turn.get("subdomain"):
+            sub = f"site-{project_id[:6]}"
 
-            updates = {}
+            supabase.table("projects").update({
+                "subdomain": sub
+            }).eq("id", project_id).execute()
+            invalidate_subdomain(sub, project_id)
 
-            if "content_json" in editor_payload:
-                updates = editor_payload["content_json"]
+    final_message = visible_text
 
-            elif "changes" in editor_payload:
-                for change in editor_payload["changes"]:
-                    updates[change["path"]] = change["value"]
+    # אם זה עדכון (יש update או editor)
+    if update_obj or editor_payload:
+        final_message = "Content updated"
+    if content_conflict:
+        final_message = CONTENT_CONFLICT_MESSAGE
 
-            for path, value in updates.items():
+    # שלוף subdomain מהDB
+    project_row = (
+        supabase.table("projects")
+        .select("subdomain")
+        .eq("id", project_id)
+        .single()
+        .execute()
+        .data
+    )
 
-                keys = path.split(".")
-                curr = content
+    subdomain = project_row.get("subdomain") if project_row else None
 
-                for k in keys[:-1]:
-                    curr = curr.setdefault(k, {})
+    return {
+        "reply": final_message,
+        "project_id": project_id,
+        "subdomain": subdomain,
+        # queued / running → poll /api/projects/<id>/build_status
+        "build_status": build_job.status if build_job else None,
+    }
 
-                curr[keys[-1]] = value
 
-            supabase.table("projects").update({
-                "content_json": content
-            }).eq("id", project_id).execute()
+@app.route("/api/chat", methods=["POST"])
+def chat():
+    try:
+        data = request.get_json(force=True)
+        try:
+            turn = prepare_chat_turn(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # OpenAI call (העורך רץ ב-temperature=0 → llm_cache; header X-Sitegyn-Cache: bypass עוקף)
+        turn["cache_bypass"] = cache_bypass_requested(request.headers)
+        assistant_text = cached_completion(
+            client,
+            model=CHAT_MODEL,
+            messages=turn["messages"],
+            temperature=turn["temperature"],
+            bypass=turn["cache_bypass"],
+            validate=has_update_block if turn["is_editor"] else None,
+            on_usage=lambda usage: prompt_cache_stats.record(
+                "chat:editor" if turn["is_editor"] else "chat", usage
+            ),
+        )
+        return jsonify(finish_chat_turn(turn, assistant_text))
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
 
-            # ensure subdomain exists
-            if not project_row.get("subdomain"):
-                sub = f"site-{project_id[:6]}"
 
-                supabase.table("projects").update({
-                    "subdomain": sub
-                }).eq("id", project_id).execute()
+# ==========================================
+# CHAT (SSE) — same turn, reply streamed as it is generated
+# ==========================================
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    try:
+        data = request.get_json(force=True)
+        try:
+            turn = prepare_chat_turn(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        turn["cache_bypass"] = cache_bypass_requested(request.headers)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
 
-        final_message = visible_text
+    def generate():
+        try:
+            stream = client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=turn["messages"],
+                temperature=turn["temperature"],
+                stream=True,
+            )
 
-        # אם זה עדכון (יש update או editor)
-        if update_obj or editor_payload:
-            final_message = "Content updated"
+            # ה-<update> לא מוצג למשתמש – נחתך כבר תוך כדי הסטרים
+            visible = UpdateBlockFilter()
+            parts = []
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if not delta:
+                    continue
+                parts.append(delta)
+                text = visible.feed(delta)
+                if text:
+                    yield sse_event("delta", {"text": text})
+
+            tail = visible.flush()
+            if tail:
+                yield sse_event("delta", {"text": tail})
+
+            # כתיבה ל-DB רק אחרי שהסטרים נגמר, ואז אירוע סיום עם ה-subdomain
+            yield sse_event("done", finish_chat_turn(turn, "".join(parts)))
+        except Exception as e:
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    # nginx / render.com proxies – לא לאגור את הסטרים
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
-        # שלוף subdomain מהDB
-        project_row = (
+
+# ==========================================
+# LIVE PREVIEW — changed fragments only (preview_updates)
+# ==========================================
+@app.route("/api/projects/<project_id>/preview/stream")
+def api_preview_stream(project_id: str):
+    # כל טאב פתוח מחזיק thread – מוגבל; תחת uvicorn ה-route האסינכרוני ב-server_async משרת
+    try:
+        frames = open_preview_stream(supabase, project_id)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 503, {"Retry-After": "30"}
+    if frames is None:
+        return jsonify({"status": "error", "error": "project_not_found"}), 404
+
+    # no stream_with_context: frames.close() gives the stream slot back
+    resp = Response(frames, mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+def project_access_error(project_id: str):
+    """
+    None if the request's user may write the project, else the 401 / 403 response.
+    Routes that write content_json with the service key require
+    Authorization: Bearer <user access token>, and the project must be
+    visible to that token under RLS.
+    """
+    auth = request.headers.get("Authorization", "")
+    access_token = auth[len("Bearer "):].strip() if auth.startswith("Bearer ") else ""
+    if not access_token:
+        return jsonify({"status": "error", "error": "unauthorized"}), 401
+    if not user_can_access_project(project_id, access_token):
+        return jsonify({"status": "error", "error": "forbidden"}), 403
+    return None
+
+
+@app.route("/api/content/patch", methods=["POST"])
+def api_content_patch():
+    """
+    Direct field save from the editor (bottom preview):
+      {"project_id", "content_version": <version read>,
+       "changes": [{"path", "value", "base_value": <value shown in the editor>}]}
+    Authorization: Bearer <user access token> – the write uses the service key,
+    so the project must be visible to the user under RLS (what the browser
+    write it replaces went through). Fields must be inline_edit in
+    editor_capabilities.json; compare-and-swap on content_version, 409 if an
+    edited field changed since it was read.
+    """
+    try:
+        data = request.get_json(force=True) or {}
+        project_id = data.get("project_id")
+        changes = data.get("changes")
+        read_version = data.get("content_version")
+        if not project_id:
+            return jsonify({"status": "error", "error": "missing_project_id"}), 400
+        if not isinstance(changes, list) or not changes or not all(
+            isinstance(c, dict) and isinstance(c.get("path"), str) and c["path"] for c in changes
+        ):
+            return jsonify({"status": "error", "error": "invalid_changes"}), 400
+        if not isinstance(read_version, int):
+            return jsonify({"status": "error", "error": "missing_content_version"}), 400
+
+        denied = project_access_error(project_id)
+        if denied:
+            return denied
+
+        project = (
             supabase.table("projects")
-            .select("subdomain")
+            .select("*")
             .eq("id", project_id)
             .single()
             .execute()
             .data
         )
+        if not project:
+            return jsonify({"status": "error", "error": "project_not_found"}), 404
+        content = project.get("content_json")
+        if not isinstance(content, dict):
+            return jsonify({"status": "error", "error": "invalid_content_json"}), 500
+        capabilities = load_capabilities(project.get("selected_template_id") or "")
+        if not capabilities:
+            return jsonify({"status": "error", "error": "missing_editor_capabilities"}), 400
+
+        # same checks as the AI batch edit, with the inline_edit flag
+        requested = [path_tokens(c["path"]) for c in changes]
+        rejected = [
+            {"path": c["path"], "reason": reason}
+            for c in changes
+            for reason in [validate_change(
+                capabilities, content, requested, c["path"], c.get("value"), permission="inline_edit"
+            )]
+            if reason
+        ]
+        if rejected:
+            return jsonify({"status": "error", "error": "invalid_changes", "rejected": rejected}), 400
+
+        if project.get("content_version") != read_version:
+            # written since the editor read it – fine unless it was one of these fields
+            changed = [
+                c["path"] for c in changes
+                if "base_value" not in c or get_value_by_path(content, c["path"]) != c["base_value"]
+            ]
+            if changed:
+                return jsonify({"status": "error", "error": "content_conflict", "paths": changed}), 409
+
+        version = apply_content_ops(
+            project_id,
+            changes_to_patch([(c["path"], c["value"]) for c in changes]),
+            base=content,
+            expected_version=project.get("content_version"),
+        )
+        invalidate_project(project_id)
+        return jsonify({"status": "ok", "content_version": version})
+
+    except ContentConflict as e:
+        return jsonify({"status": "error", "error": "content_conflict", "paths": e.paths}), 409
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"status": "error", "error": str(e)}), 500
 
-        subdomain = project_row.get("subdomain") if project_row else None
 
-        return jsonify({
-            "reply": final_message,
-            "project_id": project_id,
-            "subdomain": subdomain
-        })
+# ==========================================
+# CONTENT HISTORY — undo / redo / restore (content_history)
+# ==========================================
+def _history_response(action, project_id: str, *args):
+    try:
+        denied = project_access_error(project_id)
+        if denied:
+            return denied
+        result = action(project_id, *args)
+        if "content_version" in result:
+            invalidate_project(project_id)
+        return jsonify({"status": "ok", **result})
+    except ContentConflict as e:
+        # השדה השתנה אחרי העריכה – לא מבטלים מעל שינוי של מישהו אחר
+        return jsonify({"status": "error", "error": "content_conflict", "paths": e.paths}), 409
+    except LookupError as e:
+        return jsonify({"status": "error", "error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
     except Exception as e:
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+
+@app.route("/api/projects/<project_id>/history")
+def api_content_history(project_id: str):
+    limit = request.args.get("limit", default=50, type=int)
+    return _history_response(content_history.history, project_id, limit)
+
+
+@app.route("/api/projects/<project_id>/undo", methods=["POST"])
+def api_content_undo(project_id: str):
+    return _history_response(content_history.undo, project_id)
+
+
+@app.route("/api/projects/<project_id>/redo", methods=["POST"])
+def api_content_redo(project_id: str):
+    return _history_response(content_history.redo, project_id)
+
+
+@app.route("/api/projects/<project_id>/restore", methods=["POST"])
+def api_content_restore(project_id: str):
+    version = (request.get_json(silent=True) or {}).get("version")
+    return _history_response(content_history.restore, project_id, version)
+
+
+@app.route("/api/preview_stats")
+def api_preview_stats():
+    return jsonify({"status": "ok", **preview_hub.stats()})
 
 
 # ==========================================
 # PUBLIC SITE — on-the-fly render (NEW)
 # ==========================================
+def _not_modified_etag(page: PublicPage) -> Optional[str]:
+    """
+    If-None-Match (עדיף) או If-Modified-Since מול ה-validators של העמוד.
+    מחזיר את ה-ETag שתאם (גם גרסה דחוסה "-gzip" / "-br" של אותו תוכן), או None.
+    """
+    if request.if_none_match:
+        for etag in (page.etag, *(f"{page.etag}-{enc}" for enc in SUPPORTED_ENCODINGS)):
+            if request.if_none_match.contains(etag):
+                return etag
+        return None
+    if request.if_modified_since and page.last_modified:
+        if page.last_modified <= request.if_modified_since:
+            return page.etag
+    return None
+
+
+def _negotiate_encoding() -> Optional[str]:
+    best = request.accept_encodings.best_match((*SUPPORTED_ENCODINGS, "identity"), default="identity")
+    return None if best == "identity" else best
+
+
+def _set_validators(resp: Response, page: PublicPage, etag: str) -> Response:
+    resp.set_etag(etag)
+    if page.last_modified:
+        resp.last_modified = page.last_modified
+    # הדפדפן / ה-iframe של העורך שומר עותק אבל תמיד בודק מול השרת (→ 304)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+
+def _public_page_response(page: PublicPage, stream: bool):
+    etag = _not_modified_etag(page)
+    if etag:
+        return _set_validators(Response(status=304), page, etag)
+
+    # stream: רק טוענים; אחרת מרנדרים (ונשמר ב-cache) כדי שתהיה גרסה דחוסה
+    loaded = page.load() if stream else page.html() is not None
+    if not loaded:
+        return "Project not found or failed to render", 404
+
+    encoding = _negotiate_encoding()
+    body = page.encoded(encoding) if encoding else None
+
+    if body is not None:
+        # גרסה דחוסה מוכנה מה-cache – בלי לדחוס שוב בכל בקשה
+        resp = Response(body, mimetype="text/html")
+        resp.headers["Content-Encoding"] = encoding
+        return _set_validators(resp, page, f"{page.etag}-{encoding}")
+
+    if stream:
+        # streamed: ה-<head> וה-CSS יוצאים לדפדפן לפני שה-body מרונדר
+        resp = Response(stream_with_context(page.iter_chunks()), mimetype="text/html")
+    else:
+        resp = Response(page.html(), mimetype="text/html")
+
+    return _set_validators(resp, page, page.etag)
+
+
 @app.route("/p/<subdomain>")
 def public_page_by_subdomain(subdomain: str):
-    html = render_project_html_by_subdomain(subdomain)
-    if html is None:
+    page = get_public_page(subdomain)
+    if page is None:
         return "Project not found or failed to render", 404
-    return Response(html, mimetype="text/html")
+    return _public_page_response(page, stream=True)
+
+@app.route("/api/render_stats")
+def api_render_stats():
+    return jsonify({"status": "ok", **render_stats()})
+
+
+@app.route("/api/pool_stats")
+def api_pool_stats():
+    # HTTP pools of the shared Supabase / OpenAI clients (service_clients)
+    return jsonify({"status": "ok", **pool_stats()})
+
+
+# ==========================================
+# BUILD STATUS — initial build job (build_jobs)
+# ==========================================
+BUILD_STATUS_MAX_WAIT = 30.0
+
+
+def build_status_for(project_id: str) -> Optional[Dict[str, Any]]:
+    """Status of the project's build job; without a known job – from the project row."""
+    job = build_queue.get(project_id)
+    if job is not None:
+        return job.to_dict()
+
+    rows = (
+        supabase.table("projects")
+        .select("id, content_json, selected_template_id")
+        .eq("id", project_id)
+        .limit(1)
+        .execute()
+        .data
+    ) or []
+    if not rows:
+        return None
+    if rows[0].get("content_json"):
+        status = DONE
+    elif rows[0].get("selected_template_id"):
+        # the job runs in another worker (or was lost with a restart) – not finished
+        status = PENDING
+    else:
+        status = None
+    return {
+        "project_id": project_id,
+        "job_id": None,
+        "status": status,
+    }
+
+
+@app.route("/api/projects/<project_id>/build_status")
+def api_build_status(project_id: str):
+    try:
+        # ?wait=<seconds> – long poll עד שה-job מסתיים
+        wait = min(float(request.args.get("wait") or 0), BUILD_STATUS_MAX_WAIT)
+        build_queue.wait(project_id, wait)
+
+        status = build_status_for(project_id)
+        if status is None:
+            return jsonify({"error": "project_not_found"}), 404
+        return jsonify(status)
+    except ValueError:
+        return jsonify({"error": "invalid_wait"}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/chat_stats")
+def api_chat_stats():
+    return jsonify({
+        "status": "ok",
+        "history": history_manager.stats(),
+        "message_writer": message_writer.stats(),
+        "build_jobs": build_queue.stats(),
+        "llm_cache": llm_cache.stats(),
+        # prompt / cached tokens from usage (OpenAI prompt caching)
+        "prompt_cache": prompt_cache_stats.stats(),
+        # builds / sections / retries / failed (content_sections)
+        "content_sections": section_stats.stats(),
+        # JSON Patch writes of content_json (content_patch)
+        "content_patch": patch_stats.stats(),
+        # undo log rows / bytes / snapshots (content_history)
+        "content_history": history_stats.stats(),
+        # strict / repaired / repair:<name> / failed / llm_fallback
+        "update_parser": update_repair_stats.stats(),
+    })
 
 @app.route("/p/<subdomain>/wow")
 def public_page_wow(subdomain: str):
@@ -499,11 +1027,11 @@ def public_page_wow(subdomain: str):
         .eq("subdomain", subdomain) \
         .execute()
 
-    html = render_project_html_by_subdomain(subdomain)
-    if html is None:
+    page = get_public_page(subdomain)
+    if page is None:
         return "Project not found or failed to render", 404
 
-    return Response(html, mimetype="text/html")
+    return _public_page_response(page, stream=False)
 
 
 # ==========================================
@@ -565,6 +1093,8 @@ def api_update_subdomain(project_id):
             .update({"subdomain": candidate}) \
             .eq("id", project_id) \
             .execute().data
+        invalidate_project(project_id)
+        invalidate_subdomain(candidate, project_id)
 
         return jsonify({"status": "ok", "subdomain": candidate, "project": updated})
     except Exception as e:
@@ -0,0 +1,403 @@
+# server_async.py
+#
+# asyncio version of POST /api/chat (FastAPI + uvicorn).
+#
+# Same request / response as server.chat, but every Supabase / OpenAI call is
+# awaited on async clients and independent steps run together:
+#
+#   1. history window (chat_history)  ‖  load project            (gather)
+#   2. OpenAI call (+ the hidden <update> repair call if needed)
+#   3. update project; content generation for a new project is queued on
+#      build_jobs and polled via /api/projects/<id>/build_status
+#
+# chat_messages rows go through the write-behind buffer of server.py
+# (chat_writer), so saving the user / assistant message costs no round trip.
+#
+# POST /api/chat/stream runs the same turn but forwards the reply as SSE
+# deltas (see chat_stream.py); step 3 runs after the stream ends.
+#
+# GET /api/projects/<id>/preview/stream (preview_updates) is served here too:
+# an editor tab keeps it open for hours, and through the WSGI mount every
+# open tab would hold one of its threads.
+#
+# The project row from step 1 is reused for the initial build, the editor
+# patch and the returned subdomain, so a turn makes 2 Supabase round trips
+# on the critical path instead of 6. A turn no longer holds a worker while
+# waiting, one process serves hundreds of chats in flight; OpenAI calls are
+# capped with SITEGYN_CHAT_MAX_CONCURRENCY.
+#
+# Every other route is served by the Flask app from server.py (WSGI mount).
+#
+# Run:
+#   uvicorn server_async:app --host 0.0.0.0 --port 8000
+
+from __future__ import annotations
+
+import asyncio
+import os
+import traceback
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from openai import AsyncOpenAI
+from supabase import AsyncClient
+
+from chat_stream import UpdateBlockFilter, sse_event
+from llm_cache import acached_completion, cache_bypass_requested
+from content_patch import ContentConflict, apply_content_changes, replace_content
+from content_prompts import prompt_cache_stats
+from preview_updates import aopen_preview_stream
+from update_parser import update_repair_stats
+from render_cache import invalidate_project
+from render_service import invalidate_subdomain
+from service_clients import get_async_openai, get_async_supabase
+from server import (
+    CHAT_MODEL,
+    CONTENT_CONFLICT_MESSAGE,
+    UPDATE_FIELDS,
+    UPDATE_REPAIR_INSTRUCTION,
+    app as flask_app,
+    editor_payload_changes,
+    build_chat_messages,
+    BUILD_STATUS_MAX_WAIT,
+    build_queue,
+    build_status_for,
+    has_update_block,
+    history_manager,
+    message_writer,
+    parse_update_block,
+    pick_template_for_project,
+    strip_update_block,
+)
+
+CHAT_MAX_CONCURRENCY = int(os.getenv("SITEGYN_CHAT_MAX_CONCURRENCY", "200"))
+
+
+class AsyncClients:
+    supabase: Optional[AsyncClient] = None
+    openai: Optional[AsyncOpenAI] = None
+    openai_slots: Optional[asyncio.Semaphore] = None
+
+
+clients = AsyncClients()
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # pooled clients with timeouts / retries – service_clients
+    clients.supabase = await get_async_supabase()
+    clients.openai = get_async_openai()
+    clients.openai_slots = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+    try:
+        yield
+    finally:
+        await clients.openai.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+# ==========================================
+# Async I/O helpers
+# ==========================================
+async def _complete(
+    messages: List[Dict[str, str]],
+    temperature: float,
+    bypass: bool = False,
+    validate: Optional[Callable[[str], Any]] = None,
+    on_usage: Optional[Callable[[Any], None]] = None,
+) -> str:
+    # temperature=0 calls are memoized on disk (llm_cache)
+    async with clients.openai_slots:
+        return await acached_completion(
+            clients.openai,
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=temperature,
+            bypass=bypass,
+            validate=validate,
+            on_usage=on_usage,
+        )
+
+
+def _insert_message(project_id: str, role: str, content: str) -> None:
+    # write-behind (chat_writer) – no round trip on the request path
+    message_writer.enqueue(project_id, role, content)
+
+
+async def _load_project(project_id: str) -> Dict[str, Any]:
+    resp = await (
+        clients.supabase.table("projects")
+        .select("*")
+        .eq("id", project_id)
+        .single()
+        .execute()
+    )
+    return resp.data or {}
+
+
+async def _update_project(project_id: str, values: Dict[str, Any]) -> None:
+    await clients.supabase.table("projects").update(values).eq("id", project_id).execute()
+    invalidate_project(project_id)
+    invalidate_subdomain(values.get("subdomain"), project_id)
+
+
+# ==========================================
+# CHAT
+# ==========================================
+async def _prepare_turn(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate + history window ‖ project. ValueError(<error code>) on a bad request."""
+    project_id = data.get("project_id")
+    user_message = (data.get("message") or "").strip()
+
+    source = data.get("source", "default")  # "editor" | "default"
+    field_path = data.get("field_path")
+
+    is_editor = source == "editor"
+
+    if not project_id:
+        raise ValueError("missing_project_id")
+    if not user_message:
+        raise ValueError("empty_message")
+
+    # 1. history window ‖ project
+    if is_editor:
+        project_row = await _load_project(project_id)
+        history = []
+    else:
+        history, project_row = await asyncio.gather(
+            asyncio.to_thread(history_manager.window, project_id),
+            _load_project(project_id),
+        )
+
+    return {
+        "project_id": project_id,
+        "user_message": user_message,
+        "is_editor": is_editor,
+        "project_row": project_row,
+        "temperature": 0.0 if is_editor else 0.5,
+        "messages": build_chat_messages(
+            is_editor, user_message, history, field_path, project_row.get("content_json") or {}
+        ),
+    }
+
+
+def _save_user_message(turn: Dict[str, Any]) -> None:
+    if not turn["is_editor"]:
+        _insert_message(turn["project_id"], "user", turn["user_message"])
+
+
+async def _finish_turn(turn: Dict[str, Any], assistant_text: str) -> Dict[str, Any]:
+    """<update> (+ repair call) → initial build / editor patch → response body."""
+    project_id = turn["project_id"]
+    project_row = turn["project_row"]
+    is_editor = turn["is_editor"]
+
+    fields = None if is_editor else UPDATE_FIELDS
+    update_obj = parse_update_block(assistant_text, fields=fields)
+    if is_editor:
+        visible_text = assistant_text if update_obj else "⚠️ Failed to update content."
+    else:
+        visible_text = strip_update_block(assistant_text)
+
+    # אם המודל לא החזיר בכלל <update>...</update> – קריאה שנייה "נסתרת"
+    if not update_obj:
+        update_repair_stats.record("llm_fallback")
+        try:
+            backend_text = await _complete(
+                turn["messages"] + [{"role": "system", "content": UPDATE_REPAIR_INSTRUCTION}],
+                temperature=0.0,
+                bypass=turn["cache_bypass"],
+                validate=has_update_block,
+            )
+            update_obj = parse_update_block(backend_text, fields=fields)
+        except Exception:
+            traceback.print_exc()
+            update_obj = {}
+
+    # 3. project update
+    project_update: Dict[str, Any] = {}
+    chat_content = None
+    content_conflict = False
+    needs_build = False
+    if update_obj and is_editor:
+        # JSON Patch של השדות בלבד (content_patch) – ה-store סינכרוני, רץ ב-thread;
+        # compare-and-swap מול הגרסה שה-prompt נבנה ממנה (rebase אוטומטי)
+        try:
+            await asyncio.to_thread(
+                apply_content_changes,
+                project_id,
+                editor_payload_changes(update_obj),
+                project_row.get("content_json") or {},
+                project_row.get("content_version"),
+            )
+            invalidate_project(project_id)
+        except ContentConflict:
+            content_conflict = True
+        if not project_row.get("subdomain"):
+            project_update["subdomain"] = f"site-{project_id[:6]}"
+
+    elif update_obj:
+        project_update = update_obj
+        # content_json מלא מהצ'אט נכתב דרך content_patch, לא ב-update הכללי
+        chat_content = project_update.pop("content_json", None)
+
+        template_id = pick_template_for_project(project_row, update_obj)
+        if template_id and not update_obj.get("selected_template_id"):
+            update_obj["selected_template_id"] = template_id
+
+        # "content_json": null מהצ'אט לא דורס תוכן קיים; התוכן נבנה ברקע (build_jobs)
+        needs_build = bool(template_id) and not (project_row.get("content_json") or chat_content)
+
+        if not project_row.get("subdomain"):
+            update_obj["subdomain"] = f"site-{project_id[:6]}"
+
+    # 4. assistant message ‖ project update
+    if not is_editor:
+        _insert_message(project_id, "assistant", assistant_text)
+    if project_update:
+        await _update_project(project_id, project_update)
+    if chat_content:
+        try:
+            await asyncio.to_thread(
+                replace_content,
+                project_id,
+                chat_content,
+                project_row.get("content_json") or {},
+                project_row.get("content_version"),
+            )
+            invalidate_project(project_id)
+        except ContentConflict:
+            print(f"content_json of {project_id} changed meanwhile – chat content not saved")
+
+    build_job = None
+    if needs_build:
+        build_job = build_queue.submit(
+            project_id, project_row, dict(update_obj), template_id, turn["cache_bypass"]
+        )
+
+    return {
+        "reply": CONTENT_CONFLICT_MESSAGE if content_conflict else ("Content updated" if update_obj else visible_text),
+        "project_id": project_id,
+        "subdomain": project_update.get("subdomain") or project_row.get("subdomain"),
+        "build_status": build_job.status if build_job else None,
+    }
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    try:
+        try:
+            turn = await _prepare_turn(await request.json())
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        turn["cache_bypass"] = cache_bypass_requested(request.headers)
+
+        # 2. OpenAI
+        _save_user_message(turn)
+        assistant_text = await _complete(
+            turn["messages"],
+            turn["temperature"],
+            bypass=turn["cache_bypass"],
+            validate=has_update_block if turn["is_editor"] else None,
+            on_usage=lambda usage: prompt_cache_stats.record(
+                "chat:editor" if turn["is_editor"] else "chat", usage
+            ),
+        )
+        return JSONResponse(await _finish_turn(turn, assistant_text))
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: Request):
+    try:
+        turn = await _prepare_turn(await request.json())
+        turn["cache_bypass"] = cache_bypass_requested(request.headers)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def generate():
+        _save_user_message(turn)
+        try:
+            visible = UpdateBlockFilter()
+            parts = []
+            async with clients.openai_slots:
+                stream = await clients.openai.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=turn["messages"],
+                    temperature=turn["temperature"],
+                    stream=True,
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    text = visible.feed(delta)
+                    if text:
+                        yield sse_event("delta", {"text": text})
+
+            tail = visible.flush()
+            if tail:
+                yield sse_event("delta", {"text": tail})
+
+            yield sse_event("done", await _finish_turn(turn, "".join(parts)))
+        except Exception as e:
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ==========================================
+# BUILD STATUS (long poll without holding a thread of the WSGI app)
+# ==========================================
+@app.get("/api/projects/{project_id}/build_status")
+async def build_status(project_id: str, wait: float = 0):
+    try:
+        job = build_queue.get(project_id)
+        if job is not None and job.active and wait > 0:
+            await asyncio.to_thread(job.done_event.wait, min(wait, BUILD_STATUS_MAX_WAIT))
+
+        status = await asyncio.to_thread(build_status_for, project_id)
+        if status is None:
+            return JSONResponse({"error": "project_not_found"}, status_code=404)
+        return JSONResponse(status)
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# ==========================================
+# LIVE PREVIEW (SSE without holding a thread of the WSGI app)
+# ==========================================
+@app.get("/api/projects/{project_id}/preview/stream")
+async def preview_stream(project_id: str):
+    frames = await aopen_preview_stream(clients.supabase, project_id)
+    if frames is None:
+        return JSONResponse({"status": "error", "error": "project_not_found"}, status_code=404)
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# כל שאר ה-routes (עמודים סטטיים, /p/<subdomain>, /api/...) – אפליקציית Flask
+app.mount("/", WSGIMiddleware(flask_app))
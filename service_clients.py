@@ -0,0 +1,336 @@
+# service_clients.py
+#
+# Shared Supabase / OpenAI clients of all services.
+#
+# server.py, build_service.py, editor_update_server.py,
+# content_update_service.py and update_server.py used to call create_client /
+# OpenAI(...) each on their own, with httpx defaults: separate pools, no
+# timeouts, no retries. Every service now takes its clients from here:
+#
+#   - one client per process (lazy, thread safe) – all modules share its pool
+#   - httpx pool limits + keep-alive:
+#       SITEGYN_HTTP_MAX_CONNECTIONS   (100)  connections per pool
+#       SITEGYN_HTTP_MAX_KEEPALIVE     (20)   idle connections kept open
+#       SITEGYN_HTTP_KEEPALIVE_EXPIRY  (30s)
+#   - timeouts: SITEGYN_HTTP_CONNECT_TIMEOUT (5s), SITEGYN_HTTP_READ_TIMEOUT
+#     (30s, Supabase) and SITEGYN_OPENAI_READ_TIMEOUT (120s – completions are slow)
+#   - bounded retries (SITEGYN_HTTP_RETRIES, default 3) with full jitter
+#     (SITEGYN_HTTP_BACKOFF * 2^attempt, capped, Retry-After honored):
+#       * connect errors – any method (the request never reached the server)
+#       * read timeouts / dropped connections / 429 502 503 504 – only
+#         idempotent methods (GET, HEAD, ...), so an insert is never doubled
+#     OpenAI retries through the SDK (max_retries, also jittered); its
+#     transport only counts, so the two never multiply
+#   - pool_stats(): requests / retries / failures and open / idle / active
+#     connections per pool – GET /api/pool_stats, to size pools per worker
+#   - user_can_access_project(): the same row lookup the browser would make
+#     with the user's own session (anon key + access token → RLS), for
+#     endpoints that write with the service key on the user's behalf
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from supabase import Client, ClientOptions, create_client
+
+try:
+    from supabase import AsyncClient, AsyncClientOptions, acreate_client
+except ImportError:  # older supabase – no async client
+    AsyncClient = AsyncClientOptions = acreate_client = None
+
+MAX_CONNECTIONS = int(os.getenv("SITEGYN_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE = int(os.getenv("SITEGYN_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("SITEGYN_HTTP_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("SITEGYN_HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("SITEGYN_HTTP_READ_TIMEOUT", "30"))
+OPENAI_READ_TIMEOUT = float(os.getenv("SITEGYN_OPENAI_READ_TIMEOUT", "120"))
+RETRIES = int(os.getenv("SITEGYN_HTTP_RETRIES", "3"))
+BACKOFF_SECONDS = float(os.getenv("SITEGYN_HTTP_BACKOFF", "0.25"))
+BACKOFF_MAX_SECONDS = 4.0
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout(read: float) -> httpx.Timeout:
+    return httpx.Timeout(connect=CONNECT_TIMEOUT, read=read, write=read, pool=CONNECT_TIMEOUT)
+
+
+# ==========================================
+# Retry policy (shared by the sync / async transports)
+# ==========================================
+class RetryPolicy:
+    def __init__(self, name: str, retries: int = RETRIES, backoff: float = BACKOFF_SECONDS):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def retry_error(self, request: httpx.Request, error: Exception, attempt: int) -> bool:
+        if attempt >= self.retries:
+            return False
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return True
+        return request.method in IDEMPOTENT_METHODS and isinstance(
+            error, (httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ReadError)
+        )
+
+    def retry_response(self, request: httpx.Request, response: httpx.Response, attempt: int) -> bool:
+        return (
+            attempt < self.retries
+            and request.method in IDEMPOTENT_METHODS
+            and response.status_code in RETRY_STATUSES
+        )
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        # full jitter: uniform(0, backoff * 2^attempt), capped
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, self.backoff * (2 ** attempt)))
+        retry_after = _retry_after(response) if response is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, BACKOFF_MAX_SECONDS))
+        return delay
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retried, "failures": self.failures}
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        # HTTP date form
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryTransport(httpx.BaseTransport):
+    def __init__(self, policy: RetryPolicy, **transport_kwargs):
+        self.policy = policy
+        self.transport = httpx.HTTPTransport(limits=_limits(), **transport_kwargs)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.count("requests")
+        attempt = 0
+        while True:
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                if not self.policy.retry_error(request, e, attempt):
+                    self.policy.count("failures")
+                    raise
+                delay = self.policy.delay(attempt)
+            else:
+                if not self.policy.retry_response(request, response, attempt):
+                    return response
+                delay = self.policy.delay(attempt, response)
+                response.close()
+            attempt += 1
+            self.policy.count("retried")
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    def __init__(self, policy: RetryPolicy, **transport_kwargs):
+        self.policy = policy
+        self.transport = httpx.AsyncHTTPTransport(limits=_limits(), **transport_kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.count("requests")
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                if not self.policy.retry_error(request, e, attempt):
+                    self.policy.count("failures")
+                    raise
+                delay = self.policy.delay(attempt)
+            else:
+                if not self.policy.retry_response(request, response, attempt):
+                    return response
+                delay = self.policy.delay(attempt, response)
+                await response.aclose()
+            attempt += 1
+            self.policy.count("retried")
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+# ==========================================
+# Pools – one per (client kind) and process
+# ==========================================
+_transports: Dict[str, Any] = {}
+_clients: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _http_client(name: str, read_timeout: float, retries: int) -> httpx.Client:
+    transport = RetryTransport(RetryPolicy(name, retries=retries))
+    _transports[name] = transport
+    return httpx.Client(transport=transport, timeout=_timeout(read_timeout))
+
+
+def _async_http_client(name: str, read_timeout: float, retries: int) -> httpx.AsyncClient:
+    transport = AsyncRetryTransport(RetryPolicy(name, retries=retries))
+    _transports[name] = transport
+    return httpx.AsyncClient(transport=transport, timeout=_timeout(read_timeout))
+
+
+def _credentials() -> tuple:
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY in environment")
+    return url, key
+
+
+def get_supabase() -> Client:
+    with _lock:
+        if "supabase" not in _clients:
+            url, key = _credentials()
+            try:
+                options = ClientOptions(
+                    httpx_client=_http_client("supabase", READ_TIMEOUT, RETRIES),
+                    postgrest_client_timeout=_timeout(READ_TIMEOUT),
+                )
+            except TypeError:
+                # supabase < 2.16 cannot take an httpx client – timeouts only
+                _transports.pop("supabase", None)
+                options = ClientOptions(postgrest_client_timeout=_timeout(READ_TIMEOUT))
+            _clients["supabase"] = create_client(url, key, options=options)
+        return _clients["supabase"]
+
+
+def get_openai() -> OpenAI:
+    with _lock:
+        if "openai" not in _clients:
+            _clients["openai"] = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=_http_client("openai", OPENAI_READ_TIMEOUT, retries=0),
+                timeout=_timeout(OPENAI_READ_TIMEOUT),
+                max_retries=RETRIES,
+            )
+        return _clients["openai"]
+
+
+def get_async_openai() -> AsyncOpenAI:
+    with _lock:
+        if "async_openai" not in _clients:
+            _clients["async_openai"] = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=_async_http_client("async_openai", OPENAI_READ_TIMEOUT, retries=0),
+                timeout=_timeout(OPENAI_READ_TIMEOUT),
+                max_retries=RETRIES,
+            )
+        return _clients["async_openai"]
+
+
+async def get_async_supabase() -> "AsyncClient":
+    client = _clients.get("async_supabase")
+    if client is not None:
+        return client
+    if acreate_client is None:
+        raise RuntimeError("supabase async client not available")
+    url, key = _credentials()
+    try:
+        options = AsyncClientOptions(
+            httpx_client=_async_http_client("async_supabase", READ_TIMEOUT, RETRIES),
+            postgrest_client_timeout=_timeout(READ_TIMEOUT),
+        )
+    except TypeError:
+        _transports.pop("async_supabase", None)
+        options = AsyncClientOptions(postgrest_client_timeout=_timeout(READ_TIMEOUT))
+    client = await acreate_client(url, key, options=options)
+    return _clients.setdefault("async_supabase", client)
+
+
+# ==========================================
+# Row-level security check on the user's behalf
+# ==========================================
+def user_can_access_project(project_id: str, access_token: str) -> bool:
+    """True if projects.id = project_id is visible to the user's token under RLS."""
+    url = os.getenv("SUPABASE_URL")
+    anon_key = os.getenv("SUPABASE_ANON_KEY")
+    if not url or not anon_key:
+        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_ANON_KEY in environment")
+    with _lock:
+        if "supabase_user" not in _clients:
+            _clients["supabase_user"] = _http_client("supabase_user", READ_TIMEOUT, RETRIES)
+        http = _clients["supabase_user"]
+    response = http.get(
+        f"{url.rstrip('/')}/rest/v1/projects",
+        params={"id": f"eq.{project_id}", "select": "id"},
+        headers={"apikey": anon_key, "Authorization": f"Bearer {access_token}"},
+    )
+    if response.status_code in (401, 403):
+        return False
+    response.raise_for_status()
+    return bool(response.json())
+
+
+# ==========================================
+# Pool statistics
+# ==========================================
+def _connection_counts(transport: Any) -> Dict[str, int]:
+    # httpcore pool behind the httpx transport
+    pool = getattr(transport.transport, "_pool", None)
+    connections = list(getattr(pool, "connections", None) or [])
+    idle = sum(1 for c in connections if c.is_idle())
+    return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+def pool_stats() -> Dict[str, Any]:
+    pools = {}
+    for name, transport in list(_transports.items()):
+        try:
+            connections = _connection_counts(transport)
+        except Exception:
+            connections = {}
+        pools[name] = {**transport.policy.stats(), **connections}
+    return {
+        "limits": {
+            "max_connections": MAX_CONNECTIONS,
+            "max_keepalive": MAX_KEEPALIVE,
+            "keepalive_expiry": KEEPALIVE_EXPIRY,
+            "connect_timeout": CONNECT_TIMEOUT,
+            "read_timeout": READ_TIMEOUT,
+            "openai_read_timeout": OPENAI_READ_TIMEOUT,
+            "retries": RETRIES,
+        },
+        "pools": pools,
+    }
@@ -0,0 +1,184 @@
+# static_export.py
+#
+# Bulk static export – every project (or a filter by template / niche)
+# rendered to <output_dir>/<project_id>.html, e.g. for a nightly CDN push.
+#
+#   - projects are read from Supabase in pages (only the columns we need)
+#   - rendering runs on a process pool, each worker calls
+#     build_service.build_site_for_project with the already-loaded row
+#   - <output_dir>/manifest.json remembers the content hash (ETag) of every
+#     exported site, so re-runs skip projects whose content and template
+#     did not change
+#   - every file (HTML + manifest) is written atomically
+#
+# Usage:
+#   python static_export.py --output-dir out/
+#   python static_export.py --output-dir out/ --template template_pizza_01 --workers 8
+#   python static_export.py --output-dir out/ --niche lawyer --force
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from build_service import supabase, build_site_for_project, write_file_atomic
+from render_backends import get_render_backend
+from render_cache import etag_for_key, make_cache_key
+
+MANIFEST_NAME = "manifest.json"
+EXPORT_COLUMNS = "id, subdomain, selected_template_id, content_json"
+DEFAULT_PAGE_SIZE = 500
+
+
+# ==========================================
+# Supabase – paged project reader
+# ==========================================
+def iter_project_pages(
+    template_id: Optional[str] = None,
+    niche: Optional[str] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Iterator[List[Dict[str, Any]]]:
+    offset = 0
+    while True:
+        query = supabase.table("projects").select(EXPORT_COLUMNS)
+        if template_id:
+            query = query.eq("selected_template_id", template_id)
+        if niche:
+            query = query.eq("niche", niche)
+
+        rows = (
+            query
+            .order("id")
+            .range(offset, offset + page_size - 1)
+            .execute()
+            .data
+        ) or []
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+
+# ==========================================
+# Manifest
+# ==========================================
+def load_manifest(output_dir: Path) -> Dict[str, Dict[str, Any]]:
+    path = output_dir / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        traceback.print_exc()
+        return {}
+
+
+def save_manifest(output_dir: Path, manifest: Dict[str, Dict[str, Any]]) -> None:
+    write_file_atomic(output_dir / MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True))
+
+
+def site_hash(row: Dict[str, Any]) -> Optional[str]:
+    """Same value as the page ETag: content_json hash + template version."""
+    template_id = row.get("selected_template_id")
+    if not template_id:
+        return None
+    version = get_render_backend().template_version(template_id)
+    if version is None:
+        return None
+    return etag_for_key(make_cache_key(row["id"], row.get("content_json"), template_id, version))
+
+
+# ==========================================
+# Worker
+# ==========================================
+def _export_one(row: Dict[str, Any], output_dir: str) -> bool:
+    try:
+        return build_site_for_project(row["id"], output_dir, project=row) is not None
+    except Exception:
+        traceback.print_exc()
+        return False
+
+
+# ==========================================
+# Export
+# ==========================================
+def export_sites(
+    output_dir: str,
+    template_id: Optional[str] = None,
+    niche: Optional[str] = None,
+    workers: Optional[int] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    force: bool = False,
+) -> Dict[str, int]:
+    out = Path(output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(out)
+    stats = {"exported": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for rows in iter_project_pages(template_id, niche, page_size):
+            pending = []
+            for row in rows:
+                project_id = str(row["id"])
+                digest = site_hash(row)
+                if digest is None:
+                    stats["skipped"] += 1
+                    continue
+
+                known = manifest.get(project_id)
+                file_name = f"{project_id}.html"
+                if not force and known and known.get("hash") == digest and (out / file_name).exists():
+                    stats["unchanged"] += 1
+                    continue
+
+                future = pool.submit(_export_one, row, str(out))
+                pending.append((project_id, row.get("subdomain"), digest, file_name, future))
+
+            for project_id, subdomain, digest, file_name, future in pending:
+                if future.result():
+                    manifest[project_id] = {"hash": digest, "file": file_name, "subdomain": subdomain}
+                    stats["exported"] += 1
+                else:
+                    stats["failed"] += 1
+
+            # manifest after every page – an interrupted run keeps its progress
+            save_manifest(out, manifest)
+
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export static HTML snapshots of all projects")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--template", help="only projects with this selected_template_id")
+    parser.add_argument("--niche", help="only projects with this niche")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="render processes")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="projects per Supabase query")
+    parser.add_argument("--force", action="store_true", help="re-export even if the manifest hash matches")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    stats = export_sites(
+        args.output_dir,
+        template_id=args.template,
+        niche=args.niche,
+        workers=args.workers,
+        page_size=args.page_size,
+        force=args.force,
+    )
+    elapsed = time.perf_counter() - started
+    print(f"[static_export] {stats} in {elapsed:.1f}s")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
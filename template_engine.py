@@ -0,0 +1,354 @@
+# template_engine.py
+#
+# Precompiled slot-based renderer.
+#
+# Idea:
+#   Instead of parsing the template HTML with BeautifulSoup on every page view,
+#   we parse it ONCE per template, serialize it exactly like _render_template
+#   would, and cut the output into static chunks and "slots" (one slot per
+#   mapped element id). Rendering a project is then just a join of the static
+#   chunks with the escaped values from content_json.
+#
+#   Output is identical to build_service._render_template:
+#     - the inner content of the element with that id is replaced by str(value)
+#     - values are escaped like BeautifulSoup's "minimal" formatter (& < >)
+#     - when the value is None, the original inner content stays as is
+#
+#   Live preview (preview_updates): every compiled template also keeps a
+#   reverse index content path → slots, built from the *_mapping.json paths,
+#   so a write can be turned into {element_id: new inner html} for only the
+#   elements whose value changed.
+#
+#   The iframe side of the live preview (the "sitegyn-fragments" message
+#   listener) is not part of the template files: load_template_source injects
+#   one shared <script> before </body> of every template, so all backends
+#   render it and a new template gets it for free. Only messages from the
+#   parent window on one of SITEGYN_EDITOR_ORIGINS are applied.
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from bs4 import BeautifulSoup
+
+from build_service import (
+    PathTrie,
+    _resolve_template_path,
+    _load_template_mapping,
+)
+from content_patch import PathToken, path_tokens
+
+# Private-use characters – never appear in our templates and are left
+# untouched by BeautifulSoup's output formatter.
+_SLOT_OPEN = "\ue000"
+_SLOT_CLOSE = "\ue001"
+_SLOT_END = "\ue002"
+
+# Body chunk size for iter_render (streamed responses).
+STREAM_CHUNK_SIZE = 8 * 1024
+
+# Same set BeautifulSoup's HTML formatter uses: strings inside these tags
+# are written out without entity substitution.
+_CDATA_TAGS = frozenset(["script", "style"])
+
+# Origins of the editor that may push preview fragments into a rendered page
+# (comma separated, e.g. "https://sitegyn.com,http://localhost:5000").
+EDITOR_ORIGINS = [
+    origin.strip().rstrip("/")
+    for origin in os.getenv("SITEGYN_EDITOR_ORIGINS", "https://sitegyn.com").split(",")
+    if origin.strip()
+]
+
+# live preview from the editor: {element_id: inner html} of the changed elements only.
+# html from anyone else who frames this page is dropped (no DOM injection)
+_PREVIEW_LISTENER = """<script>
+(() => {
+  const allowed = %s;
+  window.addEventListener("message", (e) => {
+    if (e.data?.type !== "sitegyn-fragments") return;
+    if (!allowed.includes(e.origin) || e.source !== window.parent) return;
+    for (const [id, html] of Object.entries(e.data.fragments || {})) {
+      const el = document.getElementById(id);
+      if (el) el.innerHTML = html;
+    }
+  });
+})();
+</script>
+"""
+
+
+# ==========================================
+# Compiled structures
+# ==========================================
+class Slot:
+    """A mapped element whose inner content is replaced by a content_json value."""
+
+    __slots__ = ("index", "element_id", "path", "raw", "default")
+
+    def __init__(self, index: int, element_id: str, path: str, raw: bool, default: List["Part"]):
+        # position of this slot's value in PathTrie.resolve()
+        self.index = index
+        self.element_id = element_id
+        self.path = path
+        self.raw = raw
+        # Original inner content (may contain nested slots) – used when the
+        # value is missing from content_json.
+        self.default = default
+
+
+Part = Union[str, Slot]
+
+
+class CompiledTemplate:
+    """Static chunks + slots for one template/mapping pair."""
+
+    def __init__(self, template_id: str, version: str, parts: List[Part], slots: List[Slot]):
+        self.template_id = template_id
+        # hash of the HTML + mapping – changes whenever the template is edited
+        self.version = version
+        self.parts = parts
+        self.slots = slots
+        # all slot paths merged into one trie – one walk of content_json per render
+        self.trie = PathTrie([slot.path for slot in slots])
+
+        # static text before the first slot (doctype, <head>, CSS links...)
+        # – streamed before anything is resolved
+        first_slot = next((i for i, part in enumerate(parts) if part.__class__ is not str), len(parts))
+        self.prefix = "".join(parts[:first_slot])
+        self.body_parts = parts[first_slot:]
+
+        # reverse index for targeted preview updates:
+        #   _slots_by_path   full path tokens → slots bound to exactly that path
+        #   _slots_under     every prefix of a slot path → slots at / under it
+        self._slots_by_path: Dict[Tuple[PathToken, ...], List[Slot]] = {}
+        self._slots_under: Dict[Tuple[PathToken, ...], List[Slot]] = {}
+        for slot in slots:
+            tokens = path_tokens(slot.path)
+            self._slots_by_path.setdefault(tokens, []).append(slot)
+            for size in range(len(tokens) + 1):
+                self._slots_under.setdefault(tokens[:size], []).append(slot)
+
+    def render(self, content_json: Optional[Dict[str, Any]]) -> str:
+        values = self.trie.resolve(content_json or {})
+        out: List[str] = []
+        _render_parts(self.parts, values, out)
+        return "".join(out)
+
+    def iter_render(self, content_json: Optional[Dict[str, Any]], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+        """Same output as render(), yielded as the static head first and then body chunks."""
+        if self.prefix:
+            yield self.prefix
+
+        values = self.trie.resolve(content_json or {})
+        out: List[str] = []
+        size = 0
+        for part in self.body_parts:
+            before = len(out)
+            _render_parts((part,), values, out)
+            size += sum(len(text) for text in out[before:])
+            if size >= chunk_size:
+                yield "".join(out)
+                out = []
+                size = 0
+        if out:
+            yield "".join(out)
+
+    def slots_for(self, tokens: Tuple[PathToken, ...]) -> List[Slot]:
+        """
+        Slots whose rendered content depends on the value at tokens: bound to
+        the path or anything under it, or to a parent of it (a slot bound to a
+        whole list changes when one item does). () → every slot.
+        """
+        found = list(self._slots_under.get(tokens, ()))
+        for size in range(len(tokens)):
+            found.extend(self._slots_by_path.get(tokens[:size], ()))
+        return found
+
+    def render_fragments(
+        self,
+        content_json: Optional[Dict[str, Any]],
+        changed: Iterable[Tuple[PathToken, ...]],
+    ) -> Dict[str, str]:
+        """{element_id: inner html} of the slots affected by the changed paths – same output as render()."""
+        affected: Dict[int, Slot] = {}
+        for tokens in changed:
+            for slot in self.slots_for(tuple(tokens)):
+                affected[slot.index] = slot
+        if not affected:
+            return {}
+
+        values = self.trie.resolve(content_json or {})
+        fragments: Dict[str, str] = {}
+        for index in sorted(affected):
+            slot = affected[index]
+            out: List[str] = []
+            _render_parts((slot,), values, out)
+            fragments[slot.element_id] = "".join(out)
+        return fragments
+
+
+def escape_text(value: str) -> str:
+    """Same escaping as BeautifulSoup's minimal formatter for text nodes."""
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _render_parts(parts: List[Part], values: List[Any], out: List[str]) -> None:
+    for part in parts:
+        if part.__class__ is str:
+            out.append(part)
+            continue
+
+        value = values[part.index]
+        if value is None:
+            _render_parts(part.default, values, out)
+        elif part.raw:
+            out.append(str(value))
+        else:
+            out.append(escape_text(str(value)))
+
+
+# ==========================================
+# Compile step
+# ==========================================
+def template_version(html_source: str, mapping: Dict[str, str]) -> str:
+    """Hash of the HTML + mapping – changes whenever the template is edited."""
+    return hashlib.sha1(
+        (html_source + json.dumps(mapping, sort_keys=True)).encode("utf-8")
+    ).hexdigest()[:12]
+
+
+def compile_template(template_id: str, html_source: str, mapping: Dict[str, str]) -> CompiledTemplate:
+    """
+    Parse the template once and cut it into static chunks and slots.
+
+    Each mapped element gets its original children wrapped with marker
+    strings; after str(soup) the markers tell us exactly where every
+    element's inner content starts and ends in the serialized output.
+    """
+    soup = BeautifulSoup(html_source, "html.parser")
+
+    slot_specs: List[Dict[str, Any]] = []
+    for html_id, schema_path in mapping.items():
+        tag = soup.find(id=html_id)
+        if tag is None:
+            continue
+        index = len(slot_specs)
+        slot_specs.append({
+            "element_id": html_id,
+            "path": schema_path,
+            "raw": tag.name in _CDATA_TAGS,
+        })
+        tag.insert(0, f"{_SLOT_OPEN}{index}{_SLOT_CLOSE}")
+        tag.append(f"{_SLOT_END}{index}{_SLOT_CLOSE}")
+
+    serialized = str(soup)
+    version = template_version(html_source, mapping)
+
+    slots: List[Slot] = []
+    parts = _split_markers(serialized, slot_specs, slots)
+    slots.sort(key=lambda slot: slot.index)
+    return CompiledTemplate(template_id, version, parts, slots)
+
+
+def _split_markers(serialized: str, slot_specs: List[Dict[str, Any]], slots: List[Slot]) -> List[Part]:
+    root: List[Part] = []
+    stack: List[List[Part]] = [root]
+    pos = 0
+    length = len(serialized)
+
+    while pos < length:
+        next_open = serialized.find(_SLOT_OPEN, pos)
+        next_end = serialized.find(_SLOT_END, pos)
+        candidates = [i for i in (next_open, next_end) if i != -1]
+        if not candidates:
+            stack[-1].append(serialized[pos:])
+            break
+
+        marker_at = min(candidates)
+        if marker_at > pos:
+            stack[-1].append(serialized[pos:marker_at])
+
+        close_at = serialized.index(_SLOT_CLOSE, marker_at)
+        index = int(serialized[marker_at + 1:close_at])
+
+        if serialized[marker_at] == _SLOT_OPEN:
+            spec = slot_specs[index]
+            slot = Slot(index, spec["element_id"], spec["path"], spec["raw"], [])
+            slots.append(slot)
+            stack[-1].append(slot)
+            stack.append(slot.default)
+        else:
+            stack.pop()
+
+        pos = close_at + 1
+
+    return root
+
+
+def inject_preview_listener(html_source: str) -> str:
+    """html_source with the sitegyn-fragments listener added before the last </body>."""
+    script = _PREVIEW_LISTENER % json.dumps(EDITOR_ORIGINS)
+    at = html_source.lower().rfind("</body>")
+    if at == -1:
+        return html_source + script
+    return html_source[:at] + script + html_source[at:]
+
+
+# ==========================================
+# Registry – one compiled template per template_id
+# ==========================================
+_COMPILED: Dict[str, CompiledTemplate] = {}
+_COMPILE_LOCK = threading.Lock()
+_SOURCES: Dict[str, Tuple[str, Dict[str, str], str]] = {}
+
+
+def load_template_source(template_id: str) -> Optional[Tuple[str, Dict[str, str], str]]:
+    """(html_source, mapping, version) of a template, read from disk once."""
+    source = _SOURCES.get(template_id)
+    if source is not None:
+        return source
+
+    from templates_config import TEMPLATES
+
+    if template_id not in TEMPLATES:
+        return None
+
+    html_source = inject_preview_listener(
+        _resolve_template_path(template_id).read_text(encoding="utf-8")
+    )
+    mapping = _load_template_mapping(template_id)
+    source = (html_source, mapping, template_version(html_source, mapping))
+    _SOURCES[template_id] = source
+    return source
+
+
+def get_compiled_template(template_id: str) -> Optional[CompiledTemplate]:
+    """Return the compiled template, compiling it on first use."""
+    compiled = _COMPILED.get(template_id)
+    if compiled is not None:
+        return compiled
+
+    source = load_template_source(template_id)
+    if source is None:
+        return None
+
+    with _COMPILE_LOCK:
+        compiled = _COMPILED.get(template_id)
+        if compiled is None:
+            html_source, mapping, _ = source
+            compiled = compile_template(template_id, html_source, mapping)
+            _COMPILED[template_id] = compiled
+    return compiled
+
+
+def compile_all_templates() -> Dict[str, CompiledTemplate]:
+    """Compile every template in templates_config.TEMPLATES (call once at startup)."""
+    from templates_config import TEMPLATES
+
+    for template_id in TEMPLATES:
+        get_compiled_template(template_id)
+    return dict(_COMPILED)
@@ -0,0 +1,36 @@
+# tests/conftest.py
+#
+# The modules are flat in the repo root. Every test runs on the in-memory
+# stores (content_patch.LocalPatchStore + content_history.MemoryHistoryStore),
+# so nothing talks to Supabase or OpenAI – the credentials below only have to
+# look valid for the clients created at import time.
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test.test.test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["SITEGYN_LLM_CACHE"] = "0"
+os.environ["SITEGYN_CONTENT_PATCH_BACKEND"] = "local"
+os.environ["SITEGYN_CONTENT_HISTORY"] = "1"
+os.environ["SITEGYN_CONTENT_HISTORY_BACKEND"] = "memory"
+os.environ["SITEGYN_CONTENT_HISTORY_SNAPSHOT_EVERY"] = "3"
+
+
+@pytest.fixture
+def stores(monkeypatch):
+    """Fresh (patch store, history store) for one test."""
+    import content_history
+    import content_patch
+
+    patch_store = content_patch.LocalPatchStore()
+    history_store = content_history.MemoryHistoryStore()
+    monkeypatch.setitem(content_patch._INSTANCES, "local", patch_store)
+    monkeypatch.setitem(content_history._INSTANCES, "memory", history_store)
+    return patch_store, history_store
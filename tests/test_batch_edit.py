@@ -0,0 +1,71 @@
+import pytest
+
+from batch_edit import expand_fields, validate_change
+from content_patch import path_tokens
+
+CAPABILITIES = {
+    "home": {
+        "hero": {
+            "headline": {"ai_edit": True, "inline_edit": True},
+            "kicker": {"ai_edit": False, "inline_edit": True},
+        },
+    },
+    "about": {
+        "paragraphs": {"ai_edit": True, "inline_edit": False, "add_remove": False},
+        "points": {"ai_edit": True, "add_remove": True},
+    },
+    "menu": {
+        "pizzas": {
+            "ai_edit": True,
+            "inline_edit": True,
+            "per_item": {"name": {"ai_edit": True, "inline_edit": True}, "price": {"ai_edit": False, "inline_edit": True}},
+        },
+    },
+}
+
+CONTENT = {
+    "home": {"hero": {"headline": "Hi", "kicker": "k"}},
+    "about": {"paragraphs": ["a", "b"], "points": ["x"]},
+    "menu": {"pizzas": [{"name": "Margherita", "price": "9"}]},
+    "contact": {"title": "Contact"},
+}
+
+REQUESTED = [path_tokens(path) for path in ("home.hero", "about", "menu.pizzas")]
+
+
+@pytest.mark.parametrize("path, value, expected", [
+    ("home.hero.headline", "Hello", None),
+    ("home.hero.kicker", "new", "ai_edit_disabled"),
+    ("contact.title", "Talk to us", "out_of_scope"),
+    ("home.hero.missing", "x", "not_editable"),
+    ("home.hero", "x", "not_editable"),
+    ("home.hero.headline", "", "empty_value"),
+    ("home.hero.headline", "   ", "wrong_type"),
+    ("home.hero.headline", 5, "wrong_type"),
+    ("about.paragraphs", ["only one"], "item_count_changed"),
+    ("about.paragraphs", "not a list", "wrong_type"),
+    ("about.points", ["x", "y"], None),
+    ("about.paragraphs[1]", "B", None),
+    ("about.paragraphs[5]", "B", "index_out_of_range"),
+    ("menu.pizzas", [{"name": "Funghi", "price": "9"}], None),
+    ("menu.pizzas", [{"name": "Funghi", "price": "1"}], "locked_field:price"),
+    ("menu.pizzas[0].name", "Funghi", None),
+    ("menu.pizzas[0].price", "1", "ai_edit_disabled"),
+])
+def test_validate_ai_change(path, value, expected):
+    assert validate_change(CAPABILITIES, CONTENT, REQUESTED, path, value) == expected
+
+
+@pytest.mark.parametrize("path, value, expected", [
+    ("home.hero.kicker", "new", None),
+    ("about.paragraphs[0]", "A", "inline_edit_disabled"),
+    ("menu.pizzas", [{"name": "Margherita", "price": "10"}], None),
+])
+def test_validate_inline_change(path, value, expected):
+    assert validate_change(CAPABILITIES, CONTENT, REQUESTED, path, value, permission="inline_edit") == expected
+
+
+def test_expand_fields_lists_ai_fields_under_a_section():
+    assert expand_fields(CAPABILITIES, "home.hero") == ["home.hero.headline"]
+    assert expand_fields(CAPABILITIES, "about") == ["about.paragraphs", "about.points"]
+    assert expand_fields(CAPABILITIES, "nope") == []
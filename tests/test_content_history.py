@@ -0,0 +1,145 @@
+import pytest
+
+import content_history
+from content_history import document_at, edit_stacks, history_stats, redo, restore, undo
+from content_patch import ContentConflict, apply_content_changes, apply_content_ops
+
+
+def _write_versions(store, count):
+    """count writes to p1 → {version: content_json right after it}."""
+    apply_content_ops("p1", [{"op": "replace", "path": "", "value": {"home": {"title": "v1"}, "n": 1}}])
+    documents = {0: {}, 1: store.load("p1")[0]}
+    for version in range(2, count + 1):
+        changes = {"home.title": f"v{version}"}
+        if version % 2 == 0:
+            changes[f"extra.k{version}"] = version
+        apply_content_changes("p1", changes)
+        documents[version] = store.load("p1")[0]
+    return documents
+
+
+def test_every_write_is_logged(stores):
+    store, history = stores
+    _write_versions(store, 4)
+    rows = history.between("p1", 0, 4)
+    assert [row["version"] for row in rows] == [1, 2, 3, 4]
+    assert [row["kind"] for row in rows] == ["edit"] * 4
+    # SITEGYN_CONTENT_HISTORY_SNAPSHOT_EVERY=3 + the whole-document write
+    assert [row["snapshot"] is not None for row in rows] == [True, False, True, False]
+
+
+def test_same_values_again_is_a_noop(stores):
+    store, history = stores
+    _write_versions(store, 2)
+    apply_content_changes("p1", {"home.title": "v2"})
+    assert history.get("p1", 3)["kind"] == "noop"
+    assert edit_stacks("p1") == ([1, 2], [])
+
+
+# ==========================================
+# Undo / redo stacks
+# ==========================================
+def test_edit_stacks_follow_undo_and_redo(stores):
+    store, _ = stores
+    _write_versions(store, 3)
+    assert edit_stacks("p1") == ([1, 2, 3], [])
+
+    assert undo("p1") == {"content_version": 4, "undone": 3}
+    assert undo("p1") == {"content_version": 5, "undone": 2}
+    assert edit_stacks("p1") == ([1], [3, 2])
+    assert store.load("p1")[0] == {"home": {"title": "v1"}, "n": 1}
+
+    assert redo("p1") == {"content_version": 6, "redone": 2}
+    assert edit_stacks("p1") == ([1, 2], [3])
+    assert store.load("p1")[0]["home"]["title"] == "v2"
+
+
+def test_new_edit_clears_the_redo_stack(stores):
+    store, _ = stores
+    _write_versions(store, 3)
+    undo("p1")
+    apply_content_changes("p1", {"n": 2})
+    assert edit_stacks("p1") == ([1, 2, 5], [])
+    with pytest.raises(ValueError, match="nothing_to_redo"):
+        redo("p1")
+
+
+def test_undo_of_a_field_changed_outside_the_log_conflicts(stores):
+    store, _ = stores
+    _write_versions(store, 2)
+    # written without a history row (e.g. an old service writing content_json)
+    store.apply("p1", [{"op": "replace", "path": "/home/title", "value": "elsewhere"}])
+    with pytest.raises(ContentConflict) as conflict:
+        undo("p1")
+    assert conflict.value.paths == ["/home/title"]
+
+
+# ==========================================
+# document_at / restore
+# ==========================================
+def test_document_at_every_version(stores):
+    store, _ = stores
+    documents = _write_versions(store, 8)
+    current, current_version = store.load("p1")
+    for version, expected in documents.items():
+        assert document_at("p1", version, current, current_version) == expected
+
+
+def _only_after(between, first):
+    def checked(project_id, after, upto):
+        assert after >= first
+        return between(project_id, after, upto)
+    return checked
+
+
+def test_document_at_replays_forward_from_a_snapshot(stores, monkeypatch):
+    store, history = stores
+    documents = _write_versions(store, 8)
+    current, current_version = store.load("p1")
+    # 7 is one row after the snapshot at 6 – the reverse rows must not be read
+    monkeypatch.setattr(history, "between", _only_after(history.between, 6))
+    assert document_at("p1", 7, current, current_version) == documents[7]
+
+
+def test_document_at_replays_backward_from_the_current_document(stores, monkeypatch):
+    store, history = stores
+    documents = _write_versions(store, 8)
+    current, current_version = store.load("p1")
+    # without snapshots only the reverse patches from version 8 can rebuild it
+    monkeypatch.setattr(history, "snapshot_before", lambda project_id, version: None)
+    assert document_at("p1", 2, current, current_version) == documents[2]
+
+
+def test_document_at_with_missing_rows(stores):
+    store, history = stores
+    _write_versions(store, 5)
+    del history.rows["p1"][2]
+    current, current_version = store.load("p1")
+    with pytest.raises(LookupError, match="history_incomplete"):
+        document_at("p1", 2, current, current_version)
+
+
+def test_restore_writes_the_old_document_as_a_new_version(stores):
+    store, history = stores
+    documents = _write_versions(store, 5)
+    restores = history_stats.stats()["restore"]
+
+    assert restore("p1", 2) == {"content_version": 6, "restored": 2}
+    assert store.load("p1") == (documents[2], 6)
+    assert history.get("p1", 6)["kind"] == "restore"
+    assert history.get("p1", 6)["ref_version"] == 2
+    assert edit_stacks("p1") == ([1, 2, 3, 4, 5, 6], [])
+    assert history_stats.stats()["restore"] == restores + 1
+
+
+@pytest.mark.parametrize("version", [True, -1, 99, "2", 2.0])
+def test_restore_rejects_unknown_versions(stores, version):
+    store, _ = stores
+    _write_versions(store, 3)
+    with pytest.raises(ValueError, match="unknown_version"):
+        restore("p1", version)
+
+
+def test_history_store_is_abstract():
+    with pytest.raises(TypeError):
+        content_history.HistoryStore()
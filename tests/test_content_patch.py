@@ -0,0 +1,125 @@
+import copy
+
+import pytest
+
+from content_patch import (
+    ContentConflict,
+    ContentPatchStore,
+    HistoryLog,
+    apply_content_changes,
+    apply_content_ops,
+    apply_patch,
+    changes_to_patch,
+    diff_patch,
+    patch_stats,
+    reverse_patch,
+)
+
+BEFORE = {
+    "home": {"hero": {"headline": "Hi", "kicker": "k"}},
+    "about": {"paragraphs": ["a", "b", "c"]},
+    "contact": {"phone": "123"},
+}
+
+
+# ==========================================
+# reverse_patch
+# ==========================================
+@pytest.mark.parametrize("ops", [
+    [{"op": "replace", "path": "/home/hero/headline", "value": "Hello"}],
+    [{"op": "add", "path": "/home/hero/subheadline", "value": "new"}],
+    [{"op": "add", "path": "/offers/deals/0/name", "value": "created parents"}],
+    [{"op": "remove", "path": "/contact/phone"}],
+    [{"op": "replace", "path": "/about/paragraphs/1", "value": "B"}],
+    [{"op": "add", "path": "/about/paragraphs/3", "value": "appended"}],
+    [{"op": "remove", "path": "/about/paragraphs/0"}],
+    [
+        {"op": "replace", "path": "/home/hero/headline", "value": "one"},
+        {"op": "replace", "path": "/home/hero/headline", "value": "two"},
+        {"op": "remove", "path": "/home/hero/kicker"},
+    ],
+    [{"op": "replace", "path": "", "value": {"home": {"hero": {"headline": "whole"}}}}],
+])
+def test_reverse_patch_restores_the_document(ops):
+    after = apply_patch(copy.deepcopy(BEFORE), ops)
+    undo = reverse_patch(BEFORE, ops)
+    assert apply_patch(after, undo) == BEFORE
+
+
+def test_reverse_patch_of_unchanged_values_is_empty():
+    ops = [{"op": "replace", "path": "/home/hero/headline", "value": "Hi"}]
+    assert reverse_patch(BEFORE, ops) == []
+
+
+# ==========================================
+# diff_patch
+# ==========================================
+@pytest.mark.parametrize("after", [
+    BEFORE,
+    {"home": {"hero": {"headline": "Hi", "kicker": "k2"}}, "about": {"paragraphs": ["a", "b", "c"]}},
+    {**BEFORE, "about": {"paragraphs": ["a", "x", "c"]}},
+    {**BEFORE, "about": {"paragraphs": ["only one"]}},
+    {**BEFORE, "offers": {"deals": [{"name": "new"}]}},
+])
+def test_diff_patch_turns_a_into_b(after):
+    assert apply_patch(copy.deepcopy(BEFORE), diff_patch(BEFORE, after)) == after
+
+
+def test_diff_patch_is_minimal():
+    after = copy.deepcopy(BEFORE)
+    after["about"]["paragraphs"][1] = "x"
+    assert diff_patch(BEFORE, after) == [{"op": "replace", "path": "/about/paragraphs/1", "value": "x"}]
+
+
+# ==========================================
+# Compare-and-swap + rebase
+# ==========================================
+def test_write_on_current_version(stores):
+    store, _ = stores
+    apply_content_ops("p1", [{"op": "replace", "path": "", "value": BEFORE}])
+    base, base_version = store.load("p1")
+
+    apply_content_changes("p1", {"home.hero.headline": "Hello"}, base=base, expected_version=base_version)
+    assert store.load("p1") == ({**BEFORE, "home": {"hero": {"headline": "Hello", "kicker": "k"}}}, 2)
+
+
+def test_stale_write_is_rebased_when_its_paths_are_untouched(stores):
+    store, _ = stores
+    apply_content_ops("p1", [{"op": "replace", "path": "", "value": BEFORE}])
+    base, base_version = store.load("p1")
+
+    # someone else writes another field in between
+    apply_content_changes("p1", {"contact.phone": "999"})
+    rebased = patch_stats.stats()["rebased"]
+
+    apply_content_changes("p1", {"home.hero.headline": "Hello"}, base=base, expected_version=base_version)
+    content, version = store.load("p1")
+    assert version == 3
+    assert content["home"]["hero"]["headline"] == "Hello"
+    assert content["contact"]["phone"] == "999"
+    assert patch_stats.stats()["rebased"] == rebased + 1
+
+
+def test_stale_write_of_a_changed_path_conflicts(stores):
+    store, _ = stores
+    apply_content_ops("p1", [{"op": "replace", "path": "", "value": BEFORE}])
+    base, base_version = store.load("p1")
+
+    apply_content_changes("p1", {"home.hero.headline": "Theirs"})
+
+    with pytest.raises(ContentConflict) as conflict:
+        apply_content_changes("p1", {"home.hero.headline": "Mine"}, base=base, expected_version=base_version)
+    assert conflict.value.paths == ["/home/hero/headline"]
+    assert store.load("p1") == ({**BEFORE, "home": {"hero": {"headline": "Theirs", "kicker": "k"}}}, 2)
+
+
+def test_changes_to_patch_uses_pointers():
+    assert changes_to_patch({"about.paragraphs[1]": "B"}) == [
+        {"op": "replace", "path": "/about/paragraphs/1", "value": "B"},
+    ]
+
+
+@pytest.mark.parametrize("base", [ContentPatchStore, HistoryLog])
+def test_extension_points_are_abstract(base):
+    with pytest.raises(TypeError):
+        base()
@@ -0,0 +1,43 @@
+import pytest
+
+from update_parser import UPDATE_FIELDS, parse_update, update_repair_stats
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('ok <update>{"niche": "pizza"}</update>', {"niche": "pizza"}),
+    ('<update>\n```json\n{"niche": "pizza"}\n```\n</update>', {"niche": "pizza"}),
+    ('done.\n<update>{"niche": "pizza"}', {"niche": "pizza"}),
+    ("<update>{'niche': 'pizza', 'city': \"Tel Aviv\"}</update>", {"niche": "pizza", "city": "Tel Aviv"}),
+    ('<update>{"a": True, "b": None, "c": "None"}</update>', {"a": True, "b": None, "c": "None"}),
+    ('<update>{"a": [1, 2,], "b": "x,}",}</update>', {"a": [1, 2], "b": "x,}"}),
+])
+def test_repairs(text, expected):
+    assert parse_update(text, record=False) == expected
+
+
+def test_dotted_keys_are_nested_under_object_fields():
+    text = '<update>{"content_json.home.title": "Home", "niche": "pizza", "a.b": 1}</update>'
+    assert parse_update(text, fields=UPDATE_FIELDS, record=False) == {
+        "content_json": {"home": {"title": "Home"}},
+        "niche": "pizza",
+        "a.b": 1,
+    }
+
+
+@pytest.mark.parametrize("text", [
+    "no block here",
+    'an example: ```json\n{"niche": "pizza"}\n```',
+    '<update>{"content_json": {"home": {"title": "cut o',
+    "<update>not json at all</update>",
+    '<update>["a", "list"]</update>',
+])
+def test_no_usable_block(text):
+    assert parse_update(text, record=False) == {}
+
+
+def test_repairs_are_counted():
+    before = update_repair_stats.stats()
+    parse_update("<update>{'a': 1,}</update>")
+    after = update_repair_stats.stats()
+    assert after["repaired"] == before.get("repaired", 0) + 1
+    assert after["repair:single_quotes"] == before.get("repair:single_quotes", 0) + 1
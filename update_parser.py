@@ -0,0 +1,244 @@
+# update_parser.py
+#
+# Tolerant parser for <update>{...}</update> blocks.
+#
+# When the JSON inside <update> did not parse, /api/chat used to make a whole
+# second OpenAI call asking the model to resend it. Most broken blocks can be
+# fixed locally, so these repairs are tried first (each one only if the
+# previous attempt still does not parse):
+#
+#   code_fence         ```json ... ``` inside the tags
+#   missing_close_tag  "<update>{..." without "</update>" (reply cut off)
+#   single_quotes      {'a': 'b'} → {"a": "b"}
+#   python_literals    True / False / None → true / false / null
+#   trailing_comma     {"a": 1,} / [1, 2,]
+#
+# A reply cut off mid-JSON is NOT closed up: whatever is missing would be
+# written as if it were the whole value (a partial content_json replaces the
+# site). It counts as failed and the caller falls back to the repair call.
+# Without <update> tags there is no block – a ```json example in an ordinary
+# chat reply is not an update.
+#
+# and, for the chat update (fields=UPDATE_FIELDS), a schema-guided reshape:
+#
+#   dotted_keys        {"pages_json.home.title": "Home"} →
+#                      {"pages_json": {"home": {"title": "Home"}}}
+#                      (only under fields that are objects in the schema)
+#
+# update_repair_stats counts every repair, how many blocks parsed strictly,
+# how many were saved by a repair (= LLM round trips saved) and how often
+# the caller still had to fall back to the repair completion.
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+UPDATE_OPEN = "<update>"
+UPDATE_CLOSE = "</update>"
+
+# fields of the chat <update> block (sitegyn_system_prompt.txt, UPDATE BLOCK FORMAT)
+UPDATE_FIELDS = (
+    "business_name",
+    "business_type",
+    "niche",
+    "city",
+    "country",
+    "site_language",
+    "main_goal",
+    "primary_color",
+    "style_keywords",
+    "subdomain",
+    "pages_json",
+    "content_json",
+    "selected_template_id",
+)
+# fields whose value is a JSON object – dotted keys under them are reshaped
+OBJECT_FIELDS = ("pages_json", "content_json")
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL_RE = re.compile(r"\b(True|False|None)\b")
+
+
+class RepairStats:
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+update_repair_stats = RepairStats()
+
+
+# ==========================================
+# Text helpers – edits only outside JSON strings
+# ==========================================
+def _map_outside_strings(raw: str, fn: Callable[[str], str]) -> str:
+    """Apply fn to every part of raw that is not inside a "double quoted" string."""
+    out: List[str] = []
+    segment_start = 0
+    i = 0
+    while i < len(raw):
+        if raw[i] == '"':
+            out.append(fn(raw[segment_start:i]))
+            end = i + 1
+            while end < len(raw) and raw[end] != '"':
+                end += 2 if raw[end] == "\\" else 1
+            out.append(raw[i:end + 1])
+            i = segment_start = end + 1
+        else:
+            i += 1
+    out.append(fn(raw[segment_start:]))
+    return "".join(out)
+
+
+def _single_to_double_quotes(raw: str) -> str:
+    out: List[str] = []
+    i = 0
+    while i < len(raw):
+        ch = raw[i]
+        if ch == '"':
+            end = i + 1
+            while end < len(raw) and raw[end] != '"':
+                end += 2 if raw[end] == "\\" else 1
+            out.append(raw[i:end + 1])
+            i = end + 1
+        elif ch == "'":
+            value: List[str] = []
+            i += 1
+            while i < len(raw) and raw[i] != "'":
+                if raw[i] == "\\" and i + 1 < len(raw):
+                    value.append(raw[i + 1] if raw[i + 1] == "'" else raw[i:i + 2])
+                    i += 2
+                    continue
+                value.append('\\"' if raw[i] == '"' else raw[i])
+                i += 1
+            out.append('"' + "".join(value) + '"')
+            i += 1
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def _loads(raw: str) -> Tuple[bool, Any]:
+    try:
+        return True, json.loads(raw)
+    except ValueError:
+        return False, None
+
+
+# ==========================================
+# Block extraction
+# ==========================================
+def _extract(text: str, repairs: List[str]) -> Optional[str]:
+    start = text.find(UPDATE_OPEN)
+    if start == -1:
+        return None
+
+    end = text.find(UPDATE_CLOSE, start)
+    if end == -1:
+        repairs.append("missing_close_tag")
+        raw = text[start + len(UPDATE_OPEN):]
+    else:
+        raw = text[start + len(UPDATE_OPEN):end]
+    raw = raw.strip()
+
+    if raw.startswith("```"):
+        match = _FENCE_RE.match(raw)
+        if match:
+            repairs.append("code_fence")
+            raw = match.group(1).strip()
+    return raw
+
+
+def _repair_json(raw: str, repairs: List[str]) -> Tuple[bool, Any]:
+    ok, value = _loads(raw)
+    if ok:
+        return ok, value
+
+    fixes: List[Tuple[str, Callable[[str], str]]] = [
+        ("single_quotes", _single_to_double_quotes),
+        ("python_literals", lambda s: _map_outside_strings(s, lambda part: _PY_LITERAL_RE.sub(
+            lambda m: _PY_LITERALS[m.group(1)], part))),
+        ("trailing_comma", lambda s: _map_outside_strings(s, lambda part: _TRAILING_COMMA_RE.sub(r"\1", part))),
+    ]
+    for name, fix in fixes:
+        fixed = fix(raw)
+        if fixed == raw:
+            continue
+        raw = fixed
+        repairs.append(name)
+        ok, value = _loads(raw)
+        if ok:
+            return ok, value
+
+    return False, None
+
+
+def _nest_dotted_keys(obj: Dict[str, Any], fields: Tuple[str, ...], repairs: List[str]) -> Dict[str, Any]:
+    for key in [k for k in obj if "." in k]:
+        head, _, rest = key.partition(".")
+        if head not in fields or head not in OBJECT_FIELDS or not rest:
+            continue
+        value = obj.pop(key)
+        target = obj.get(head)
+        if not isinstance(target, dict):
+            target = obj[head] = {}
+        parts = rest.split(".")
+        for part in parts[:-1]:
+            child = target.get(part)
+            if not isinstance(child, dict):
+                child = target[part] = {}
+            target = child
+        target[parts[-1]] = value
+        if "dotted_keys" not in repairs:
+            repairs.append("dotted_keys")
+    return obj
+
+
+# ==========================================
+# Public API
+# ==========================================
+def parse_update(
+    text: str,
+    fields: Optional[Tuple[str, ...]] = None,
+    record: bool = True,
+) -> Dict[str, Any]:
+    """
+    JSON object of the <update> block in text ({} if there is none / it
+    cannot be repaired). fields → reshape dotted keys of the chat update.
+    record=False → do not count (e.g. when only validating a reply).
+    """
+    repairs: List[str] = []
+    raw = _extract(text or "", repairs)
+    if raw is None:
+        if record:
+            update_repair_stats.record("no_block")
+        return {}
+
+    ok, value = _repair_json(raw, repairs) if raw else (True, {})
+    if not ok or not isinstance(value, dict):
+        if record:
+            update_repair_stats.record("failed")
+        return {}
+
+    if fields:
+        value = _nest_dotted_keys(value, fields, repairs)
+
+    if record:
+        update_repair_stats.record("repaired" if repairs else "strict")
+        for name in repairs:
+            update_repair_stats.record(f"repair:{name}")
+    return value
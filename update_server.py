@@ -1,11 +1,15 @@
 import os
-import json
 import traceback
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from openai import OpenAI
+from supabase import Client
+from llm_cache import cached_completion, cache_bypass_requested
+from update_parser import parse_update
+from service_clients import get_openai, get_supabase
+from content_patch import ContentConflict, apply_content_changes
+from batch_edit import batch_edit
+import content_history  # noqa: F401 – every write goes to the undo log
 
 # ==========================================
 # Load environment
@@ -22,8 +26,9 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
 if not OPENAI_API_KEY:
     raise RuntimeError("Missing OpenAI API key")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-client = OpenAI(api_key=OPENAI_API_KEY)
+# משותפים לכל השירותים: pool, timeouts ו-retries (service_clients)
+supabase: Client = get_supabase()
+client = get_openai()
 
 # ==========================================
 # Load editor prompt
@@ -43,19 +48,18 @@ CORS(app)
 # Helpers
 # ==========================================
 def parse_update_block(text):
+    # תיקונים מקומיים ל-JSON שבור (פסיקים, גדרות קוד, סוגר חסר...) – update_parser
     try:
-        start = text.find("<update>")
-        end = text.find("</update>")
-        if start == -1 or end == -1:
-            return None
-
-        raw = text[start + 8:end].strip()
-        return json.loads(raw)
+        return parse_update(text) or None
     except:
         traceback.print_exc()
         return None
 
 
+def has_update_block(text):
+    return bool(parse_update(text, record=False))
+
+
 def get_value_by_path(obj, path):
     if not path:
         return ""
@@ -70,17 +74,6 @@ def get_value_by_path(obj, path):
     return curr
 
 
-def set_value_by_path(obj, path, value):
-
-    keys = path.split(".")
-    curr = obj
-
-    for k in keys[:-1]:
-        curr = curr.setdefault(k, {})
-
-    curr[keys[-1]] = value
-
-
 # ==========================================
 # Health
 # ==========================================
@@ -113,9 +106,10 @@ def update_field():
         # Load project
         # ==========================================
 
+        # "*" – כולל content_version (compare-and-swap) אם העמודה קיימת
         project = (
             supabase.table("projects")
-            .select("content_json")
+            .select("*")
             .eq("id", project_id)
             .single()
             .execute()
@@ -147,17 +141,19 @@ def update_field():
         # Call OpenAI
         # ==========================================
 
-        completion = client.chat.completions.create(
+        # temperature=0 → אותה בקשה שוב (rewrite / retry) נענית מ-llm_cache
+        assistant_text = cached_completion(
+            client,
             model="gpt-4.1-mini",
             messages=[{
                 "role": "user",
                 "content": prompt
             }],
-            temperature=0
+            temperature=0,
+            bypass=cache_bypass_requested(request.headers),
+            validate=has_update_block,
         )
 
-        assistant_text = completion.choices[0].message.content
-
         update_obj = parse_update_block(assistant_text)
 
         if not update_obj:
@@ -172,6 +168,7 @@ def update_field():
         # Apply changes
         # ==========================================
 
+        updates = []
         for change in changes:
 
             path = change.get("path")
@@ -183,18 +180,18 @@ def update_field():
             if value is None or value == "":
                 continue
 
-            set_value_by_path(content_json, path, value)
+            updates.append((path, value))
 
         # ==========================================
-        # Save to Supabase
+        # Save to Supabase – JSON Patch של השדות בלבד (content_patch)
         # ==========================================
 
-        supabase.table("projects") \
-            .update({
-                "content_json": content_json
-            }) \
-            .eq("id", project_id) \
-            .execute()
+        apply_content_changes(
+            project_id,
+            updates,
+            base=content_json,
+            expected_version=project.get("content_version"),
+        )
 
         return jsonify({
             "status": "ok",
@@ -202,6 +199,38 @@ def update_field():
             "value": changes[0]["value"] if changes else None
         })
 
+    except ContentConflict as e:
+        # השדה השתנה בינתיים (טאב / worker אחר) – אין דריסה שקטה
+        return jsonify({"error": "content_conflict", "paths": e.paths}), 409
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+# ==========================================
+# Update Fields – several fields, one instruction (batch_edit)
+# ==========================================
+@app.route("/api/update-fields", methods=["POST"])
+def update_fields():
+
+    try:
+        data = request.get_json(force=True)
+
+        # prompt אחד עם כל הערכים, completion אחד, כתיבה אחת
+        result = batch_edit(
+            supabase,
+            client,
+            data,
+            bypass_cache=cache_bypass_requested(request.headers),
+        )
+        return jsonify(result), 200 if result["changes"] else 422
+
+    except ContentConflict as e:
+        return jsonify({"error": "content_conflict", "paths": e.paths}), 409
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500